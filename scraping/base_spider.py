@@ -4,16 +4,51 @@ of the spider's lifetime (e.g. when spider is being closed, we might want to sto
 log messages.
 """
 
+import collections
+import os
+import random
+import signal
 import time
 import scrapy
 import scrapy.signals as signals
 from multiprocessing import Process, Queue
+import scraping.support.cache_helper as cache_helper
+import scraping.support.host_cache_helper as host_cache_helper
 import scraping.support.log_helper as lg
+import scraping.support.manifest_helper as manifest_helper
 import scrapy.crawler as crawler
-import twisted.internet.reactor as reactor
+from scrapy.exceptions import IgnoreRequest
+from scrapy.spidermiddlewares.httperror import HttpError
+from twisted.internet import task  # not the reactor - it is imported where used, see FORKSERVER_PRELOAD in run.py
+
+from scraping.support.common import *
+
+
+# kinds of errors for which a request is retried, and how many times at most (per request). Browser and parse errors
+# are only retried when asked for (run.py -r, see get_retry_settings) - network errors as by Scrapy's RetryMiddleware
+DEF_URL_RETRY_BUDGETS = {
+    'network': 2,  # download errors and HTTP codes in RETRY_HTTP_CODES
+    'selenium': 0,  # browser errors, e.g. timeouts waiting for an element
+    'parse': 0  # errors extracting data from the response
+}
+RETRY_HTTP_CODES = (408, 429, 500, 502, 503, 504, 522, 524)
 
 
 class BaseSpider(scrapy.Spider):
+    # set to False in spiders which should always download and extract everything (see _cached_request)
+    use_response_cache = True
+
+    # set to True in long-running spiders whose pending requests should survive a restart of the run (see JOBDIR in
+    # get_run_settings). Their requests must be serializable - callbacks and errbacks being methods of the spider
+    persist_frontier = False
+
+    # limits of the spider's process tree in the super parallel mode (see run.py), if other than the default ones
+    time_limit = None  # s
+    max_rss = None  # MB
+
+    # arguments of the spider's __init__ which jobs of the scraping daemon may pass (see daemon.py) - name -> type
+    job_args = {}
+
     def __init__(self, err_queue=None):
         super().__init__()
 
@@ -21,15 +56,161 @@ class BaseSpider(scrapy.Spider):
 
         self._logger = lg.get_logger(self.name)
 
+        self._retries = collections.Counter()  # kind of error -> number of retries
+        self._gave_up = collections.Counter()  # kind of error -> number of requests failed with no retries left
+        self._cache_stats = collections.Counter()  # 'hits' and 'misses' of the response cache
+        self._errors = 0
+        self._close_reason = None
+
     def _log_err(self, err_msg):
         """
         Use this method to log an error - other than printing the error, it is also stored in the error queue, which
         is e.g. monitored when running the spider using the "retry on error" mode (see function below)
         """
         err = Exception('Exception occured in {}: {}'.format(self.name, err_msg))
+        self._errors += 1
         self._err_queue.put(err)
         self._logger.error(err_msg)
 
+    def _errback(self, failure):
+        """Errback for the spider's requests. Network errors are retried (see _retry_request), others are logged"""
+        request = getattr(failure, 'request', None)
+
+        if request is not None and self.__is_retryable(failure):
+            retry = self._retry_request(request, 'network', failure.getErrorMessage())
+            if retry is not None:
+                return self._with_backoff([retry])
+
+        return self._request_failed(request, 'Request ended up in error: {}'.format(failure)) or []
+
+    def _request_failed(self, request, err_msg):
+        """
+        Called when the request failed for good (i.e. no retries left). request may be None. May return the requests
+        to issue instead of the failed one
+        """
+        self._log_err(err_msg)
+
+    def __is_retryable(self, failure):
+        if failure.check(HttpError):
+            return failure.value.response.status in RETRY_HTTP_CODES
+
+        return not failure.check(IgnoreRequest)
+
+    def _retry_request(self, request, kind, reason):
+        """
+        Returns a copy of the request to be issued again, or None if the request used up its retry budget for this
+        kind of error (see URL_RETRY_BUDGETS setting). Only this request is retried - not the whole spider.
+
+        The returned request should be passed through _with_backoff, which delays it.
+        """
+        budgets = self.settings.getdict('URL_RETRY_BUDGETS', DEF_URL_RETRY_BUDGETS)
+        retries = dict(request.meta.get('url_retries', {}))
+        if retries.get(kind, 0) >= budgets.get(kind, 0):
+            self._gave_up[kind] += 1
+            return None
+
+        retries[kind] = retries.get(kind, 0) + 1
+        self._retries[kind] += 1
+
+        # exponential backoff with (full) jitter
+        max_delay = min(self.settings.getfloat('URL_RETRY_MAX_DELAY', 60),
+                        self.settings.getfloat('URL_RETRY_BASE_DELAY', 2) * 2 ** sum(retries.values()))
+        delay = random.uniform(0, max_delay)
+
+        self._logger.warning('Retrying {} in {:.1f}s ({} error, retry {}/{}): {}'.format(
+            request.url, delay, kind, retries[kind], budgets[kind], reason))
+
+        retry = request.replace(dont_filter=True)
+        retry.meta['url_retries'] = retries
+        retry.meta['url_retry_delay'] = delay
+
+        return retry
+
+    def _with_backoff(self, requests):
+        """
+        Returns the requests as they are if none of them is a retry. Otherwise returns a Deferred firing with them
+        once the retry delay passed. Must be called from the reactor thread.
+        """
+        from twisted.internet import reactor
+
+        delay = max([r.meta.get('url_retry_delay', 0) for r in requests] + [0])
+        if delay == 0:
+            return requests
+
+        for r in requests:
+            r.meta.pop('url_retry_delay', None)
+
+        return task.deferLater(reactor, delay, lambda: requests)
+
+    # ---------------------------------------------------------------------
+    # --- Response cache
+    # ---------------------------------------------------------------------
+
+    def __response_cache(self):
+        if not self.use_response_cache or not self.settings.getbool('RESPONSE_CACHE_ENABLED', True):
+            return None
+
+        return cache_helper.get_response_cache(self.settings)
+
+    def _cached_request(self, url, cache_key, **kwargs):
+        """
+        Creates a request whose extracted result can be cached under the given key (see _cached_result and
+        _cache_result). If a result is cached already, the request is conditional (If-None-Match/If-Modified-Since).
+        """
+        cache = self.__response_cache()
+        if cache is None:
+            return scrapy.Request(url=url, **kwargs)
+
+        headers = dict(kwargs.pop('headers', {}), **cache.conditional_headers(cache_key))
+        meta = dict(kwargs.pop('meta', {}), response_cache_key=cache_key, handle_httpstatus_list=[304])
+
+        return scrapy.Request(url=url, headers=headers, meta=meta, **kwargs)
+
+    def _cached_result(self, response, size=None):
+        """
+        Returns the result cached for the response if the page did not change (304 or same body), otherwise None.
+        If None is returned for a 304 response, the page must be re-requested with _unconditional_request. With size,
+        a cached result (list) of another length is not returned either
+        """
+        cache = self.__response_cache()
+        key = response.meta.get('response_cache_key')
+        if cache is None or key is None:
+            return None
+
+        result = cache.lookup(key, response)
+        if result is not None and size is not None and len(result) != size:
+            result = None
+        self._cache_stats['hits' if result is not None else 'misses'] += 1
+
+        return result
+
+    def _cache_result(self, response, result):
+        """Caches the result extracted from the response, if the response was requested with _cached_request"""
+        cache = self.__response_cache()
+        key = response.meta.get('response_cache_key')
+        if cache is not None and key is not None and response.status == 200:
+            cache.store(key, response, result)
+
+    def _unconditional_request(self, request):
+        headers = {k: v for k, v in request.headers.items() if k not in (b'If-None-Match', b'If-Modified-Since')}
+        meta = {k: v for k, v in request.meta.items() if k != 'response_cache_key'}
+
+        return request.replace(headers=headers, meta=meta, dont_filter=True)
+
+    def _defer_to_parse_process(self, f, response, *args):
+        """
+        Returns a Deferred firing with f(response.body, *args), called in the parse process pool. Only to be used when
+        the PARSE_IN_PROCESS_POOL setting is on (see _parse_in_process_pool)
+        """
+        # imported only when used - it needs Python 3.8+ (multiprocessing.shared_memory)
+        import scraping.support.process_pool_helper as process_pool_helper
+
+        return process_pool_helper.defer_to_parse_process(
+            f, response.body, *args, processes=self.settings.getint('PARSE_PROCESSES'))
+
+    def _parse_in_process_pool(self):
+        return self.settings.getbool('PARSE_IN_PROCESS_POOL', False)
+
     def __spider_error(self, failure, response):
         err_msg = "Error on {0}, traceback: {1}".format(response.url, failure.getTraceback())
         self._log_err(err_msg)
@@ -38,15 +219,55 @@ class BaseSpider(scrapy.Spider):
         self._start_time = time.time()
         self._logger.info('Starting {}'.format(self.name))
 
+        if self.settings.get('RUN_ID'):
+            manifest_helper.get_manifest().set_state(self.settings['RUN_ID'], self.name, manifest_helper.RUNNING)
+
     def _spider_closed(self):
         pass
 
-    def __spider_closed(self):
+    def _run_result(self):
+        """Override to return a short summary of the results, recorded in the run manifest"""
+        return None
+
+    def __spider_closed(self, reason):
+        self._close_reason = reason
         self._spider_closed()
 
         self._store_results()
 
-        self._logger.info('Finished {0}. Execution took: {1:.2f}s'.format(self.name, time.time() - self._start_time))
+        if self.settings.get('RUN_ID'):
+            if reason != 'finished':
+                state, result = manifest_helper.KILLED, 'closed: {}'.format(reason)
+            elif self._errors > 0:
+                state, result = manifest_helper.FAILED, '{} errors, result: {}'.format(self._errors, self._run_result())
+            else:
+                state, result = manifest_helper.DONE, self._run_result()
+
+            if len(self._retries) > 0 or len(self._gave_up) > 0:
+                result = '{}; {}'.format(result, self._retry_summary())
+
+            manifest_helper.get_manifest().set_state(self.settings['RUN_ID'], self.name, state, result)
+
+        self._logger.info('Finished {0}. Execution took: {1:.2f}s. {2}'.format(
+            self.name, time.time() - self._start_time, self._retry_summary()))
+
+        if len(self._cache_stats) > 0:
+            self._logger.info('Response cache of {0}: {1} hits, {2} misses'.format(
+                self.name, self._cache_stats['hits'], self._cache_stats['misses']))
+
+        self._logger.info('Robots.txt and DNS caches of the process: {}'.format(
+            host_cache_helper.get_stats(self.settings)))
+
+    def _retry_summary(self):
+        """Retries consumed and requests given up on, per kind of error - recorded in the run manifest (see run.py)"""
+        def _per_kind(counter):
+            if len(counter) == 0:
+                return '0'
+
+            return '{} ({})'.format(sum(counter.values()), ', '.join(
+                ['{} {}'.format(kind, count) for kind, count in sorted(counter.items())]))
+
+        return 'retries: {}, gave up: {}'.format(_per_kind(self._retries), _per_kind(self._gave_up))
 
     def _store_results(self):
         """Override to store results at this point"""
@@ -71,9 +292,46 @@ class BaseSpider(scrapy.Spider):
             'USER_AGENT': 'my_test_spider',
             'LOG_ENABLED': False,
             'BOT_NAME': 'my_test_bot',
-            'ROBOTSTXT_OBEY': True
+            'ROBOTSTXT_OBEY': True,
+            'ROBOTSTXT_CACHE_TTL': 24 * 3600,  # robots.txt and DNS are cached on disk, see host_cache_helper
+            'DNS_CACHE_TTL': 3600,
+            'DOWNLOADER_MIDDLEWARES': {
+                'scrapy.downloadermiddlewares.robotstxt.RobotsTxtMiddleware': None,
+                'scraping.support.host_cache_helper.DiskCachedRobotsTxtMiddleware': 100
+            },
+            'RETRY_ENABLED': False,  # requests are retried by the spider itself, see _retry_request
+            'URL_RETRY_BUDGETS': DEF_URL_RETRY_BUDGETS,
+            'URL_RETRY_BASE_DELAY': 2,
+            'URL_RETRY_MAX_DELAY': 60,
+            'RESPONSE_CACHE_ENABLED': True,
+            'RESPONSE_CACHE_TTL': 7 * 24 * 3600,
+            'RESPONSE_CACHE_MAX_BYTES': 50 * 1024 * 1024,
+            'PARSE_IN_PROCESS_POOL': False,  # parse responses in a pool of processes, see process_pool_helper
+            'PARSE_PROCESSES': os.cpu_count()
         }
 
+    @classmethod
+    def get_retry_settings(cls, trials):
+        """Settings for trying each request at most `trials` times, for every kind of error"""
+        return {'URL_RETRY_BUDGETS': {kind: trials - 1 for kind in DEF_URL_RETRY_BUDGETS}}
+
+    @classmethod
+    def uses_browser(cls):
+        """Whether the spider drives a browser (Selenium) - such spiders are heavy, and scheduled accordingly"""
+        return False
+
+    @classmethod
+    def get_run_settings(cls, run_id, resumed=False):
+        """
+        Settings for running the spider as a part of the run run_id of run.py (see manifest_helper). resumed is True
+        if the run is being resumed
+        """
+        settings = {'RUN_ID': run_id, 'RUN_RESUMED': resumed}
+        if cls.persist_frontier:
+            settings['JOBDIR'] = from_data_root('runs/jobs/{}/{}'.format(run_id, cls.name), create_if_needed=True)
+
+        return settings
+
     @classmethod
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super(BaseSpider, cls).from_crawler(crawler, *args, **kwargs)
@@ -89,32 +347,111 @@ class BaseSpider(scrapy.Spider):
     # ---------------------------------------------------------------------
 
     _multiple_mode_runners = []
+    _shared_runner = None
+    keep_reactor_running = False  # e.g. in the scraping daemon, which runs spiders as jobs come
 
     @classmethod
     def setup_for_multiple_exec(cls, settings, *init_args, **init_kwargs):
         """
         Use this when you want to execute more spiders. This will only setup an execution of the spider,
-        but will not actually start it. The execution must be explicitly triggered with start_execution
+        but will not actually start it. The execution must be explicitly triggered with start_execution.
+        Returns a Deferred firing when the spider finished
         """
+        host_cache_helper.install_resolver(settings)
+
         runner = crawler.CrawlerRunner(settings)
         cls._multiple_mode_runners.append(runner)
         deferred = runner.crawl(cls, *init_args, **init_kwargs)
 
-        def _spider_finished(runner):
-            cls._multiple_mode_runners.remove(runner)
-            if len(cls._multiple_mode_runners) == 0:
-                reactor.stop()
+        deferred.addBoth(lambda _: cls._runner_finished(runner))
+
+        return deferred
+
+    @classmethod
+    def setup_for_shared_exec(cls, settings, *init_args, **init_kwargs):
+        """
+        Same as setup_for_multiple_exec, but all the spiders set up this way are scheduled by one runner and share one
+        concurrency budget (global and per domain) and one pool of HTTP connections - see get_shared_settings.
+
+        Use this to run many spiders in one process.
+        """
+        shared_settings = BaseSpider.get_shared_settings()
+        spider_settings = dict(shared_settings)
+        spider_settings.update(settings)  # the spider's own settings (e.g. download delay) take precedence
+        for key in ('DOWNLOADER_MIDDLEWARES', 'DOWNLOAD_HANDLERS'):
+            spider_settings[key] = dict(shared_settings[key], **settings.get(key, {}))
+
+        host_cache_helper.install_resolver(spider_settings)
+
+        if BaseSpider._shared_runner is None:
+            BaseSpider._shared_runner = crawler.CrawlerRunner(shared_settings)
+            cls._multiple_mode_runners.append(BaseSpider._shared_runner)
+
+        runner = BaseSpider._shared_runner
+        deferred = runner.crawl(crawler.Crawler(cls, spider_settings), *init_args, **init_kwargs)
+
+        deferred.addBoth(lambda _: len(runner.crawlers) == 0 and cls._runner_finished(runner))
+
+        return deferred
+
+    @classmethod
+    def get_shared_settings(cls):
+        """Settings applied to all spiders run with setup_for_shared_exec"""
+        return {
+            'SHARED_CONCURRENT_REQUESTS': 64,  # across all the spiders
+            'SHARED_CONCURRENT_REQUESTS_PER_DOMAIN': 8,  # across all the spiders
+            'CONCURRENT_REQUESTS_PER_IP': 8,  # enforced by Scrapy per spider - not shared like the two above
+            'DNSCACHE_ENABLED': True,
+            'REACTOR_THREADPOOL_MAXSIZE': 20,  # DNS resolution happens in the reactor thread pool
+            'DOWNLOADER_MIDDLEWARES': {
+                'scraping.support.concurrency_helper.SharedBudgetMiddleware': 950
+            },
+            'DOWNLOAD_HANDLERS': {
+                'http': 'scraping.support.concurrency_helper.SharedPoolDownloadHandler',
+                'https': 'scraping.support.concurrency_helper.SharedPoolDownloadHandler'
+            }
+        }
+
+    @classmethod
+    def _runner_finished(cls, runner):
+        from twisted.internet import reactor
+
+        cls._multiple_mode_runners.remove(runner)
+        if runner is BaseSpider._shared_runner:
+            BaseSpider._shared_runner = None
 
-        deferred.addBoth(lambda _: _spider_finished(runner))
+        if len(cls._multiple_mode_runners) == 0 and not BaseSpider.keep_reactor_running:
+            reactor.stop()
 
     @classmethod
     def start_multiple_execution(cls):
         """
         Triggers the execution of spiders that were set up
         """
+        from twisted.internet import reactor
+
         if len(cls._multiple_mode_runners) > 0:
+            cls._close_on_sigterm(cls._multiple_mode_runners)
             reactor.run()
 
+    @staticmethod
+    def _close_on_sigterm(runners):
+        """
+        Makes SIGTERM (e.g. from the watchdog of run.py) close the spiders of the runners, with reason 'terminated', so
+        that they still store their results - instead of just stopping the reactor. Call before running the reactor
+        """
+        from twisted.internet import reactor
+
+        def _close():
+            for runner in list(runners):
+                for c in list(runner.crawlers):
+                    if c.engine is not None:
+                        c.engine.close_spider(c.spider, 'terminated')
+
+        # installed once the reactor runs, as the reactor installs its own handler when starting
+        reactor.callWhenRunning(
+            lambda: signal.signal(signal.SIGTERM, lambda *_: reactor.callFromThread(_close)))
+
     @classmethod
     def run_single(cls, settings, *init_args, **init_kwargs):
         """
@@ -131,21 +468,16 @@ class BaseSpider(scrapy.Spider):
     @classmethod
     def run_with_retry(cls, settings, trials=2, *init_args, **init_kwargs):
         """
-        This method can be used to re-run spider in case there was an error in the execution.
+        This method can be used to retry the spider's requests in case there was an error in the execution. Only
+        the failed requests are retried (see _retry_request), counts scraped from the rest are kept. If an error
+        remains after all the trials, it is raised.
 
-        :param trials: how many times to retry at most
+        :param trials: how many times to try each request at most
         """
-        trials -= 1
-
-        try:
-            cls.__run_in_separate_process(settings, *init_args, **init_kwargs)
-        except:
-            if trials == 0:
-                raise
+        settings = dict(settings)
+        settings.update(cls.get_retry_settings(trials))
 
-            print(f'Retrying. Remaining trials = {trials}')
-
-            cls.run_with_retry(settings, trials=trials, *init_args, **init_kwargs)
+        cls.__run_in_separate_process(settings, *init_args, **init_kwargs)
 
     @classmethod
     def __run_in_separate_process(cls, settings, *init_args, **init_kwargs):
@@ -158,7 +490,11 @@ class BaseSpider(scrapy.Spider):
         See https://stackoverflow.com/questions/41495052/scrapy-reactor-not-restartable
         """
         def _process_method(err_queue):
+            from twisted.internet import reactor
+
             try:
+                host_cache_helper.install_resolver(settings)
+
                 runner = crawler.CrawlerRunner(settings)
                 deferred = runner.crawl(cls, *init_args, **init_kwargs, err_queue=err_queue)
 
@@ -168,6 +504,7 @@ class BaseSpider(scrapy.Spider):
 
                 deferred.addBoth(lambda _: _cb())
 
+                cls._close_on_sigterm([runner])
                 reactor.run()
             except Exception as e:
                 err_queue.put(e)
@@ -4,12 +4,38 @@ for each company website spider, and thus  makes it possible for the developer t
 each company website when building a new spider.
 """
 
+import collections
 import functools
+import inspect
 import traceback
 import scrapy
+from scrapy.http import HtmlResponse
+from selenium.common.exceptions import WebDriverException
 
+import scraping.support.cache_helper as cache_helper
 import scraping.support.general_helper as general_helper
+import scraping.support.selenium_helper as sel_helper
+import scraping.support.store_helper as store_helper
 from scraping.base_spider import BaseSpider
+from scraping.company_website.extractions import SeleniumExtraction
+from scraping.company_website.paginations import SeleniumPagination
+
+
+def count_in_process(body, url, encoding, extractions):
+    """
+    Runs the (static) extractions on the body - to be run in the parse process pool. Returns a list with a tuple
+    (count, error message) per extraction
+    """
+    response = HtmlResponse(url=url, body=body, encoding=encoding)
+
+    results = []
+    for extraction in extractions:
+        try:
+            results.append((extraction.get_count(response), None))
+        except Exception as e:
+            results.append((None, '{}: {}'.format(type(e).__name__, e)))
+
+    return results
 
 
 class BaseCwSpider(BaseSpider):
@@ -17,7 +43,9 @@ class BaseCwSpider(BaseSpider):
         super().__init__(err_queue=err_queue)
 
         self._total = 0
+        self._counted = False  # whether any count was added to the total
         self._err_msg = None
+        self._entry_err_msg = None  # last failure of a url_info entry, the counts of the other entries are kept
 
     @property
     def urls_info(self):
@@ -26,7 +54,11 @@ class BaseCwSpider(BaseSpider):
         - 'url': the url being scraped
         - 'extraction': the extraction applied (subclassing the class Extraction)
 
-        Additional optional entry is 'pagination', specifying how to navigate pagination on the page
+        Additional optional entries are:
+        - 'pagination': specifying how to navigate pagination on the page
+        - 'method': HTTP method of the request (GET by default)
+
+        Entries with the same url and method are downloaded only once, all their extractions run on the same response
 
         See spiders.py for some examples
         """
@@ -38,7 +70,9 @@ class BaseCwSpider(BaseSpider):
         raise NotImplementedError
 
     def _spider_closed(self):
-        if self._err_msg is None:
+        if self._err_msg is None and self._entry_err_msg is not None and self._counted:
+            self._logger.info('{} vacancies (partial, some pages failed): "{}"'.format(self._total, self.company_name))
+        elif self._err_msg is None and self._entry_err_msg is None:
             self._logger.info('{} vacancies: "{}"'.format(self._total, self.company_name))
         else:
             self._logger.info('N/A vacancies: "{}"'.format(self.company_name))
@@ -48,61 +82,243 @@ class BaseCwSpider(BaseSpider):
         super()._log_err(err_msg)
 
     def start_requests(self):
+        sel_helper.set_pool_size(self.settings.getint('SELENIUM_POOL_SIZE', sel_helper.POOL_MAX_SIZE))
+        sel_helper.set_browser_workers(self.settings.getint('SELENIUM_WORKERS', sel_helper.BROWSER_WORKERS))
+        budget = sel_helper.get_budget()
+        if budget is not None:
+            budget.configure(self.settings.getint('BROWSER_SLOTS', sel_helper.BROWSER_SLOTS),
+                             self.settings.getint('BROWSER_MIN_FREE_MB', sel_helper.BROWSER_MIN_FREE_MB))
+
+        # (url, method) -> list of url_info entries applied to the page
+        entries_by_page = collections.OrderedDict()
+
         for url_info in self.urls_info:
             if 'pagination' in url_info:
-                pagination = url_info['pagination']
-                pagination.assign_logger(self._logger)
-            else:
-                pagination = None
+                url_info['pagination'].assign_logger(self._logger)
+            url_info['extraction'].assign_logger(self._logger)
 
-            extraction = url_info['extraction']
-            extraction.assign_logger(self._logger)
+            page = (url_info['url'], url_info.get('method', 'GET'))
+            entries_by_page.setdefault(page, []).append(url_info)
 
-            callback = functools.partial(self._parse, extraction=extraction, pagination=pagination)
+        for (url, method), entries in entries_by_page.items():
+            callback = functools.partial(self._parse, entries=entries)
+            meta = {'cw_entries': entries}  # the entries failing if the request fails, see _request_failed
             try:
-                yield scrapy.Request(url=url_info['url'], callback=callback, errback=self._errback, dont_filter=True)
+                if all(['pagination' not in e and e['extraction'].cacheable for e in entries]):
+                    # the counts cached are only valid for the same entries, extracted the same way
+                    cache_key = '{}|{} {}|{}'.format(self.name, method, url, cache_helper.fingerprint(entries))
+                    yield self._cached_request(url, cache_key, method=method, callback=callback,
+                                               errback=self._errback, meta=meta, dont_filter=True)
+                else:
+                    yield scrapy.Request(url=url, method=method, callback=callback, errback=self._errback,
+                                         meta=meta, dont_filter=True)
             except Exception as e:
                 self._log_err('Error making request: {}'.format(e))
 
-    def _errback(self, failure):
-        self._log_err('Request ended up in error: {}'.format(failure))
-
-    def _parse(self, response, extraction, pagination):
+    def _parse(self, response, entries):
         self._logger.debug("Scraping: {}".format(response.url))
 
+        cached = self._cached_result(response, size=len(entries))
+        if cached is not None:
+            return self._add_counts((list(zip(entries, cached)), []))
+        elif response.status == 304:
+            return [self._unconditional_request(response.request)]
+
+        if any([e['extraction'].runs_in_browser(response) for e in entries]):
+            # the browser blocks, so it is driven from a worker thread - the reactor keeps downloading meanwhile
+            deferred = sel_helper.defer_to_browser_worker(self._extract_entries, response, entries)
+            deferred.addCallback(self._add_counts)
+            return deferred
+        elif self._parse_in_process_pool():
+            # only the extractions run in the pool, the (cheap) pagination stays here as it needs the response
+            extractions = [e['extraction'] for e in entries]
+            deferred = self._defer_to_parse_process(count_in_process, response, response.url, response.encoding,
+                                                    extractions)
+            deferred.addCallback(lambda results: self._extract_entries(response, entries, results))
+            deferred.addCallback(self._add_counts)
+            return deferred
+
+        return self._add_counts(self._extract_entries(response, entries))
+
+    def _extract_entries(self, response, entries, results=None):
+        """
+        Runs the extraction (and pagination) of each url_info entry on the response. Returns the list of counts (one
+        per entry, None if the extraction failed) and the list of requests to follow. Browser extractions share one
+        driver, in which the page is loaded only once.
+
+        `results` are the results of the extractions if they were already run in the parse process pool
+        """
+        counts = []
+        requests = []
+        session = None  # the browser extraction which loaded the page, its driver is shared with the others
+
+        try:
+            for i, url_info in enumerate(entries):
+                extraction = url_info['extraction']
+                pagination = url_info.get('pagination')
+
+                # an extraction paginating in the browser moves the driver away from the page, so it does not share
+                in_browser = extraction.runs_in_browser(response)
+                shares = in_browser and (pagination is None or not pagination.in_browser)
+                if session is not None and shares and extraction.browser_profile == session.browser_profile:
+                    extraction.attach_driver(session.driver)
+                elif session is not None and in_browser:
+                    # the session's driver goes back to the pool before another one is borrowed - holding it while
+                    # waiting for a place in the pool (or a browser slot) could deadlock
+                    session.dispose()
+                    session = None
+
+                result = results[i] if results is not None else None
+                count, entry_requests = self._extract_and_paginate(response, url_info, result)
+                counts.append(count)
+                requests.extend(entry_requests)
+
+                if session is None and shares and count is not None and extraction.driver is not None:
+                    session = extraction
+                else:
+                    extraction.dispose()
+        finally:
+            if session is not None:
+                session.dispose()
+
+        if None not in counts:
+            self._cache_result(response, counts)
+
+        return list(zip(entries, counts)), requests
+
+    def _extract_and_paginate(self, response, url_info, result=None):
+        """
+        Returns the count extracted from the response (None if the extraction failed) and the list of requests for
+        the following pages. If the extraction fails, the list contains only the retry of this page and this
+        extraction (if any retries are left).
+
+        `result` is the (count, error message) of the extraction if it was already run in the parse process pool
+        """
+        extraction = url_info['extraction']
+        pagination = url_info.get('pagination')
+        callback = functools.partial(self._parse, entries=[url_info])
+
+        count = None
+        requests = []
+
         try:
-            self._total += extraction.get_count(response)
+            if result is None:
+                count = extraction.get_count(response)
+            elif result[1] is not None:
+                raise Exception(result[1])
+            else:
+                count = result[0]
         except Exception as e:
-            self._log_err('Error getting count from {}: {}'.format(response.url, e))
+            kind = 'selenium' if isinstance(e, WebDriverException) else 'parse'
+            retry = self._retry_request(self._unconditional_request(response.request).replace(callback=callback),
+                                        kind, e)
+            if retry is not None:
+                return None, [retry]  # the pagination continues from the retried page
+
+            self._entry_failed(url_info, 'Error getting count from {}: {}'.format(response.url, e))
             traceback.print_exc()
 
         try:
-            if pagination is not None:
-                self._logger.debug("Scraped count so far: {}".format(self._total))
-                callback = functools.partial(self._parse, extraction=extraction, pagination=pagination)
-                yield from pagination.next_url(response, extraction, callback)
+            if pagination is not None and pagination.in_browser:
+                for page_count in pagination.page_counts(response, extraction):
+                    count = (count or 0) + page_count
+            elif pagination is not None:
+                requests = [r.replace(errback=r.errback or self._errback, meta=dict(r.meta, cw_entries=[url_info]))
+                            for r in pagination.next_url(response, extraction, callback, count=count)]
         except Exception as e:
-            self._log_err('Error paginating from {}: {}'.format(response.url, e))
+            self._entry_failed(url_info, 'Error paginating from {}: {}'.format(response.url, e))
             traceback.print_exc()
-        finally:
-            extraction.dispose()
+
+        return count, requests
+
+    def _add_counts(self, result):
+        entry_counts, requests = result
+
+        for url_info, count in entry_counts:
+            if count is not None:
+                self._add_entry_count(url_info, count)
+
+        if len(requests) > 0:
+            self._logger.debug("Scraped count so far: {}".format(self._total))
+
+        return self._with_backoff(requests)
+
+    def _add_entry_count(self, url_info, count):
+        """Called (on the reactor thread) with the count extracted for the url_info entry from one page"""
+        self._total += count
+        self._counted = True
+
+    def _entry_failed(self, url_info, err_msg):
+        """
+        Called when the extraction/pagination of the url_info entry failed for good (i.e. no retries left). The counts
+        of the pages which did not fail are kept - the total is stored as partial, together with the error
+        """
+        self._entry_err_msg = err_msg
+        BaseSpider._log_err(self, err_msg)  # not as an error of the whole spider
+
+    def _request_failed(self, request, err_msg):
+        entries = request.meta.get('cw_entries') if request is not None else None
+        if entries is None:
+            return super()._request_failed(request, err_msg)
+
+        requests = []
+        for url_info in entries:
+            self._entry_failed(url_info, err_msg)
+
+            # the failed page may hold a slot of a pagination requesting its pages concurrently
+            pagination = url_info.get('pagination')
+            if pagination is not None and not pagination.in_browser:
+                callback = functools.partial(self._parse, entries=[url_info])
+                requests.extend(r.replace(errback=r.errback or self._errback, meta=dict(r.meta, cw_entries=[url_info]))
+                                for r in pagination.page_failed(request, callback))
+
+        return requests
 
     def _store_results(self):
-        if self._err_msg is not None:
+        if self._err_msg is None and self._close_reason not in (None, 'finished'):
+            self._err_msg = 'Closed before finishing ({})'.format(self._close_reason)
+
+        # a partial total is kept with the error of the entry which failed - unless nothing was counted at all
+        err_msg = self._err_msg or self._entry_err_msg
+        if self._err_msg is not None or (err_msg is not None and not self._counted):
             self._total = None
 
-        # TODO - here you can store the scraped data instead of just printing
-        print(f'Company: {self.company_name}')
-        print(f'Date: {general_helper.get_date()}')
-        print(f'JV count: {self._total}')
-        print(f'Error message: {self._err_msg}')
+        self._store_result(self.company_name, self._total, err_msg)
+
+    def _run_result(self):
+        if self._total is None:
+            return self._err_msg or self._entry_err_msg
+        elif self._entry_err_msg is not None:
+            return '{} (partial): {}'.format(self._total, self._entry_err_msg)
+
+        return self._total
+
+    def _store_result(self, company_name, total, err_msg):
+        """Stores the count of the company for today (see store_helper.get_results_store)"""
+        date = general_helper.get_date()
+        store_helper.get_results_store(self.settings).put(company_name, date, total, err_msg, self.name)
+
+        self._logger.debug('Stored result for "{}" on {}: {} (error: {})'.format(company_name, date, total, err_msg))
+
+    @classmethod
+    def uses_browser(cls):
+        # the Selenium extractions and paginations are declared as nested classes of the spider
+        return any(issubclass(c, (SeleniumExtraction, SeleniumPagination))
+                   for _, c in inspect.getmembers(cls, inspect.isclass))
 
     @classmethod
     def get_settings(cls):
         settings = super().get_settings()
         settings.update({
             'COOKIES_ENABLED': True,
-            'COOKIES_DEBUG': True
+            'COOKIES_DEBUG': True,
+            'RESULTS_STORE_PATH': 'scraped/company_website/results.sqlite',  # relative to the data folder
+            'RESULTS_FLUSH_SIZE': 100,
+            'RESULTS_TIMESERIES_SOURCE': 'company_website',  # series of the time-series store, None to not append
+            'SELENIUM_POOL_SIZE': sel_helper.POOL_MAX_SIZE,  # max. number of warm Chrome drivers kept by the process
+            'SELENIUM_WORKERS': sel_helper.BROWSER_WORKERS,  # max. number of Selenium extractions running concurrently
+            'BROWSER_SLOTS': sel_helper.BROWSER_SLOTS,  # max. number of Chromes in use on the machine (all processes)
+            'BROWSER_MIN_FREE_MB': sel_helper.BROWSER_MIN_FREE_MB  # memory needed available to launch a Chrome
         })
 
         return settings
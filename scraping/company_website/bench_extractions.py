@@ -0,0 +1,62 @@
+"""
+Micro-benchmark of the per-response cost of the simple extractions - the way they used to be done (xpath and regex
+parsed on every response, matching nodes turned into strings) against the precompiled ones in extractions.py.
+
+Simply run this file to see the numbers.
+"""
+
+import re
+import timeit
+
+from scrapy.http import HtmlResponse
+
+from scraping.company_website.extractions import simple_xpath_regex_extraction, simple_xpath_count_extraction
+
+
+JOBS = 500
+REPEAT = 200
+
+COUNT_XPATH = '//a[@class="job-link"]'
+REGEX_XPATH = '//a[@class="more-link button"]/span[@class="count"]/text()'
+PATTERN = '(\d+)'
+
+
+def make_response():
+    links = ''.join(['<li><a class="job-link" href="/job/{0}">Job {0}</a></li>'.format(i) for i in range(JOBS)])
+    body = '<html><body><ul>{}</ul><a class="more-link button"><span class="count">{}</span></a></body></html>'.format(
+        links, JOBS)
+
+    return HtmlResponse(url='http://example.com/jobs', body=body.encode('utf-8'), encoding='utf-8')
+
+
+def old_count(response):
+    return len(response.xpath(COUNT_XPATH).extract())
+
+
+def old_regex(response):
+    return int(re.search(PATTERN, response.xpath(REGEX_XPATH).extract_first()).group(1))
+
+
+def bench(name, f, response):
+    f(response)  # the selector of the response is built here, so that it is not part of the measurement
+    t = timeit.timeit(lambda: f(response), number=REPEAT)
+    print('{:>20}: {:8.1f} us per response'.format(name, t / REPEAT * 1e6))
+
+
+def main():
+    count_extraction = simple_xpath_count_extraction(COUNT_XPATH)
+    regex_extraction = simple_xpath_regex_extraction(REGEX_XPATH, PATTERN)
+
+    response = make_response()
+    assert old_count(response) == count_extraction.get_count(response) == JOBS
+    assert old_regex(response) == regex_extraction.get_count(response) == JOBS
+
+    print('{} job links per page, {} repetitions'.format(JOBS, REPEAT))
+    bench('count - before', old_count, response)
+    bench('count - after', count_extraction.get_count, response)
+    bench('regex - before', old_regex, response)
+    bench('regex - after', regex_extraction.get_count, response)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark of the browser profiles - loads pages with the default and the lean profile (see selenium_helper) and prints
+the bytes downloaded and the load time of each, and what the lean profile saves.
+
+Run as `python bench_profiles.py [url ...]` (by default the pages of the Selenium spiders in spiders.py are loaded).
+"""
+
+import sys
+import time
+
+import scraping.support.selenium_helper as sh
+
+
+REPEAT = 3
+
+URLS = [
+    'https://www.accenture.com/gb-en/careers/jobsearch',
+    'https://uk-aon.icims.com/jobs/search?pr=0',
+    'https://jacobs.taleo.net/careersection/ex/jobsearch.ftl?lang=en'
+]
+
+
+def load(profile, url):
+    """Returns the (bytes, load time in ms as reported by the browser, wall time in ms) of loading url"""
+    driver = sh.get_driver(profile)
+    try:
+        t = time.time()
+        driver.get(url)
+        wall_ms = (time.time() - t) * 1000
+
+        page_bytes, load_ms, _ = sh.page_load_stats.record(profile, driver) or (0, 0, 0)
+        return page_bytes, load_ms, wall_ms
+    finally:
+        driver.quit()
+
+
+def bench(url):
+    results = {}
+    for profile in (sh.DEFAULT_PROFILE, sh.LEAN_PROFILE):
+        loads = [load(profile, url) for _ in range(REPEAT)]
+        results[profile.name] = [sum(values) / REPEAT for values in zip(*loads)]
+
+        print('{:>10}: {:8.0f} kB {:8.0f} ms (browser) {:8.0f} ms (wall)'.format(
+            profile.name, results[profile.name][0] / 1024, results[profile.name][1], results[profile.name][2]))
+
+    default, lean = results[sh.DEFAULT_PROFILE.name], results[sh.LEAN_PROFILE.name]
+    print('{:>10}: {:8.0f} kB {:8.0f} ms (browser) {:8.0f} ms (wall)'.format(
+        'saved', (default[0] - lean[0]) / 1024, default[1] - lean[1], default[2] - lean[2]))
+
+
+def main(urls):
+    for url in urls:
+        print(url)
+        bench(url)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or URLS)
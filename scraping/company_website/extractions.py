@@ -3,8 +3,14 @@ Helper methods/classes to faciliate extraction of the required data from the HTM
 """
 
 
+import scraping.support.cache_helper as cache_helper
 import scraping.support.selenium_helper as sel_helper
 import re
+import threading
+import time
+import urllib.parse as urlparse
+from lxml import etree
+from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException, TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 import scraping.support.selenium_helper as sh
 
@@ -15,6 +21,9 @@ import scraping.support.selenium_helper as sh
 
 class Extraction:
     """Subclass this to describe extraction from a HTTP response"""
+    # whether the count can be re-used while the page does not change (see BaseSpider._cached_request)
+    cacheable = True
+
     def assign_logger(self, logger):
         self._logger = logger
 
@@ -22,6 +31,13 @@ class Extraction:
         """Override with code extracting the desired integer from the HTTP response"""
         raise NotImplementedError
 
+    def runs_in_browser(self, response):
+        """
+        Whether the extraction drives a browser for this response. Such extractions (together with their pagination)
+        are run on a browser worker thread, off the reactor thread
+        """
+        return False
+
     def get_count(self, response):
         count = self.get_count_from_response(response)
         if not isinstance(count, int):
@@ -34,38 +50,172 @@ class Extraction:
 
 
 class SeleniumExtraction(Extraction):
-    """Subclass this to describe extraction from a Selenium driver"""
+    """
+    Subclass this to describe extraction from a Selenium driver. Set browser_profile to e.g. sh.LEAN_PROFILE (or
+    sh.LEAN_PROFILE.allowing('*.company.com', ...)) to load the page without images, fonts, media and trackers
+    """
     DEF_WAIT = 30
+    cacheable = False  # the content rendered by the browser may change even if the page itself did not
+    browser_profile = sh.DEFAULT_PROFILE
 
     def __init__(self):
         self.driver = None
+        self._crashed = False
+        self._attached = False
+        self._timeouts = {}
+        self._host = None  # of the page being extracted, the adaptive timeouts are learned per host
 
     def get_count_via_driver(self, driver, response):
         """Override with code extracting the desired number from the Selenium driver, or the HTTP response"""
         raise NotImplementedError
 
+    def runs_in_browser(self, response):
+        return True
+
+    def adaptive_timeout(self, name, max_wait=None):
+        """
+        Returns the adaptive timeout of the wait called name of this extraction on the host of the current page (see
+        AdaptiveTimeout) - pass it as the timeout of the waits below, e.g.
+        wait_for_number(driver, locator, timeout=self.adaptive_timeout('count'))
+        """
+        if (name, self._host) not in self._timeouts:
+            self._timeouts[(name, self._host)] = AdaptiveTimeout('{}.{}.{}@{}'.format(
+                type(self).__module__, type(self).__qualname__, name, self._host), max_wait or self.DEF_WAIT)
+
+        return self._timeouts[(name, self._host)]
+
+    def attach_driver(self, driver):
+        """
+        Makes the next get_count use the given driver, in which the page is already loaded (by another extraction of
+        the same page), instead of loading the page again. The driver stays owned by the other extraction
+        """
+        self.dispose()
+
+        self.driver = driver
+        self._attached = True
+
     def get_count_from_response(self, response):
-        if self.driver is not None:
-            self.driver.quit()
+        self._host = urlparse.urlparse(response.url).hostname
 
-        self.driver = sel_helper.get_driver()
+        if self._attached:
+            self.driver.switch_to.default_content()
+        else:
+            # a driver still borrowed from the previous page (e.g. kept for the pagination) goes back to the pool
+            self.dispose()
 
-        try:
-            self.driver.get(response.url)
-        except Exception as e:
-            self._logger.error('Error loading page: ' + str(e))
-            raise e
+            self.driver = sel_helper.get_pool().checkout(self.browser_profile)
+
+            # the pool restores the default timeout (PAGE_LOAD_TIMEOUT) when the driver is checked in
+            page_load_timeout = self.adaptive_timeout('page_load', sh.PAGE_LOAD_TIMEOUT)
+            self.driver.set_page_load_timeout(page_load_timeout.get())
+            t = time.time()
+            try:
+                self.driver.get(response.url)
+                page_load_timeout.record(time.time() - t)
+            except Exception as e:
+                if isinstance(e, TimeoutException):
+                    page_load_timeout.record(time.time() - t)
+
+                self._logger.error('Error loading page: ' + str(e))
+                self._crashed = True
+                raise e
 
+            page_load = sel_helper.page_load_stats.record(self.browser_profile, self.driver)
+            if page_load is not None:
+                self._logger.debug('Loaded {} with the {} profile: {:.0f} kB, {:.0f} ms, {} resources'.format(
+                    response.url, self.browser_profile.name, page_load[0] / 1024, page_load[1], page_load[2]))
+
+        return self.get_count_from_current_page(response)
+
+    def get_count_from_current_page(self, response):
+        """Extracts the count from the page the driver is on now (which may differ from the response's page)"""
         try:
-            return self.get_count_via_driver(self.driver, response)
+            count = self.get_count_via_driver(self.driver, response)
         except Exception as e:
             self._logger.error('Error getting counts using web-driver: ' + str(e))
             sel_helper.screenshot(self.driver, self._logger)
 
             raise e
 
+        if not isinstance(count, int):
+            raise Exception('Value must be converted to integer class: {}'.format(count))
+
+        return count
+
     def dispose(self):
-        self.driver.quit()
+        """Returns the driver to the pool (unless it was only attached)"""
+        if self.driver is not None and not self._attached:
+            sel_helper.get_pool().checkin(self.driver, crashed=self._crashed)
+
+        self.driver = None
+        self._crashed = False
+        self._attached = False
+
+
+class HybridExtraction(SeleniumExtraction):
+    """
+    Subclass this (overriding get_count_via_driver) for pages where the count can often be found without a browser.
+    The static extraction given (e.g. simple_xpath_regex_extraction, or one reading embedded JSON) is tried on the
+    response downloaded by Scrapy first, and the browser is launched only if that fails.
+
+    Which way worked is remembered across runs under `key` (by default the class name, which includes the spider's).
+    If only the browser worked, later runs go straight to the browser - but the static extraction is re-tested once
+    STATIC_RETEST_DAYS passed.
+    """
+    STATIC_RETEST_DAYS = 7
+
+    def __init__(self, static_extraction, key=None):
+        super().__init__()
+
+        self._static_extraction = static_extraction
+        self._key = key if key is not None else '{}.{}'.format(type(self).__module__, type(self).__qualname__)
+
+        self._response = None  # the last response decided about
+        self._static_count = None  # count from the static extraction of that response, None if it failed
+
+    def assign_logger(self, logger):
+        super().assign_logger(logger)
+        self._static_extraction.assign_logger(logger)
+
+    def __getstate__(self):
+        # the response is not sent along when the extraction is pickled to the parse process pool
+        state = dict(self.__dict__)
+        state['_response'] = None
+
+        return state
+
+    def runs_in_browser(self, response):
+        if response is not self._response:
+            self._response = response
+            self._static_count = self.__try_static(response)
+
+        return self._static_count is None
+
+    def __try_static(self, response):
+        store = cache_helper.get_extraction_path_store()
+
+        path, checked_at = store.get(self._key)
+        if path == 'browser' and time.time() - checked_at < self.STATIC_RETEST_DAYS * 24 * 3600:
+            return None
+
+        try:
+            count = self._static_extraction.get_count(response)
+        except Exception as e:
+            self._logger.debug('Static extraction failed on {}, using the browser: {}'.format(response.url, e))
+            count = None
+
+        new_path = 'static' if count is not None else 'browser'
+        if new_path != path:
+            self._logger.info('Extraction path of {} changed: {} -> {}'.format(self._key, path, new_path))
+        store.set(self._key, new_path)
+
+        return count
+
+    def get_count_from_response(self, response):
+        if not self.runs_in_browser(response):
+            return self._static_count
+
+        return super().get_count_from_response(response)
 
 
 # ---------------------------------------------------------------------
@@ -73,26 +223,208 @@ class SeleniumExtraction(Extraction):
 # ---------------------------------------------------------------------
 
 
-def simple_xpath_regex_extraction(xpath, pattern='(\d+)'):
-    """For cases where we just take a number representing the count directly"""
-    class NewExtraction(Extraction):
-        def get_count_from_response(self, response):
-            text = response.xpath(xpath).extract_first()
-            return int(re.search(pattern, text).group(1))
+class XpathRegexExtraction(Extraction):
+    """
+    Takes the number matched by the regex (its first group) in the text at the xpath (or in the HTML, if the xpath
+    selects an element). The regex is compiled once per instance, the xpath once per thread (see compiled_xpath)
+    """
+    def __init__(self, xpath, pattern=r'(\d+)'):
+        self._xpath = xpath
+        self._pattern = re.compile(pattern)
+
+    def get_count_from_response(self, response):
+        nodes = compiled_xpath(self._xpath)(response.selector.root)
+        text = _to_text(nodes[0]) if len(nodes) > 0 else None
+        return int(self._pattern.search(text).group(1))
 
-    return NewExtraction()
+
+class XpathCountExtraction(Extraction):
+    """
+    Counts the nodes at the xpath. The nodes are counted by lxml (XPath count()), without turning them into strings
+    """
+    def __init__(self, xpath):
+        self._xpath = xpath
+        self._count_xpath = 'count({})'.format(xpath)
+
+    def get_count_from_response(self, response):
+        return int(compiled_xpath(self._count_xpath)(response.selector.root))
+
+
+XPATH_NAMESPACES = {'re': 'http://exslt.org/regular-expressions'}  # same as in Scrapy's selectors
+XPATH_CACHE_SIZE = 1024  # compiled xpaths kept per thread
+
+_compiled_xpaths = threading.local()
+
+
+def compiled_xpath(xpath):
+    """
+    Returns the xpath compiled by lxml. Compiled xpaths are cached per thread, as they are not thread-safe - the cache
+    goes away with its thread, and is emptied once it holds XPATH_CACHE_SIZE xpaths
+    """
+    cache = getattr(_compiled_xpaths, 'cache', None)
+    if cache is None:
+        cache = _compiled_xpaths.cache = {}
+
+    if xpath not in cache:
+        if len(cache) >= XPATH_CACHE_SIZE:
+            cache.clear()
+        cache[xpath] = etree.XPath(xpath, namespaces=XPATH_NAMESPACES)
+
+    return cache[xpath]
+
+
+def _to_text(node):
+    """Turns a node selected by an xpath into text, same as Scrapy's extract() would"""
+    if isinstance(node, etree._Element):
+        return etree.tostring(node, method='html', encoding='unicode', with_tail=False)
+
+    return str(node)
+
+
+def simple_xpath_regex_extraction(xpath, pattern=r'(\d+)'):
+    """For cases where we just take a number representing the count directly"""
+    return XpathRegexExtraction(xpath, pattern)
 
 
 def simple_xpath_count_extraction(xpath):
     """For cases where we just count number of job ads given by specified xpath"""
-    class NewExtraction(Extraction):
-        def get_count_from_response(self, response):
-            return len(response.xpath(xpath).extract())
+    return XpathCountExtraction(xpath)
+
+
+# ---------------------------------------------------------------------
+# --- Waits
+# ---------------------------------------------------------------------
+#
+# The waits return as soon as their condition holds. Their timeout is a number of seconds or an AdaptiveTimeout
+# (e.g. from SeleniumExtraction.adaptive_timeout) - with the latter, the time the wait took is recorded, so that the
+# timeouts follow the latencies seen on the site.
+
+POLL_INTERVAL = 0.1  # s
+
+# counts the mutations of the DOM (added/removed nodes and text changes) since the observer was installed
+DOM_MUTATIONS_SCRIPT = '''
+    if (window.__jvpMutations === undefined) {
+        window.__jvpMutations = 0;
+        new MutationObserver(function (mutations) { window.__jvpMutations += mutations.length; })
+            .observe(document, {childList: true, subtree: true, characterData: true});
+    }
+    return window.__jvpMutations;
+'''
+
+# the page finished loading and how many resources (incl. XHR) finished downloading
+NETWORK_SCRIPT = "return [document.readyState, performance.getEntriesByType('resource').length];"
+
+
+class AdaptiveTimeout:
+    """
+    Timeout of a wait learned from the latencies of the same wait in earlier runs (stored under key): the p95 latency
+    times MARGIN, within MIN_WAIT and max_wait. Until MIN_SAMPLES latencies are known, max_wait is used.
+    """
+    MARGIN = 3
+    MIN_WAIT = 5
+    MIN_SAMPLES = 5
+
+    def __init__(self, key, max_wait=sh.DEF_WAIT):
+        self._key = key
+        self._max_wait = max_wait
+
+    def get(self):
+        latencies = sorted(cache_helper.get_latency_store().get(self._key))
+        if len(latencies) < self.MIN_SAMPLES:
+            return self._max_wait
 
-    return NewExtraction()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return min(self._max_wait, max(self.MIN_WAIT, p95 * self.MARGIN))
 
+    def record(self, seconds):
+        cache_helper.get_latency_store().add(self._key, seconds)
 
-def wait_for_element(driver, expectation):
-    element = WebDriverWait(driver, sh.DEF_WAIT).until(expectation)
+
+def wait_until(driver, condition, timeout=None):
+    """
+    Waits until condition(driver) returns a truthy value, and returns it. Raises TimeoutException if it does not
+    within the timeout (sh.DEF_WAIT by default)
+    """
+    seconds = timeout.get() if isinstance(timeout, AdaptiveTimeout) else timeout or sh.DEF_WAIT
+
+    t = time.time()
+    try:
+        result = WebDriverWait(driver, seconds, poll_frequency=POLL_INTERVAL).until(condition)
+    except TimeoutException:
+        # a timed out wait is recorded with its timeout - the latency was at least that. Other errors (e.g. the
+        # browser crashed) say nothing about the latency, they are not recorded
+        if isinstance(timeout, AdaptiveTimeout):
+            timeout.record(time.time() - t)
+        raise
+
+    if isinstance(timeout, AdaptiveTimeout):
+        timeout.record(time.time() - t)
+
+    return result
+
+
+def wait_for_element(driver, expectation, timeout=None):
+    element = wait_until(driver, expectation, timeout)
 
     return element
+
+
+def wait_for_number(driver, locator, pattern=r'(\d+)', timeout=None, different_from=None):
+    """
+    Waits until the text of the element at locator (e.g. (By.XPATH, '...')) matches the pattern, and returns the
+    number matched (its first group). With different_from, waits for a text other than that one (e.g. the text before
+    a search was submitted)
+    """
+    pattern = re.compile(pattern)
+
+    def _number(driver):
+        try:
+            text = driver.find_element(*locator).text
+        except (NoSuchElementException, StaleElementReferenceException):
+            return None
+
+        match = pattern.search(text)
+        return int(match.group(1)) if match is not None and text != different_from else None
+
+    return wait_until(driver, _number, timeout)
+
+
+def wait_for_dom_settled(driver, quiet=0.5, timeout=None):
+    """Waits until the DOM did not change (nodes added/removed, text changed) for `quiet` seconds"""
+    return wait_until(driver, _Unchanged(lambda d: d.execute_script(DOM_MUTATIONS_SCRIPT), quiet), timeout)
+
+
+def wait_for_network_idle(driver, quiet=0.5, timeout=None):
+    """Waits until the page is loaded and no resource (XHR included) finished downloading for `quiet` seconds"""
+    def _network(driver):
+        ready_state, resources = driver.execute_script(NETWORK_SCRIPT)
+        return resources if ready_state == 'complete' else None
+
+    return wait_until(driver, _Unchanged(_network, quiet), timeout)
+
+
+def text_of(driver, locator):
+    """Returns the text of the element at locator, None if there is no such element"""
+    try:
+        return driver.find_element(*locator).text
+    except NoSuchElementException:
+        return None
+
+
+class _Unchanged:
+    """Condition holding once probe(driver) returned the same (not None) value for `quiet` seconds"""
+
+    def __init__(self, probe, quiet):
+        self._probe = probe
+        self._quiet = quiet
+        self._value = None
+        self._since = None
+
+    def __call__(self, driver):
+        value = self._probe(driver)
+        if value is None or value != self._value:
+            self._value = value
+            self._since = time.time()
+            return False
+
+        return time.time() - self._since >= self._quiet
@@ -2,11 +2,19 @@
 Helper class for handling pages which require use of pagination
 """
 
+import collections
+import math
+import re
+import urllib.parse as urlparse
+
 import scrapy
 
 
 class Pagination:
     """Subclass this to describe pagination on the page"""
+    # whether the pages are gone through in the browser of the extraction (see SeleniumPagination)
+    in_browser = False
+
     def assign_logger(self, logger):
         self._logger = logger
 
@@ -14,7 +22,117 @@ class Pagination:
         """Override with code to get the next page url, or None if this is the last page"""
         raise NotImplementedError
 
-    def next_url(self, response, extraction, callback):
+    def next_url(self, response, extraction, callback, count=None):
+        """Yields the requests for the following page(s). `count` is the count extracted from the response"""
         next_url = self.get_next_url(response, extraction)
         if next_url is not None:
-            yield scrapy.Request(url=next_url, callback=callback)
\ No newline at end of file
+            yield scrapy.Request(url=next_url, callback=callback)
+
+    def page_failed(self, request, callback):
+        """Returns the requests for the following page(s) once the page requested failed for good (no retries left)"""
+        return []
+
+
+class PredictablePagination(Pagination):
+    """
+    Subclass this for pagination where the urls of all the pages can be derived from the first page (e.g. 'page=2',
+    'offset=20', ...). Instead of following the pages one by one, they are requested concurrently - but at most
+    max_fan_out of them at once. Once a page comes back without results, the remaining pages are not requested.
+
+    The counts from all the pages are summed up, as for any other pagination.
+    """
+    def __init__(self, max_fan_out=8):
+        self._max_fan_out = max_fan_out
+        self._pending = None  # urls of the pages not requested yet
+        self._stopped = False
+
+    def get_page_urls(self, response, extraction):
+        """Override with code returning the urls of all the pages after the first one (the response)"""
+        raise NotImplementedError
+
+    def next_url(self, response, extraction, callback, count=None):
+        if self._pending is None:
+            self._pending = collections.deque(self.get_page_urls(response, extraction))
+            self._logger.debug('Requesting {} more pages, {} at once'.format(len(self._pending), self._max_fan_out))
+            slots = self._max_fan_out
+        else:
+            slots = 1  # one of the pages in flight finished
+
+        if count == 0 and not self._stopped:
+            self._logger.debug('No results on {}, not requesting the {} remaining pages'.format(
+                response.url, len(self._pending)))
+            self._stopped = True
+
+        return self.__requests(slots, callback)
+
+    def page_failed(self, request, callback):
+        # the failed page's slot is handed to the next page - a failure does not say the results ran out
+        if self._pending is None:
+            return []
+
+        return self.__requests(1, callback)
+
+    def __requests(self, slots, callback):
+        requests = []
+        while not self._stopped and slots > 0 and len(self._pending) > 0:
+            requests.append(scrapy.Request(url=self._pending.popleft(), callback=callback, dont_filter=True))
+            slots -= 1
+
+        return requests
+
+
+class QueryParamPagination(PredictablePagination):
+    """
+    Pages addressed by a number in a query parameter, e.g. iCIMS 'pr=0,1,2,...' (step=1) or 'offset=0,20,40,...'
+    (step=20). The number of pages is read from the first page, using `total_xpath` and `pattern`. If `per_page` is
+    given, the number read is the number of results (rather than of pages).
+    """
+    def __init__(self, param, total_xpath, pattern='(\d+)', step=1, per_page=None, max_fan_out=8):
+        super().__init__(max_fan_out=max_fan_out)
+
+        self._param = param
+        self._total_xpath = total_xpath
+        self._pattern = re.compile(pattern)
+        self._step = step
+        self._per_page = per_page
+
+    def get_page_urls(self, response, extraction):
+        total = int(self._pattern.search(response.xpath(self._total_xpath).extract_first()).group(1))
+        pages = total if self._per_page is None else int(math.ceil(total / self._per_page))
+
+        scheme, netloc, path, query, fragment = urlparse.urlsplit(response.url)
+        params = urlparse.parse_qsl(query, keep_blank_values=True)
+        first = int(dict(params).get(self._param, 0))
+
+        urls = []
+        for i in range(1, pages):
+            page_params = [(k, v) for k, v in params if k != self._param] + [(self._param, first + i * self._step)]
+            urls.append(urlparse.urlunsplit((scheme, netloc, path, urlparse.urlencode(page_params), fragment)))
+
+        return urls
+
+
+class SeleniumPagination(Pagination):
+    """
+    Subclass this for pagination done in the browser, to be used with a SeleniumExtraction. The driver which extracted
+    the count from the first page moves through all the following pages in place (by clicking or navigating) and the
+    extraction counts each of them. So no browser is started and nothing is downloaded by Scrapy for the next pages.
+    """
+    in_browser = True
+    MAX_PAGES = 1000
+
+    def go_to_next_page(self, driver, extraction):
+        """Override with code moving the driver to the next page. Return False if there is no next page"""
+        raise NotImplementedError
+
+    def page_counts(self, response, extraction):
+        """Yields the count of each page after the first one"""
+        for page in range(2, self.MAX_PAGES + 1):
+            if not self.go_to_next_page(extraction.driver, extraction):
+                return
+
+            self._logger.debug('Counting page {} of {} in the browser'.format(page, response.url))
+            yield extraction.get_count_from_current_page(response)
+
+    def next_url(self, response, extraction, callback, count=None):
+        return []  # the pages are not requested through Scrapy
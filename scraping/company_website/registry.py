@@ -0,0 +1,83 @@
+"""
+Declarative registry of company websites - for the simple cases, where the count can be taken with an xpath (and a
+regex), so that no spider class needs to be written for the company. All the companies in the registry are scraped
+by one spider, see RegistryCwSpider.
+
+The registry is either a CSV file, or a SQLite database (.sqlite/.db) with a table `companies`, with columns:
+- company_name: the name of the company (the results are stored under it)
+- url: the url being scraped
+- extraction: 'xpath_regex' (take a number from the text at the xpath) or 'xpath_count' (count the nodes at the xpath)
+- xpath: the xpath for the extraction
+- pattern: (optional) the regex with the number in its first group, for 'xpath_regex' (default '(\d+)')
+- next_xpath: (optional) xpath of the 'next page' link's href, if the results are paginated
+
+One company can have more rows (e.g. more urls), their counts are summed up.
+"""
+
+import csv
+import sqlite3
+
+from scraping.company_website.extractions import simple_xpath_regex_extraction, simple_xpath_count_extraction
+from scraping.company_website.paginations import Pagination
+
+
+COLUMNS = ['company_name', 'url', 'extraction', 'xpath', 'pattern', 'next_xpath']
+DEF_PATTERN = r'(\d+)'
+
+
+def load_registry(path):
+    """Returns the rows of the registry (CSV or SQLite file) as a list of dictionaries"""
+    if path.endswith('.sqlite') or path.endswith('.db'):
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in connection.execute('SELECT * FROM companies')]
+        finally:
+            connection.close()
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    # empty cells mean the optional value is not set
+    return [{c: (row.get(c) or None) for c in COLUMNS} for row in rows]
+
+
+class NextXpathPagination(Pagination):
+    """Follows the link whose href is at the given xpath"""
+    def __init__(self, next_xpath):
+        self._next_xpath = next_xpath
+
+    def get_next_url(self, response, extraction):
+        href = response.xpath(self._next_xpath).extract_first()
+        return response.urljoin(href) if href else None
+
+
+def build_urls_info(rows):
+    """
+    Turns registry rows into url_info entries for BaseCwSpider, with the additional entry 'company_name'. Extractions
+    are built once per distinct spec, so companies on the same platform (same xpath & regex) share them
+    """
+    extractions = {}
+    urls_info = []
+
+    for row in rows:
+        spec = (row['extraction'], row['xpath'], row['pattern'] or DEF_PATTERN)
+        if spec not in extractions:
+            if row['extraction'] == 'xpath_regex':
+                extractions[spec] = simple_xpath_regex_extraction(xpath=row['xpath'], pattern=spec[2])
+            elif row['extraction'] == 'xpath_count':
+                extractions[spec] = simple_xpath_count_extraction(xpath=row['xpath'])
+            else:
+                raise ValueError('Unknown extraction "{}" for {}'.format(row['extraction'], row['company_name']))
+
+        url_info = {
+            'company_name': row['company_name'],
+            'url': row['url'],
+            'extraction': extractions[spec]
+        }
+        if row['next_xpath'] is not None:
+            url_info['pagination'] = NextXpathPagination(row['next_xpath'])
+
+        urls_info.append(url_info)
+
+    return urls_info
@@ -0,0 +1,99 @@
+"""
+Generic company-website spider, scraping all the companies of the registry (see registry.py) in one crawl.
+
+Bespoke spiders (spiders.py) remain for the cases the registry can not describe (e.g. use of Selenium).
+
+Simply run this file to try it out on the example registry!
+"""
+
+import collections
+
+from scraping.base_spider import BaseSpider
+from scraping.company_website.base_cw_spider import BaseCwSpider
+from scraping.company_website import registry
+from scraping.support.common import *
+
+
+class RegistryCwSpider(BaseCwSpider):
+    """
+    Scrapes all the companies of the registry at CW_REGISTRY_PATH (or at registry_path, if given). With offset and
+    limit, only a slice of the registry is scraped. The counts and errors are kept per company.
+    """
+
+    name = 'registry-cw'
+    job_args = {'offset': int, 'limit': int}  # a slice of the registry - but not another registry file
+
+    def __init__(self, err_queue=None, registry_path=None, offset=0, limit=None):
+        super().__init__(err_queue=err_queue)
+
+        self._registry_path = registry_path
+        self._offset = offset
+        self._limit = limit
+
+        self._urls_info = None
+        self._totals = collections.OrderedDict()  # company name -> count
+        self._counted_companies = set()  # companies with a count added to their total
+        self._err_msgs = {}  # company name -> error message
+
+    @property
+    def company_name(self):
+        return 'REGISTRY ({} companies)'.format(len(self._totals))
+
+    @property
+    def urls_info(self):
+        if self._urls_info is None:
+            rows = registry.load_registry(self._registry_path or self.settings['CW_REGISTRY_PATH'])
+            end = self._offset + self._limit if self._limit is not None else None
+            self._urls_info = registry.build_urls_info(rows[self._offset:end])
+
+            for url_info in self._urls_info:
+                self._totals.setdefault(url_info['company_name'], 0)
+
+            self._logger.info('Loaded {} urls of {} companies from the registry'.format(
+                len(self._urls_info), len(self._totals)))
+
+        return self._urls_info
+
+    def _add_entry_count(self, url_info, count):
+        self._totals[url_info['company_name']] += count
+        self._counted_companies.add(url_info['company_name'])
+
+    def _entry_failed(self, url_info, err_msg):
+        # only the company fails, not the whole spider
+        self._err_msgs[url_info['company_name']] = err_msg
+        BaseSpider._log_err(self, '{}: {}'.format(url_info['company_name'], err_msg))
+
+    def _spider_closed(self):
+        self._logger.info('{} companies scraped, {} of them failed'.format(len(self._totals), len(self._err_msgs)))
+
+    def _run_result(self):
+        return '{} companies, {} failed'.format(len(self._totals), len(self._err_msgs))
+
+    def _store_results(self):
+        # as in BaseCwSpider, per company: a partial total is kept with the error of the entry which failed - unless
+        # nothing was counted for the company, or the whole spider failed (e.g. closed early)
+        spider_err_msg = self._err_msg
+        if spider_err_msg is None and self._close_reason not in (None, 'finished'):
+            spider_err_msg = 'Closed before finishing ({})'.format(self._close_reason)
+
+        for company_name, total in self._totals.items():
+            err_msg = self._err_msgs.get(company_name) or spider_err_msg
+            if spider_err_msg is not None or (err_msg is not None and company_name not in self._counted_companies):
+                total = None
+
+            self._store_result(company_name, total, err_msg)
+
+    @classmethod
+    def get_settings(cls):
+        settings = super().get_settings()
+        settings.update({
+            'CW_REGISTRY_PATH': from_root('company_website/registry.csv'),
+            'CONCURRENT_REQUESTS': 32,
+            'COOKIES_DEBUG': False  # too verbose for thousands of companies
+        })
+
+        return settings
+
+
+if __name__ == '__main__':
+    RegistryCwSpider.run_single(RegistryCwSpider.get_settings())
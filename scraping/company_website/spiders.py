@@ -8,7 +8,6 @@ from scraping.company_website.extractions import *
 from scraping.company_website.paginations import *
 from selenium.webdriver.common.by import By
 from scraping.company_website.base_cw_spider import BaseCwSpider
-import time
 import selenium.webdriver.support.expected_conditions as ec
 
 
@@ -94,14 +93,24 @@ class AonCwSpider(BaseCwSpider):
 
             return len(in_uk)
 
-    class Pagination(Pagination):
-        def get_next_url(self, response, extraction):
-            paginator = extraction.driver.find_element_by_class_name('iCIMS_Paginator_Bottom')
+    class Pagination(SeleniumPagination):
+        """The pages are gone through in the same browser, by clicking on the 'next' arrow in the iframe"""
+        def go_to_next_page(self, driver, extraction):
+            paginator = driver.find_element_by_class_name('iCIMS_Paginator_Bottom')
             try:
                 next_arrow = paginator.find_element_by_css_selector('a.glyph:nth-of-type(3)')
-                return next_arrow.get_attribute('href')
             except:
-                return None
+                return False
+
+            if next_arrow.get_attribute('href') is None:
+                return False
+
+            table = driver.find_element_by_class_name('iCIMS_JobsTable')
+            next_arrow.click()
+            wait_for_element(driver, ec.staleness_of(table))
+
+            driver.switch_to.default_content()  # the extraction switches to the iframe again
+            return True
 
     @property
     def urls_info(self):
@@ -171,23 +180,23 @@ class JacobsUkLtdCwSpider(BaseCwSpider):
         return 'JACOBS UK LTD INCL JACOBS UK HOLD LTD&JACOBS PROCESS&JACOBS ONE&JACOBS E&C INTER&JACOBS E&C LTD'
 
     class Extraction(SeleniumExtraction):
+        PAGE_INFO = (By.XPATH, '//span[@id="currentPageInfo"]')
+
         def get_count_via_driver(self, driver, response):
-            time.sleep(5)
+            # the search form is built by scripts after the page loads
+            wait_for_dom_settled(driver, timeout=self.adaptive_timeout('form'))
             wait_for_element(driver, ec.visibility_of_element_located((
                 By.XPATH, '(//input[@role="textbox"])[2]'
-            ))).send_keys('United Kingdom')
+            )), timeout=self.adaptive_timeout('textbox')).send_keys('United Kingdom')
 
-            time.sleep(5)
-            wait_for_element(driver, ec.presence_of_element_located((
+            wait_for_element(driver, ec.element_to_be_clickable((
                 By.XPATH, '//input[@id="search"]'
-            ))).click()
-
-            time.sleep(5)
-            element = wait_for_element(driver, ec.presence_of_element_located((
-                By.XPATH, '//span[@id="currentPageInfo"]'
-            )))
+            )), timeout=self.adaptive_timeout('search')).click()
 
-            return int(re.search(' of (\d+)', element.text).group(1))
+            # the results of the search are shown once the page settles - not waiting for the count to change, as the
+            # search may leave it as it was
+            wait_for_dom_settled(driver, quiet=1, timeout=self.adaptive_timeout('settled'))
+            return wait_for_number(driver, self.PAGE_INFO, r' of (\d+)', timeout=self.adaptive_timeout('count'))
 
     @property
     def urls_info(self):
@@ -0,0 +1,252 @@
+"""
+Long-running scraping service. Keeps one warm process - imports, loggers, reactor, the browser pools and the DNS cache
+stay up between jobs - and runs the spiders of every job submitted to it, all in the shared mode (see
+BaseSpider.setup_for_shared_exec). Instead of cold-starting `run.py` from cron, submit jobs to it.
+
+Jobs are submitted:
+- over HTTP on 127.0.0.1 (only): POST /jobs with a JSON job spec, GET /jobs and GET /jobs/<job id> for their status
+- or as JSON files (job specs) put into the spool folder (data/daemon/spool/), picked up every SPOOL_POLL_INTERVAL s
+
+A job spec looks like {"spiders": ["cw", "careerjet"]} (same names as for run.py), with optional arguments of the
+spiders, e.g. a slice of the registry: {"spiders": ["registry-cw"], "args": {"registry-cw": {"offset": 0, "limit": 500}}}
+Only the arguments a spider declares in its job_args can be given. Each spider is closed after its time_limit (or
+JOB_TIME_LIMIT), and idle browsers are quit once no job is running.
+
+The HTTP API only accepts requests whose Host is 127.0.0.1:<port> (or localhost:<port>), and jobs posted as
+application/json - so that web pages open in a browser on the machine (the Chromes of Selenium included) can not
+submit jobs, neither with a cross-origin request nor through DNS rebinding.
+
+Each job is a run of the run manifest (see manifest_helper) - its id is the run id, and its status are the states and
+results of its spiders. Start the daemon with `python run.py --daemon`, submit with `python run.py --submit cw`.
+"""
+
+import collections
+import glob
+import json
+import os
+import time
+import urllib.request
+
+from twisted.internet import defer, reactor, task, threads
+from twisted.web import resource, server
+
+import scraping.support.log_helper as lg
+import scraping.support.manifest_helper as manifest_helper
+import scraping.support.selenium_helper as sel_helper
+from scraping.base_spider import BaseSpider
+from scraping.support.common import *
+
+
+DAEMON_PORT = 8613
+SPOOL_FOLDER = 'daemon/spool/'  # relative to the data folder
+SPOOL_POLL_INTERVAL = 10  # s
+JOB_TIME_LIMIT = 24 * 3600  # s after which a spider of a job is closed, unless the spider has its own time_limit
+
+
+class Job:
+    def __init__(self, job_id, spider_names, args):
+        self.id = job_id
+        self.spider_names = spider_names
+        self.args = args  # spider name -> its init kwargs
+
+        self.state = 'queued'  # -> 'running' -> 'done'
+        self.submitted = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'spiders': self.spider_names,
+            'args': self.args,
+            'submitted': self.submitted,
+            'finished': self.finished,
+            'runs': manifest_helper.get_manifest().get_run(self.id)
+        }
+
+
+class ScrapingDaemon:
+    """
+    Runs the jobs submitted to it. get_spiders turns the spider names of a job spec into the spider classes (see
+    runner.get_spiders). All the methods must be called from the reactor thread
+    """
+
+    def __init__(self, get_spiders, spool_folder=None):
+        self._get_spiders = get_spiders
+        self._spool_folder = spool_folder or from_data_root(SPOOL_FOLDER)
+        self._jobs = collections.OrderedDict()  # job id -> job
+
+    def submit(self, spec):
+        """Starts the job given by the spec (see the module's doc) and returns it"""
+        spiders = self._get_spiders(spec.get('spiders', []))
+        if len(spiders) == 0:
+            raise ValueError('No spiders to run for {}'.format(spec.get('spiders')))
+
+        args = spec.get('args', {})
+        _check_args(spiders, args)
+
+        run_id = manifest_helper.get_manifest().new_run([spider.name for spider in spiders])
+
+        job = Job(run_id, [spider.name for spider in spiders], args)
+        self._jobs[job.id] = job
+        lg.deflog.info('Job {} submitted: {}'.format(job.id, job.spider_names))
+
+        deferreds = []
+        for spider in spiders:
+            settings = spider.get_settings()
+            settings.update(spider.get_run_settings(run_id))
+            settings['CLOSESPIDER_TIMEOUT'] = spider.time_limit or JOB_TIME_LIMIT
+            deferreds.append(spider.setup_for_shared_exec(settings, **args.get(spider.name, {})))
+
+        job.state = 'running'
+        defer.DeferredList(deferreds).addBoth(lambda _: self.__job_finished(job))
+
+        return job
+
+    def __job_finished(self, job):
+        job.state = 'done'
+        job.finished = time.time()
+
+        lg.deflog.info('Job {} done in {:.0f}s: {}'.format(job.id, job.finished - job.submitted, [
+            (run['spider'], run['state'], run['result']) for run in manifest_helper.get_manifest().get_run(job.id)]))
+
+        # browsers kept warm for the next job would hold memory needed by other runs on the machine meanwhile
+        if all([j.state == 'done' for j in self._jobs.values()]):
+            threads.deferToThread(sel_helper.get_pool().close_idle)
+
+    def get_job(self, job_id):
+        return self._jobs.get(job_id)
+
+    def get_jobs(self):
+        return list(self._jobs.values())
+
+    def poll_spool(self):
+        """
+        Submits the job specs in the spool folder. Their files are moved to 'submitted/' (or 'failed/'). Never raises -
+        an exception would stop the LoopingCall polling the spool, silently
+        """
+        try:
+            paths = sorted(glob.glob(os.path.join(self._spool_folder, '*.json')))
+        except Exception as e:
+            lg.deflog.error('Polling the spool folder {} failed: {}'.format(self._spool_folder, e))
+            return
+
+        for path in paths:
+            try:
+                self.__pick_up(path)
+            except Exception as e:
+                lg.deflog.error('Picking up job spec {} failed: {}'.format(path, e))
+
+    def __pick_up(self, path):
+        # the spec is moved out of the spool before its job is submitted - if the move fails, the spec is picked up
+        # again at the next poll, and no job is submitted twice
+        picked = os.path.join(self._spool_folder, 'picked', os.path.basename(path))
+        create_directories_if_necessary(picked)
+        os.replace(path, picked)
+
+        try:
+            with open(picked) as f:
+                job = self.submit(json.load(f))
+            target = os.path.join(self._spool_folder, 'submitted', '{}.json'.format(job.id))
+        except Exception as e:
+            lg.deflog.error('Job spec {} failed: {}'.format(path, e))
+            target = os.path.join(self._spool_folder, 'failed', os.path.basename(path))
+
+        create_directories_if_necessary(target)
+        os.replace(picked, target)
+
+    def serve(self, port=DAEMON_PORT):
+        """Runs the daemon (until the process is stopped)"""
+        BaseSpider.keep_reactor_running = True
+
+        create_directories_if_necessary(self._spool_folder)
+        reactor.listenTCP(port, server.Site(_JobsResource(self, port)), interface='127.0.0.1')
+        task.LoopingCall(self.poll_spool).start(SPOOL_POLL_INTERVAL)
+
+        lg.deflog.info('Scraping daemon listening on 127.0.0.1:{}, spool folder {}'.format(port, self._spool_folder))
+        reactor.run()
+
+
+class _JobsResource(resource.Resource):
+    """The HTTP API of the daemon"""
+    isLeaf = True
+
+    def __init__(self, daemon, port):
+        super().__init__()
+        self._daemon = daemon
+        self._hosts = {'127.0.0.1:{}'.format(port).encode('ascii'), 'localhost:{}'.format(port).encode('ascii')}
+
+    def render_GET(self, request):
+        if request.getHeader(b'host') not in self._hosts:
+            return self.__json(request, 403, {'error': 'Forbidden host'})
+
+        path = [p.decode('utf-8') for p in request.postpath if p]
+
+        if path == ['jobs']:
+            return self.__json(request, 200, [job.to_dict() for job in self._daemon.get_jobs()])
+        elif len(path) == 2 and path[0] == 'jobs' and self._daemon.get_job(path[1]) is not None:
+            return self.__json(request, 200, self._daemon.get_job(path[1]).to_dict())
+
+        return self.__json(request, 404, {'error': 'Not found'})
+
+    def render_POST(self, request):
+        if request.getHeader(b'host') not in self._hosts:
+            return self.__json(request, 403, {'error': 'Forbidden host'})
+        if [p for p in request.postpath if p] != [b'jobs']:
+            return self.__json(request, 404, {'error': 'Not found'})
+        if (request.getHeader(b'content-type') or b'').split(b';')[0].strip() != b'application/json':
+            return self.__json(request, 415, {'error': 'Jobs must be posted as application/json'})
+
+        try:
+            job = self._daemon.submit(json.loads(request.content.read().decode('utf-8')))
+        except Exception as e:
+            return self.__json(request, 400, {'error': str(e)})
+
+        return self.__json(request, 201, job.to_dict())
+
+    def __json(self, request, code, data):
+        request.setResponseCode(code)
+        request.setHeader(b'Content-Type', b'application/json')
+
+        return json.dumps(data).encode('utf-8')
+
+
+def _check_args(spiders, args):
+    """Raises ValueError unless all the args (spider name -> its init kwargs) are declared in job_args of the spiders"""
+    if not isinstance(args, dict):
+        raise ValueError('args must be an object, not {}'.format(args))
+
+    spiders = {spider.name: spider for spider in spiders}
+    for name, kwargs in args.items():
+        if name not in spiders:
+            raise ValueError('Arguments given for {}, which is not run by the job'.format(name))
+        if not isinstance(kwargs, dict):
+            raise ValueError('Arguments of {} must be an object, not {}'.format(name, kwargs))
+
+        job_args = spiders[name].job_args
+        for arg, value in kwargs.items():
+            if arg not in job_args:
+                raise ValueError('{} does not take argument {} (it takes {})'.format(name, arg, sorted(job_args)))
+            # JSON true/false would pass for int, as bool subclasses int
+            if not isinstance(value, job_args[arg]) or (isinstance(value, bool) and job_args[arg] is not bool):
+                raise ValueError('Argument {} of {} must be of type {}, not {}'.format(
+                    arg, name, job_args[arg].__name__, value))
+
+
+# ---------------------------------------------------------------------
+# --- Client
+# ---------------------------------------------------------------------
+
+def submit(spec, port=DAEMON_PORT):
+    """Submits the job spec to the daemon running on this machine, returns the job (as dict)"""
+    request = urllib.request.Request('http://127.0.0.1:{}/jobs'.format(port), data=json.dumps(spec).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'}, method='POST')
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def status(job_id=None, port=DAEMON_PORT):
+    """Returns the job (as dict) from the daemon running on this machine, or all its jobs if job_id is None"""
+    url = 'http://127.0.0.1:{}/jobs{}'.format(port, '' if job_id is None else '/' + job_id)
+    with urllib.request.urlopen(url) as response:
+        return json.loads(response.read().decode('utf-8'))
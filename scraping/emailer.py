@@ -2,17 +2,34 @@
 A stub of code that could be extended to send emails, e.g. with diagnostic info about the daily scrape results.
 """
 
+import datetime
+
 import mailjet_rest as mj
 import scraping.support.log_helper as log_helper
 from scraping.support.common import *
 
 
+def latest_results_html(source='company_website', days=7):
+    """
+    Returns an HTML table of the counts of the last days (from the time-series store - only the partitions of these
+    days are read), one row per company
+    """
+    # imported here, as it needs pandas (and pyarrow) - which scraping itself does not
+    import scraping.support.timeseries_helper as timeseries_helper
+
+    end = datetime.date.today()
+    series = timeseries_helper.read_series(source, start=end - datetime.timedelta(days=days - 1), end=end)
+
+    header = [d.strftime('%d/%m') for d in series.index]
+    return series.T.to_html(float_format='{:.0f}'.format, na_rep='-', header=header)
+
+
 def emailer():
     api_key = os.environ['MAILJET_KEY']
     api_secret = os.environ['MAILJET_SECRET']
     mailjet = mj.Client(auth=(api_key, api_secret))
 
-    html = '...construct an email here... e.g. by querying the Database where you stored the results for latest values'
+    html = latest_results_html()
 
     data = {
         'FromEmail': 'email@domain.com',
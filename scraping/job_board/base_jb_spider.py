@@ -2,7 +2,6 @@
 Module with the base class for job-board spiders, i.e. spiders scraping job vacancy counts from job boards.
 """
 
-import pandas as pd
 import scraping.support.general_helper as general_helper
 from scraping.base_spider import BaseSpider
 from scraping.support.common import *
@@ -15,14 +14,17 @@ class BaseJbSpider(BaseSpider):
     def __init__(self, err_queue=None):
         super().__init__(err_queue)
 
+        self.item_pipeline = None  # set by the BatchedItemPipeline when the spider opens
+
     def _store_results(self):
-        feed_uri = self.settings['FEED_URI']
-        df = pd.read_csv(feed_uri)
-        entries = df.to_dict(orient='records')
+        # the items were already written in batches by the pipeline, here we just close it
+        if self.item_pipeline is not None:
+            self.item_pipeline.close()
+
+            self._logger.info('Stored {} items to {}'.format(self.item_pipeline.stored, self.settings['ITEM_SINK_PATH']))
 
-        print('Scraped results:')
-        print(entries)
-        # TODO here you can store the data, e.g. in Mongo database
+    def _run_result(self):
+        return '{} items'.format(self.item_pipeline.stored) if self.item_pipeline is not None else None
 
     def _try_extract(self, extraction_method, *args, **kwargs):
         try:
@@ -31,23 +33,27 @@ class BaseJbSpider(BaseSpider):
             self._logger.error('Error extracting applying {} on {}: {}'.format(extraction_method.__name__, args, e))
             return None
 
+    @classmethod
+    def get_settings(cls):
+        return cls.get_jb_settings()
+
     @classmethod
     def get_jb_settings(cls):
-        # this feed Scrapy setting will cause the spider to save all scraped data in a CSV file
-        # at the path spec. by feed_uri. In other words, the scraped data will be stored in a CSV file
-        # so that when the spider is closing, one can e.g. print the results, or store them in Mongo DB etc...
+        # the item pipeline will store the scraped items, in batches as they come, at the path spec. by sink_path
+        # (by default in a SQLite database). Set ITEM_SINK_BACKEND to 'parquet' or 'mongo' to store them elsewhere
 
-        output_path = 'scraped/job_board/{}_{}.csv'.format(cls.name, general_helper.get_date())
-        feed_uri = from_data_root(output_path, create_if_needed=True)
-        if os.path.exists(feed_uri):
-            os.remove(feed_uri)
+        # an existing database is replaced when the pipeline opens - unless the run is being resumed (RUN_RESUMED)
+        output_path = 'scraped/job_board/{}_{}.sqlite'.format(cls.name, general_helper.get_date())
+        sink_path = from_data_root(output_path, create_if_needed=True)
 
         settings = BaseSpider.get_settings()
         settings.update({
-            'FEED_URI': feed_uri,
-            'FEED_FORMAT': 'csv',
+            'ITEM_PIPELINES': {'scraping.job_board.pipelines.BatchedItemPipeline': 300},
+            'ITEM_SINK_BACKEND': 'sqlite',
+            'ITEM_SINK_PATH': sink_path,
+            'ITEM_SINK_FLUSH_SIZE': 500,
             'CONCURRENT_REQUESTS': 1,
             'DOWNLOAD_DELAY': 3
         })
 
-        return settings
\ No newline at end of file
+        return settings
@@ -10,16 +10,68 @@ import string
 import bs4 as bs
 import scraping.job_board.items as items
 import scrapy
+from lxml import etree
 
 from scraping.job_board.base_jb_spider import BaseJbSpider
 
 
+LETTER_RE = re.compile('jobs/(.).html')
+COUNT_RE = re.compile('\d+')
+BASE_URL = 'http://www.careerjet.co.uk'
+
+PARSERS = ('lxml', 'bs4', 'compare')  # values of the CAREERJET_PARSER setting
+
+
+def extract_companies_lxml(root):
+    """
+    Extracts the company data from the letter page's lxml tree (e.g. Scrapy's response.selector.root) - the same
+    data the BeautifulSoup parsing gives, but with one pass over each cell
+    """
+    table = root.xpath('//div[@id="heart"]')[0].find('.//table')
+
+    return [_extract_company_data_lxml(td) for td in table.iter('td')]
+
+
+def parse_letter_body(body, encoding):
+    """Same as extract_companies_lxml, from the body of the letter page - to be run in the parse process pool"""
+    return extract_companies_lxml(etree.fromstring(body, parser=etree.HTMLParser(encoding=encoding)))
+
+
+def _extract_company_data_lxml(td):
+    a = td.find('.//a')
+
+    # the cell's children as BeautifulSoup lists them (texts and elements), only the first three are needed
+    children = [td.text] if td.text else []
+    for child in td:
+        if len(children) >= 3:
+            break
+        children.append(child.text if isinstance(child, etree._Comment) else child)
+        if child.tail:
+            children.append(child.tail)
+
+    if a is None:
+        name = 'EXTRACT_NAME_ERR (no link)'
+        link = 'EXTRACT_LINK_ERR (no link)'
+    else:
+        title = a.get('title')
+        href = a.get('href')
+        name = title if title is not None else "EXTRACT_NAME_ERR ('title')"
+        link = BASE_URL + href if href is not None else "EXTRACT_LINK_ERR ('href')"
+
+    count = children[2] if len(children) > 2 else None
+    match = COUNT_RE.search(count) if isinstance(count, str) else None
+    count = int(match.group(0)) if match is not None else 'EXTRACT_COUNT_ERR (no count in {!r})'.format(count)
+
+    return {'company_name': name, 'link_internal': link, 'count': count}
+
+
 class CareerjetJb(BaseJbSpider):
     """
     Spider scraping all job vacancy counts from Careerjet.
     """
 
     name = "careerjet"
+    persist_frontier = True  # a restarted run continues from the letter pages not scraped yet
 
     def __init__(self, err_queue=None):
         super().__init__(err_queue=err_queue)
@@ -42,7 +94,8 @@ class CareerjetJb(BaseJbSpider):
         self._logger.info('Scraping from {} start urls'.format(self.name, len(self.urls)))
 
         for url in self.urls:
-            yield scrapy.Request(url=url, callback=self.parse_letter_page)
+            yield self._cached_request(url, '{}|{}'.format(self.name, url),
+                                       callback=self.parse_letter_page, errback=self._errback)
 
     def __extract_company_name(self, td):
         try:
@@ -52,13 +105,13 @@ class CareerjetJb(BaseJbSpider):
 
     def __extract_link(self, td):
         try:
-            return 'http://www.careerjet.co.uk' + td.find('a').attrs['href']
+            return BASE_URL + td.find('a').attrs['href']
         except Exception as e:
             return 'EXTRACT_LINK_ERR ({})'.format(e)
 
     def __extract_count(self, td):
         try:
-            count = re.search('\d+', list(td.children)[2])
+            count = COUNT_RE.search(list(td.children)[2])
             return int(count.group(0))
         except Exception as e:
             return 'EXTRACT_COUNT_ERR ({})'.format(e)
@@ -72,25 +125,78 @@ class CareerjetJb(BaseJbSpider):
 
     def parse_letter_page(self, response):
         """
-        Parsing the response using Beautiful Soup
+        Parsing the response using lxml (Scrapy's selector) or Beautiful Soup, depending on the CAREERJET_PARSER
+        setting. With 'compare', both are used and differences are logged (the Beautiful Soup results are kept).
+
+        If the PARSE_IN_PROCESS_POOL setting is on, the lxml parsing runs in the parse process pool (and a Deferred
+        is returned)
         """
-        letter = re.search('jobs/(.).html', response.url).group(1)
+        letter = LETTER_RE.search(response.url).group(1)
+
+        cached = self._cached_result(response)
+        if cached is not None:
+            self._logger.info('Letter {} did not change, re-using data for {} companies'.format(letter, len(cached)))
+            return [items.CareerjetItem(**entry) for entry in cached]
+        elif response.status == 304:
+            return [self._unconditional_request(response.request)]
+
+        parser = self.settings.get('CAREERJET_PARSER', 'lxml')
+        if parser == 'lxml' and self._parse_in_process_pool():
+            deferred = self._defer_to_parse_process(parse_letter_body, response, response.encoding)
+            deferred.addCallback(lambda entries: self.__letter_parsed(
+                response, letter, [items.CareerjetItem(**entry) for entry in entries]))
+            return deferred
+        elif parser == 'lxml':
+            letter_data = [items.CareerjetItem(**entry) for entry in extract_companies_lxml(response.selector.root)]
+        elif parser == 'bs4':
+            letter_data = self.__parse_with_bs4(response)
+        elif parser == 'compare':
+            letter_data = self.__parse_with_bs4(response)
+            self.__compare(letter, letter_data, extract_companies_lxml(response.selector.root))
+        else:
+            raise ValueError('Unknown parser {}, use one of {}'.format(parser, PARSERS))
+
+        return self.__letter_parsed(response, letter, letter_data)
+
+    def __letter_parsed(self, response, letter, letter_data):
+        self._logger.info('Got data for {} companies for letter {}'.format(len(letter_data), letter))
+        self._cache_result(response, [dict(item) for item in letter_data])
+
+        return letter_data
 
+    def __parse_with_bs4(self, response):
         soup = bs.BeautifulSoup(response.body, 'lxml')
         table = soup.find('div', {'id': 'heart'}).table
         tds = table.find_all('td')
 
-        letter_data = list(map(self.__extract_company_data, tds))
+        return list(map(self.__extract_company_data, tds))
 
-        self._logger.info('Got data for {} companies for letter {}'.format(len(letter_data), letter))
+    def __compare(self, letter, bs4_data, lxml_data):
+        def _normalized(value):
+            # error messages differ between the parsers, only the kind of the error is compared
+            return value.split(' (')[0] if isinstance(value, str) and '_ERR (' in value else value
+
+        if len(bs4_data) != len(lxml_data):
+            self._logger.warning('Parsers differ for letter {}: {} (bs4) vs {} (lxml) companies'.format(
+                letter, len(bs4_data), len(lxml_data)))
+            return
+
+        differences = 0
+        for bs4_entry, lxml_entry in zip(bs4_data, lxml_data):
+            for field in ('company_name', 'link_internal', 'count'):
+                if _normalized(bs4_entry[field]) != _normalized(lxml_entry[field]):
+                    differences += 1
+                    self._logger.warning('Parsers differ for letter {}, {}: {!r} (bs4) vs {!r} (lxml)'.format(
+                        letter, field, bs4_entry[field], lxml_entry[field]))
 
-        yield from letter_data
+        self._logger.info('Parsers compared for letter {}: {} differences'.format(letter, differences))
 
     @classmethod
     def get_jb_settings(cls):
         settings = super().get_jb_settings()
         settings.update({
-            'FEED_EXPORT_FIELDS': ['company_name', 'link_internal', 'count'],
+            'ITEM_SINK_FIELDS': ['company_name', 'link_internal', 'count'],
+            'CAREERJET_PARSER': 'lxml'  # see PARSERS
         })
 
         return settings
@@ -0,0 +1,68 @@
+"""
+Item pipelines for the job-board spiders
+"""
+
+import scraping.support.store_helper as store_helper
+
+
+class BatchedItemPipeline:
+    """
+    Writes the scraped items to an item sink (see store_helper) in batches, as they are scraped - so the memory used
+    does not grow with the size of the job board.
+
+    Settings:
+    - ITEM_SINK_BACKEND: 'sqlite', 'parquet' or 'mongo'
+    - ITEM_SINK_PATH: where to store the items (file path, or Mongo uri)
+    - ITEM_SINK_FIELDS: fields of the items to store
+    - ITEM_SINK_FLUSH_SIZE: number of items written at once
+
+    Items stored by an earlier run in the sink at ITEM_SINK_PATH are removed, unless the run is being resumed (see
+    BaseSpider.get_run_settings). The sink is closed by the spider, when storing its results (see BaseJbSpider._store_results)
+    """
+
+    def __init__(self, backend, path, fields, flush_size):
+        self._backend = backend
+        self._path = path
+        self._fields = fields
+        self._flush_size = flush_size
+
+        self._sink = None
+        self._batch = []
+        self.stored = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get('ITEM_SINK_BACKEND', 'sqlite'),
+            settings.get('ITEM_SINK_PATH'),
+            settings.getlist('ITEM_SINK_FIELDS', ['company_name', 'count']),
+            settings.getint('ITEM_SINK_FLUSH_SIZE', 500)
+        )
+
+    def open_spider(self, spider):
+        if not spider.settings.getbool('RUN_RESUMED', False):
+            store_helper.remove_sink_files(self._backend, self._path)
+
+        self._sink = store_helper.open_sink(self._backend, self._path, spider.name, self._fields)
+        spider.item_pipeline = self
+
+    def process_item(self, item, spider):
+        self._batch.append({f: item.get(f) for f in self._fields})
+        if len(self._batch) >= self._flush_size:
+            self.flush()
+
+        return item
+
+    def close_spider(self, spider):
+        self.flush()
+
+    def flush(self):
+        if len(self._batch) > 0:
+            self._sink.insert_many(self._batch)
+            self.stored += len(self._batch)
+            self._batch = []
+
+    def close(self):
+        self.flush()
+        self._sink.close()
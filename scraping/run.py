@@ -1,33 +1,55 @@
 """
 A script to run the whole scraping from command line, using command line arguments.
 
-Also implements option to run spiders in parallel by invoking separate python processes for each spider.
+Also implements option to run spiders in parallel by running each spider in a separate (pre-warmed) python process.
 
 Run e.g. as `python3 run.py -s 3 careerjet aecom-cw halfords-cw`
 
 Or `python3 run.py -s 5 cw` to run all Company website spiders with 5 spiders in parallel
+
+Or `python3 run.py -m cw` to run all Company website spiders in one process, sharing one concurrency budget
+
+Or `python3 run.py registry-cw` to scrape all the companies in the company website registry (see registry.py)
+
+Every run is recorded in the run manifest (see manifest_helper) - an interrupted run can be continued with
+`python3 run.py --resume <run id>`, which skips the spiders that finished already
+
+In the super parallel mode, the longest spiders (as measured in earlier runs) are started first - see the schedule
+with e.g. `python3 run.py -s 5 --dry-run cw`
+
+Or `python3 run.py --daemon` to keep a warm scraping service running (see daemon.py), and `python3 run.py --submit cw`
+to run spiders in it - `python3 run.py --status [<job id>]` shows its jobs
 """
 
 import getopt
-import inspect
+import json
 import multiprocessing as mp
-import os
-import queue
-import subprocess
 import sys
+import threading
 
 import scraping.emailer as emailer
+import scraping.runner as runner
 import scraping.support.log_helper as lg
+import scraping.support.manifest_helper as manifest_helper
+import scraping.support.schedule_helper as schedule_helper
+import scraping.support.watchdog_helper as watchdog_helper
 from scraping.base_spider import BaseSpider
 
-import scraping.company_website.spiders as cw_spiders
-from scraping.job_board.careerjet import CareerjetJb
-
 SEP = '*' * 50
 SEPNL = SEP + '\n'
 NLSEP = '\n' + SEP
 NLSEPNL = '\n' + SEP + '\n'
 
+SPIDER_TIME_LIMIT = 24 * 3600  # default maximum running time of a spider in the super parallel mode - day
+MAX_BROWSER_SPIDERS = 2  # maximum number of spiders using a browser running at once in the super parallel mode
+
+# modules imported by the forkserver of the super parallel mode, before it forks the spider processes - so that these
+# start warm. None of them may import twisted.internet.reactor (scrapy and the spiders do not, see runner.py): that
+# installs the reactor, whose epoll and waker pipe would then be shared by all the forked spiders. With '__main__',
+# the forked processes do not import this script again. Modules which can not be imported are skipped
+FORKSERVER_PRELOAD = ['__main__', 'lxml.etree', 'lxml.html', 'bs4', 'selenium.webdriver', 'pandas', 'sqlite3', 'json',
+                      'scrapy', 'scrapy.crawler', 'scraping.base_spider', 'scraping.runner']
+
 
 def print_help():
     lg.deflog.info('''HELP
@@ -38,81 +60,142 @@ Run as:
 
 Options:
  -s / --super-parallel <S> run the super parallel mode (S spiders in parallel)
+ -m / --shared             run all spiders in this process, sharing concurrency limits and connections
  -e / --email              run emailer after scraping
+ --resume <run id>         resume the given run - only the spiders which did not finish are run (all of the run's
+                           spiders, unless some are given as args)
+ --max-browser <B>         run at most B spiders using a browser at once in the super parallel mode (default 2)
+ --dry-run                 only print the predicted schedule and total running time of the spiders
+ --time-limit <T>          terminate a spider still running after T seconds in the super parallel mode (default a day)
+ --max-rss <M>             terminate a spider whose processes (browsers included) use over M MB in the super
+                           parallel mode (default no limit). Spiders can set their own limits, see BaseSpider
+ --daemon                  run the scraping daemon - a warm process running the jobs submitted to it (see daemon.py)
+ --submit                  submit the spiders given as args as a job to the daemon running on this machine
+ --status                  print the jobs of the daemon running on this machine (only the job given as arg, if any)
     ''')
 
 
-def _run_in_parallel(spiders, retry_count, parellelism):
-    # This is a way to run spiders truly in parallel
-    # It's a bit of a hack - this script is simply called several times with by invoking a new Python process
+def _run_in_parallel(spiders, retry_count, parellelism, run_id, resumed, max_browser, time_limit, max_rss):
+    # This is a way to run spiders truly in parallel - every spider runs in its own process, which isolates crashes
+    # and gives each spider a fresh reactor (Scrapy's reactor is not restartable).
+    # The processes are forked from a forkserver which imports the heavy libraries (see FORKSERVER_PRELOAD) only once,
+    # so they start warm. The workers are just threads feeding spider names to those processes, in the order given
+    # by the scheduler (longest spiders first, see schedule_helper), and watching them (see watchdog_helper).
 
-    popens = []
+    context = mp.get_context('forkserver')
+    context.set_forkserver_preload(FORKSERVER_PRELOAD)
 
-    this_dir = os.path.dirname(os.path.realpath(__file__))
-    os.chdir(this_dir)
+    manifest = manifest_helper.get_manifest()
+    scheduler = schedule_helper.SpiderScheduler(
+        spiders, schedule_helper.estimate_durations(spiders, manifest), max_browser)
 
-    popens.extend([['python', 'run.py', spider.name] for spider in spiders])
-
-    popens = [popen[:-1] + ['-l', lg.get_file_name()] + popen[-1:] for popen in popens]
-
-    if retry_count is not None:
-        popens = [popen[:-1] + ['-r', str(retry_count)] + popen[-1:] for popen in popens]
-
-    popen_queue = mp.Queue()
-    for popen in popens:
-        popen_queue.put(popen)
-
-    def _worker(i, popen_queue):
+    def _worker(i):
         while True:
-            try:
-                popen = popen_queue.get(timeout=5)
-            except queue.Empty:
+            spider = scheduler.next_spider()
+            if spider is None:
                 lg.deflog.info('{}Worker {} DONE{}'.format(NLSEPNL, i, NLSEP))
                 return
 
-            lg.deflog.info('{}Worker {} starting {}{}'.format(NLSEPNL, i, popen[-1], NLSEP))
+            spider_name = spider.name
+
+            lg.deflog.info('{}Worker {} starting {}{}'.format(NLSEPNL, i, spider_name, NLSEP))
 
-            proc = subprocess.Popen(popen)
+            # the reservation of the spider (e.g. its browser) must be given back whatever happens, or the other
+            # workers would wait for it forever
             try:
-                proc.wait(24 * 3600)  # maximum running time - day
-            except subprocess.TimeoutExpired as e:
-                lg.deflog.info('Worker {} exception for {}: {}'.format(i, popen[-1], e))
+                proc = context.Process(target=runner.run_spider,
+                                       args=(spider_name, lg.get_file_name(), retry_count, run_id, resumed))
+                proc.start()
+
+                spider_max_rss = spider.max_rss or max_rss
+                reason = watchdog_helper.watch(proc, spider.time_limit or time_limit,
+                                               spider_max_rss * 2 ** 20 if spider_max_rss else None)
 
-    processes = [mp.Process(target=_worker, args=[i, popen_queue]) for i in range(parellelism)]
-    for p in processes:
-        p.start()
+                # the spider records its own state, unless it was terminated or its process died before it could
+                if reason is not None:
+                    lg.deflog.error('Worker {}: {} TIMED OUT - terminated, {}'.format(i, spider_name, reason))
+                    manifest.set_state(run_id, spider_name, manifest_helper.TIMED_OUT, reason)
+                elif manifest.get_state(run_id, spider_name) in (manifest_helper.PENDING, manifest_helper.RUNNING):
+                    result = 'process exited with code {}'.format(proc.exitcode)
+                    lg.deflog.error('Worker {}: {} failed, {}'.format(i, spider_name, result))
+                    manifest.set_state(run_id, spider_name, manifest_helper.KILLED, result)
+            except Exception as e:
+                lg.deflog.error('Worker {}: error running {}: {}'.format(i, spider_name, e))
+            finally:
+                scheduler.spider_finished(spider)
 
-    for p in processes:
-        p.join()
+    workers = [threading.Thread(target=_worker, args=[i]) for i in range(parellelism)]
+    for w in workers:
+        w.start()
 
+    for w in workers:
+        w.join()
 
-def run(spider_names, parellelism, retry_count, email):
-    # here we build the list of spiders classes that we want to run
-    spiders = []
 
-    jbs = [CareerjetJb]
-    jbs = [jb for jb in jbs if jb.name in spider_names]
-    spiders.extend(jbs)
+def _print_schedule(spiders, parellelism, max_browser):
+    durations = schedule_helper.estimate_durations(spiders, manifest_helper.get_manifest())
+    schedule, makespan = schedule_helper.predict_schedule(spiders, durations, parellelism, max_browser)
 
-    # company website spiders
-    cws = [i[1] for i in inspect.getmembers(cw_spiders, inspect.isclass) if
-           str(i[0]).endswith('Spider') and str(i[0]) != 'BaseCwSpider']
-    cws = [cw for cw in cws if cw.name in spider_names or 'cw' in spider_names]
-    spiders.extend(cws)
+    lg.deflog.info('Predicted schedule of {} spiders on {} workers (at most {} using a browser at once):'.format(
+        len(spiders), parellelism, max_browser))
+    for worker, spider_name, start, end in schedule:
+        lg.deflog.info('  worker {:>2}  {:>8.0f}s - {:>8.0f}s  {}'.format(worker, start, end, spider_name))
+    lg.deflog.info('Predicted total running time: {:.0f}s'.format(makespan))
 
 
+def _print_summary(run_id):
+    """Prints the state and result (retries included, see BaseSpider._retry_summary) of each spider of the run"""
+    lg.deflog.info('{}Run {}:'.format(NLSEPNL, run_id))
+    for run in manifest_helper.get_manifest().get_run(run_id):
+        lg.deflog.info('  {:<30} {:<10} {}'.format(run['spider'], run['state'], run['result'] or ''))
+    lg.deflog.info(SEP)
+
+
+def _start_run(spider_names, resume_run_id):
+    """Returns the spiders to run and the id of the run - a new one, or resume_run_id without its finished spiders"""
+    manifest = manifest_helper.get_manifest()
+
+    if resume_run_id is None:
+        spiders = runner.get_spiders(spider_names)
+        run_id = manifest.new_run([spider.name for spider in spiders])
+        lg.deflog.info('Run {} - if interrupted, resume it with --resume {}'.format(run_id, run_id))
+
+        return spiders, run_id
+
+    spiders = runner.get_spiders(spider_names or manifest.spiders(resume_run_id))
+    manifest.add_spiders(resume_run_id, [spider.name for spider in spiders])
+
+    done = manifest.spiders(resume_run_id, states=[manifest_helper.DONE])
+    lg.deflog.info('Resuming run {} - skipping {} finished spiders: {}'.format(resume_run_id, len(done), done))
+
+    return [spider for spider in spiders if spider.name not in done], resume_run_id
+
+
+def run(spider_names, parellelism, retry_count, email, shared=False, resume_run_id=None,
+        max_browser=MAX_BROWSER_SPIDERS, dry_run=False, time_limit=SPIDER_TIME_LIMIT, max_rss=None):
+    if dry_run:
+        _print_schedule(runner.get_spiders(spider_names), parellelism or 1, max_browser)
+        return
+
+    spiders, run_id = _start_run(spider_names, resume_run_id)
+    resumed = resume_run_id is not None
+
     # now let's run those spiders!
     if parellelism is not None:
-        _run_in_parallel(spiders, retry_count, parellelism)
-    else:
+        _run_in_parallel(spiders, retry_count, parellelism, run_id, resumed, max_browser, time_limit, max_rss)
+    elif shared:
         for spider in spiders:
             settings = spider.get_settings()
-            if retry_count is None:
-                spider.setup_for_multiple_exec(settings)
-            else:
-                spider.run_with_retry(settings, retry_count)
+            settings.update(spider.get_run_settings(run_id, resumed))
+            if retry_count is not None:
+                settings.update(spider.get_retry_settings(retry_count))
+            spider.setup_for_shared_exec(settings)
 
         BaseSpider.start_multiple_execution()
+    else:
+        runner.run_sequentially(spiders, retry_count, run_id, resumed)
+
+    _print_summary(run_id)
 
     if email:
         lg.deflog.info(SEP)
@@ -127,7 +210,10 @@ def main():
     argv = sys.argv[1:]
 
     try:
-        opts, args = getopt.getopt(argv, 'hs:er:l:', ['help', 'super-parallel=', 'email', 'retry=', 'log='])
+        opts, args = getopt.getopt(argv, 'hs:mer:l:',
+                                   ['help', 'super-parallel=', 'shared', 'email', 'retry=', 'log=', 'resume=',
+                                    'max-browser=', 'dry-run', 'time-limit=', 'max-rss=', 'daemon', 'submit',
+                                    'status'])
     except getopt.GetoptError:
         print('Wrong options')
         sys.exit()
@@ -136,23 +222,55 @@ def main():
     parellelism = None
     email = False
     retry_count = None
+    shared = False
+    resume_run_id = None
+    max_browser = MAX_BROWSER_SPIDERS
+    dry_run = False
+    time_limit = SPIDER_TIME_LIMIT
+    max_rss = None
     for opt, arg in opts:
         if opt in ('-h', '--help'):
             print_help()
             sys.exit()
         elif opt in ('-s', '--super-parallel'):
             parellelism = int(arg)
+        elif opt in ('-m', '--shared'):
+            shared = True
         elif opt in ('-e', '--email'):
             email = True
         elif opt in ('-r', '--retry'):
             retry_count = int(arg)
         elif opt in ('-l', '--log'):
             lg.set_file_name(arg)
+        elif opt == '--resume':
+            resume_run_id = arg
+        elif opt == '--max-browser':
+            max_browser = max(1, int(arg))
+        elif opt == '--dry-run':
+            dry_run = True
+        elif opt == '--time-limit':
+            time_limit = int(arg)
+        elif opt == '--max-rss':
+            max_rss = int(arg)
+        elif opt == '--daemon':
+            import scraping.daemon as daemon  # only here - it imports the reactor, see FORKSERVER_PRELOAD
+            daemon.ScrapingDaemon(runner.get_spiders).serve()
+            return
+        elif opt == '--submit':
+            import scraping.daemon as daemon
+            job = daemon.submit({'spiders': spider_names_to_run})
+            lg.deflog.info('Job {} submitted: {}'.format(job['id'], job['spiders']))
+            return
+        elif opt == '--status':
+            import scraping.daemon as daemon
+            lg.deflog.info(json.dumps(daemon.status(args[0] if args else None), indent=2))
+            return
         else:
             print('Wrong options')
             sys.exit()
 
-    run(spider_names_to_run, parellelism, retry_count, email)
+    run(spider_names_to_run, parellelism, retry_count, email, shared, resume_run_id, max_browser, dry_run, time_limit,
+        max_rss)
 
 
 if __name__ == '__main__':
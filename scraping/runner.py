@@ -0,0 +1,60 @@
+"""
+Running spiders by name - used by run.py, and importable by the processes of its super parallel mode, which are forked
+from a forkserver that imported this module (and so the spiders) already.
+
+Nothing here imports the Twisted reactor - importing it installs it, and the forked spider processes must each install
+their own.
+"""
+
+import inspect
+
+import scraping.support.log_helper as lg
+import scraping.support.selenium_helper as sel_helper
+from scraping.base_spider import BaseSpider
+
+import scraping.company_website.spiders as cw_spiders
+from scraping.company_website.registry_spider import RegistryCwSpider
+from scraping.job_board.careerjet import CareerjetJb
+
+
+def get_spiders(spider_names):
+    # here we build the list of spiders classes that we want to run
+    spiders = []
+
+    jbs = [CareerjetJb]
+    jbs = [jb for jb in jbs if jb.name in spider_names]
+    spiders.extend(jbs)
+
+    # company website spiders
+    cws = [i[1] for i in inspect.getmembers(cw_spiders, inspect.isclass) if
+           str(i[0]).endswith('Spider') and str(i[0]) != 'BaseCwSpider']
+    cws = [cw for cw in cws if cw.name in spider_names or 'cw' in spider_names]
+    spiders.extend(cws)
+
+    # the registry spider only runs when asked for by name ('cw' means all the bespoke spiders)
+    if RegistryCwSpider.name in spider_names:
+        spiders.append(RegistryCwSpider)
+
+    return spiders
+
+
+def run_sequentially(spiders, retry_count, run_id, resumed):
+    for spider in spiders:
+        settings = spider.get_settings()
+        settings.update(spider.get_run_settings(run_id, resumed))
+        if retry_count is None:
+            spider.setup_for_multiple_exec(settings)
+        else:
+            spider.run_with_retry(settings, retry_count)
+
+    BaseSpider.start_multiple_execution()
+
+
+def run_spider(spider_name, log_file_name, retry_count, run_id, resumed):
+    """Runs a single spider, in a process of the super parallel mode"""
+    lg.set_file_name(log_file_name)
+
+    run_sequentially(get_spiders([spider_name]), retry_count, run_id, resumed)
+
+    # processes of the super parallel mode end without running the atexit hooks
+    sel_helper.close_pool()
@@ -0,0 +1,332 @@
+"""
+Helper classes for caching data on disk. The caches are SQLite files under the data folder, so they are shared by all
+spiders and processes on the machine, and survive between runs.
+"""
+
+import collections
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import types
+
+from scraping.support.common import *
+
+
+def open_db(path):
+    """
+    Opens a SQLite database which is safe to use from more threads (serialize access with a lock) and more processes
+    """
+    create_directories_if_necessary(path)
+
+    connection = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+    connection.execute('PRAGMA journal_mode=WAL')  # readers do not block the writer (and vice versa)
+    connection.execute('PRAGMA synchronous=NORMAL')
+
+    return connection
+
+
+class ResponseCache:
+    """
+    Cache of response validators (ETag, Last-Modified, hash of the body), stored together with the result extracted
+    from the response (e.g. the count). Later runs send the validators in a conditional request - if the server
+    answers 304, or the body is identical, the cached result is re-used instead of extracting it again.
+
+    Entries expire after `ttl` seconds. If the results stored exceed `max_bytes`, the least recently used are evicted.
+    """
+
+    def __init__(self, path, ttl, max_bytes):
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._db = open_db(path)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            body_hash TEXT,
+            result TEXT,
+            size INTEGER,
+            stored_at REAL,
+            used_at REAL
+        )''')
+
+    def __get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT etag, last_modified, body_hash, result FROM responses WHERE key = ? AND stored_at > ?',
+                (key, time.time() - self._ttl)).fetchone()
+
+        return row
+
+    def conditional_headers(self, key):
+        """Returns headers making the request for the given key conditional (empty if nothing is cached)"""
+        row = self.__get(key)
+        if row is None:
+            return {}
+
+        etag, last_modified, _, _ = row
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+
+        return headers
+
+    def lookup(self, key, response):
+        """Returns the result cached for the key if the response is unchanged (304 or same body), None otherwise"""
+        row = self.__get(key)
+        if row is None:
+            return None
+
+        _, _, body_hash, result = row
+        if response.status != 304 and _hash(response.body) != body_hash:
+            return None
+
+        with self._lock:
+            self._db.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+
+        return json.loads(result)
+
+    def store(self, key, response, result):
+        """Caches the result extracted from the (200) response"""
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        result = json.dumps(result)
+        now = time.time()
+
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                key,
+                etag.decode('latin-1') if etag is not None else None,
+                last_modified.decode('latin-1') if last_modified is not None else None,
+                _hash(response.body),
+                result,
+                len(result),
+                now,
+                now
+            ))
+
+            self.__evict()
+
+    def __evict(self):
+        self._db.execute('DELETE FROM responses WHERE stored_at <= ?', (time.time() - self._ttl,))
+
+        size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if size <= self._max_bytes:
+            return
+
+        # drop least recently used entries until the cache fits
+        to_delete = []
+        for key, entry_size in self._db.execute('SELECT key, size FROM responses ORDER BY used_at'):
+            if size <= self._max_bytes:
+                break
+            to_delete.append((key,))
+            size -= entry_size
+
+        self._db.executemany('DELETE FROM responses WHERE key = ?', to_delete)
+
+
+class ExtractionPathStore:
+    """
+    Remembers, per extraction, which way of extracting the count worked last time ('static' or 'browser') and when
+    that was checked. See extractions.HybridExtraction
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = open_db(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS paths (key TEXT PRIMARY KEY, path TEXT, checked_at REAL)')
+
+    def get(self, key):
+        """Returns tuple (path, time when it was checked), or (None, None) if nothing is known"""
+        with self._lock:
+            row = self._db.execute('SELECT path, checked_at FROM paths WHERE key = ?', (key,)).fetchone()
+
+        return row if row is not None else (None, None)
+
+    def set(self, key, path):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO paths VALUES (?, ?, ?)', (key, path, time.time()))
+
+
+class LatencyStore:
+    """
+    Keeps the last latencies (s) of browser waits and page loads, per key (extraction and wait), from which adaptive
+    timeouts are computed. See extractions.AdaptiveTimeout
+    """
+    MAX_SAMPLES = 50  # per key
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = open_db(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS latencies (key TEXT, seconds REAL, recorded_at REAL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS latencies_key ON latencies (key, recorded_at)')
+
+    def get(self, key):
+        """Returns the last latencies recorded under key, most recent first"""
+        with self._lock:
+            rows = self._db.execute('SELECT seconds FROM latencies WHERE key = ? ORDER BY recorded_at DESC LIMIT ?',
+                                    (key, self.MAX_SAMPLES)).fetchall()
+
+        return [r[0] for r in rows]
+
+    def add(self, key, seconds):
+        with self._lock:
+            self._db.execute('INSERT INTO latencies VALUES (?, ?, ?)', (key, seconds, time.time()))
+            self._db.execute('''DELETE FROM latencies WHERE key = ? AND recorded_at <
+                                (SELECT MIN(recorded_at) FROM (SELECT recorded_at FROM latencies WHERE key = ?
+                                                               ORDER BY recorded_at DESC LIMIT ?))''',
+                             (key, key, self.MAX_SAMPLES))
+
+
+class HostCache:
+    """
+    Values looked up per host - the robots.txt of a host, or the address a host name resolves to - which expire after
+    `ttl` seconds. Hits and misses of the lookups in this process are counted in `stats`. See host_cache_helper
+    """
+
+    def __init__(self, path, ttl):
+        self._ttl = ttl
+        self.stats = collections.Counter()
+
+        self._lock = threading.Lock()
+        self._db = open_db(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS hosts (host TEXT PRIMARY KEY, value BLOB, stored_at REAL)')
+
+    def get(self, host):
+        """Returns the value stored for the host, or None if there is none (or it expired)"""
+        with self._lock:
+            row = self._db.execute('SELECT value FROM hosts WHERE host = ? AND stored_at > ?',
+                                   (host, time.time() - self._ttl)).fetchone()
+            self.stats['hits' if row is not None else 'misses'] += 1
+
+        return row[0] if row is not None else None
+
+    def set(self, host, value):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO hosts VALUES (?, ?, ?)', (host, value, time.time()))
+            self._db.execute('DELETE FROM hosts WHERE stored_at <= ?', (time.time() - self._ttl,))
+
+
+def _hash(body):
+    return hashlib.sha1(body).hexdigest()
+
+
+def fingerprint(value):
+    """
+    Returns a hash of the value, to be made part of a cache key which must change whenever the value does - e.g. of the
+    url_info entries whose counts are cached. Objects (extractions, paginations, ...) are described by their class,
+    including the code of its methods, and by their attributes (except for the logger)
+    """
+    return _hash(repr(_describe(value, 0)).encode('utf-8'))
+
+
+def _describe(value, depth):
+    if depth > 8:  # cycles, or objects which are not specs
+        return '...'
+    elif value is None or isinstance(value, (str, bytes, int, float)):
+        return value
+    elif isinstance(value, re.Pattern):
+        return 're', value.pattern, value.flags
+    elif isinstance(value, dict):
+        return 'dict', sorted((str(k), _describe(v, depth + 1)) for k, v in value.items() if k != '_logger')
+    elif isinstance(value, (list, tuple)):
+        return type(value).__name__, [_describe(v, depth + 1) for v in value]
+    elif isinstance(value, types.CodeType):
+        return 'code', value.co_code, value.co_names, [_describe(c, depth + 1) for c in value.co_consts]
+    elif isinstance(value, (staticmethod, classmethod)):
+        return _describe(value.__func__, depth)
+    elif isinstance(value, property):
+        return _describe(value.fget, depth)
+    elif isinstance(value, types.FunctionType):
+        return _describe(value.__code__, depth)
+    elif isinstance(value, type):
+        # the attributes and methods defined in the class and its bases
+        return value.__module__, value.__qualname__, [
+            _describe({k: v for k, v in vars(c).items() if not k.startswith('__')}, depth + 1)
+            for c in value.__mro__ if c is not object]
+    elif hasattr(value, '__dict__'):
+        return _describe(type(value), depth + 1), _describe(vars(value), depth + 1)
+
+    return type(value).__qualname__
+
+
+_response_cache = None
+_instances_lock = threading.Lock()
+
+
+def get_response_cache(settings):
+    """Returns the response cache of this process, created with the given (Scrapy) settings on first call"""
+    global _response_cache
+
+    with _instances_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                from_data_root(settings.get('RESPONSE_CACHE_PATH', 'cache/responses.sqlite')),
+                settings.getfloat('RESPONSE_CACHE_TTL', 7 * 24 * 3600),
+                settings.getint('RESPONSE_CACHE_MAX_BYTES', 50 * 1024 * 1024)
+            )
+
+    return _response_cache
+
+
+_extraction_path_store = None
+
+
+def get_extraction_path_store():
+    """Returns the extraction path store of this process"""
+    global _extraction_path_store
+
+    with _instances_lock:
+        if _extraction_path_store is None:
+            _extraction_path_store = ExtractionPathStore(from_data_root('cache/extraction_paths.sqlite'))
+
+    return _extraction_path_store
+
+
+_latency_store = None
+
+
+def get_latency_store():
+    """Returns the latency store of this process"""
+    global _latency_store
+
+    with _instances_lock:
+        if _latency_store is None:
+            _latency_store = LatencyStore(from_data_root('cache/latencies.sqlite'))
+
+    return _latency_store
+
+
+_robots_cache = None
+
+
+def get_robots_cache(settings):
+    """Returns the robots.txt cache of this process, created with the given (Scrapy) settings on first call"""
+    global _robots_cache
+
+    with _instances_lock:
+        if _robots_cache is None:
+            _robots_cache = HostCache(from_data_root('cache/robots.sqlite'),
+                                      settings.getfloat('ROBOTSTXT_CACHE_TTL', 24 * 3600))
+
+    return _robots_cache
+
+
+_dns_cache = None
+
+
+def get_dns_cache(settings):
+    """Returns the DNS cache of this process, created with the given (Scrapy) settings on first call"""
+    global _dns_cache
+
+    with _instances_lock:
+        if _dns_cache is None:
+            _dns_cache = HostCache(from_data_root('cache/dns.sqlite'), settings.getfloat('DNS_CACHE_TTL', 3600))
+
+    return _dns_cache
@@ -0,0 +1,109 @@
+"""
+Scrapy components letting many crawlers in one process behave like one crawler towards the network.
+
+Every crawler has its own downloader (and so its own concurrency limits and connection pool). When hundreds of spiders
+run in one process (see BaseSpider.setup_for_shared_exec), these components make them share:
+- one global concurrency budget and one per-domain concurrency budget (SharedBudgetMiddleware)
+- one pool of persistent HTTP connections (SharedPoolDownloadHandler)
+
+The budgets are shared within the process only (not with spiders of other processes), and limits which Scrapy itself
+enforces - e.g. CONCURRENT_REQUESTS_PER_IP - stay per crawler.
+
+Needs Scrapy 2.0+, where process_request of a downloader middleware may return a Deferred.
+"""
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+
+
+class SharedBudgetMiddleware:
+    """
+    Downloader middleware holding a request until both a global slot and a slot for its domain are free. The slots are
+    shared by all crawlers in the process, and are released once the response (or exception) comes back.
+
+    Settings:
+    - SHARED_CONCURRENT_REQUESTS: max. number of requests in flight across all crawlers
+    - SHARED_CONCURRENT_REQUESTS_PER_DOMAIN: max. number of requests in flight to one domain across all crawlers
+    """
+
+    _global_semaphore = None
+    _domain_semaphores = {}
+
+    def __init__(self, total, per_domain):
+        cls = type(self)
+        if cls._global_semaphore is None:
+            cls._global_semaphore = defer.DeferredSemaphore(total)
+
+        self._per_domain = per_domain
+        self._held = {}  # request -> semaphores it acquired
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler.settings.getint('SHARED_CONCURRENT_REQUESTS', 64),
+            crawler.settings.getint('SHARED_CONCURRENT_REQUESTS_PER_DOMAIN', 8)
+        )
+
+    def _domain_semaphore(self, request):
+        domain = urlparse_cached(request).hostname or ''
+        semaphores = type(self)._domain_semaphores
+        if domain not in semaphores:
+            semaphores[domain] = defer.DeferredSemaphore(self._per_domain)
+
+        return semaphores[domain]
+
+    def process_request(self, request, spider):
+        # domain first - a request waiting for its (busy) domain should not take a global slot from other domains
+        semaphores = [self._domain_semaphore(request), type(self)._global_semaphore]
+
+        deferred = defer.succeed(None)
+        for semaphore in semaphores:
+            deferred.addCallback(lambda _, s=semaphore: s.acquire())
+
+        def _acquired(_):
+            self._held[request] = semaphores
+            return None
+
+        return deferred.addCallback(_acquired)
+
+    def process_response(self, request, response, spider):
+        self._release(request)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        self._release(request)
+
+    def _release(self, request):
+        for semaphore in self._held.pop(request, []):
+            semaphore.release()
+
+
+class SharedPoolDownloadHandler(HTTP11DownloadHandler):
+    """
+    The default HTTP(S) download handler, except that all instances in the process share one HTTP connection pool,
+    so a connection opened by one spider can be re-used by another spider talking to the same host
+    """
+
+    _shared_pool = None
+    _users = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        cls = type(self)
+        if cls._shared_pool is None:
+            cls._shared_pool = self._pool
+        else:
+            self._pool = cls._shared_pool
+        cls._users += 1
+
+    def close(self):
+        cls = type(self)
+        cls._users -= 1
+        if cls._users > 0:
+            return defer.succeed(None)
+
+        # last user closes the pool
+        cls._shared_pool = None
+        return super().close()
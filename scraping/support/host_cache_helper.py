@@ -0,0 +1,99 @@
+"""
+Scrapy components keeping the robots.txt rules and DNS resolutions of hosts on disk (see cache_helper.HostCache), so
+that they are shared by all spiders and processes on the machine and survive between runs - many company websites are
+hosted by the same few ATS hosts (taleo.net, icims.com, ...), whose robots.txt would otherwise be fetched again by every
+spider and run:
+- DiskCachedRobotsTxtMiddleware replaces Scrapy's RobotsTxtMiddleware (see BaseSpider.get_settings)
+- DiskCachedResolver is installed on the reactor with install_resolver (see BaseSpider.setup_for_multiple_exec)
+
+Settings:
+- ROBOTSTXT_CACHE_TTL: for how long (s) a fetched robots.txt is used
+- DNS_CACHE_TTL: for how long (s) a resolved address is used
+"""
+
+from scrapy.downloadermiddlewares.robotstxt import RobotsTxtMiddleware
+from scrapy.resolver import CachingThreadedResolver, dnscache
+from scrapy.settings import Settings
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import defer
+
+import scraping.support.cache_helper as cache_helper
+
+
+class DiskCachedRobotsTxtMiddleware(RobotsTxtMiddleware):
+    """RobotsTxtMiddleware which parses the robots.txt of a host from the disk cache, if it is there"""
+
+    def __init__(self, crawler):
+        super().__init__(crawler)
+        self._disk_cache = cache_helper.get_robots_cache(crawler.settings)
+
+    def robot_parser(self, request, spider):
+        netloc = urlparse_cached(request).netloc
+        if netloc not in self._parsers:
+            body = self._disk_cache.get(netloc)
+            if body is not None:
+                self._parsers[netloc] = self._parserimpl.from_crawler(self.crawler, body)
+
+        return super().robot_parser(request, spider)
+
+    def _parse_robots(self, response, netloc, spider):
+        # error pages (5xx, 403, captchas...) are not the host's robots.txt, only a 404 says there is none
+        if 200 <= response.status < 300:
+            self._disk_cache.set(netloc, response.body)
+        elif response.status == 404:
+            self._disk_cache.set(netloc, b'')
+        super()._parse_robots(response, netloc, spider)
+
+
+class DiskCachedResolver(CachingThreadedResolver):
+    """
+    The default resolver of Scrapy, which looks a host name up in the disk cache before resolving it. Addresses found
+    in the disk cache are not put to Scrapy's in-process cache, which never expires - so that DNS_CACHE_TTL applies in
+    long-running processes (e.g. the scraping daemon) too
+    """
+
+    def __init__(self, reactor, cache_size, timeout, disk_cache):
+        super().__init__(reactor, cache_size, timeout)
+        self._disk_cache = disk_cache
+
+    def getHostByName(self, name, timeout=None):
+        address = self._disk_cache.get(name)
+        if address is not None:
+            return defer.succeed(address)
+
+        return super().getHostByName(name, timeout).addCallback(self.__store, name)
+
+    def __store(self, address, name):
+        self._disk_cache.set(name, address)
+        dnscache.pop(name, None)  # looked up in the disk cache from now on, so that it expires
+        return address
+
+
+_resolver_installed = False
+
+
+def install_resolver(settings):
+    """
+    Installs DiskCachedResolver on the reactor, unless it is installed already. Scrapy only installs its resolver when
+    crawling with a CrawlerProcess - not with the CrawlerRunners used by BaseSpider
+    """
+    from twisted.internet import reactor
+
+    global _resolver_installed
+
+    if _resolver_installed:
+        return
+
+    settings = Settings(settings)
+    if settings.getbool('DNSCACHE_ENABLED'):
+        DiskCachedResolver(reactor, settings.getint('DNSCACHE_SIZE'), settings.getfloat('DNS_TIMEOUT'),
+                           cache_helper.get_dns_cache(settings)).install_on_reactor()
+    _resolver_installed = True
+
+
+def get_stats(settings):
+    """Returns the hits and misses of the robots.txt and DNS caches in this process, as a dict"""
+    return {
+        'robots.txt': dict(cache_helper.get_robots_cache(settings).stats),
+        'dns': dict(cache_helper.get_dns_cache(settings).stats)
+    }
@@ -0,0 +1,125 @@
+"""
+Helper class for the run manifest - the state of every spider of a run (of run.py), so that a run which was
+interrupted (machine restarted, orchestrator killed, ...) can be resumed without re-running the spiders which finished.
+
+The manifest is a SQLite file under the data folder, written by run.py and by the spiders themselves (which may run in
+other processes).
+"""
+
+import datetime
+import os
+import threading
+import time
+
+import scraping.support.cache_helper as cache_helper
+from scraping.support.common import *
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'  # finished, but with errors
+KILLED = 'killed'  # closed before finishing (e.g. terminated or shut down), or its process died
+TIMED_OUT = 'timed-out'  # terminated by the watchdog of run.py, see watchdog_helper
+
+MANIFEST_PATH = 'runs/runs.sqlite'  # relative to the data folder
+
+
+class RunManifest:
+    """
+    Table spider_runs, with one row per (run, spider): its state (PENDING, RUNNING, DONE, FAILED, KILLED or
+    TIMED_OUT), result (a short summary, or the error) and when it started and finished
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = cache_helper.open_db(path)
+        self._db.execute('''CREATE TABLE IF NOT EXISTS spider_runs (
+            run_id TEXT,
+            spider TEXT,
+            state TEXT,
+            result TEXT,
+            started REAL,
+            finished REAL,
+            PRIMARY KEY (run_id, spider)
+        )''')
+
+    def new_run(self, spider_names):
+        """Registers a new run of the spiders (all pending) and returns its id"""
+        run_id = '{}-{}'.format(datetime.datetime.now().strftime('%Y%m%d-%H%M%S'), os.getpid())
+        self.add_spiders(run_id, spider_names)
+
+        return run_id
+
+    def add_spiders(self, run_id, spider_names):
+        with self._lock:
+            self._db.executemany('INSERT OR IGNORE INTO spider_runs (run_id, spider, state) VALUES (?, ?, ?)',
+                                 [(run_id, name, PENDING) for name in spider_names])
+
+    def spiders(self, run_id, states=None):
+        """Returns the names of the spiders of the run (only of those in the given states, if any)"""
+        with self._lock:
+            rows = self._db.execute('SELECT spider, state FROM spider_runs WHERE run_id = ? ORDER BY rowid',
+                                    (run_id,)).fetchall()
+
+        return [spider for spider, state in rows if states is None or state in states]
+
+    def get_run(self, run_id):
+        """Returns the spiders of the run, as dicts with their state, result, started and finished"""
+        with self._lock:
+            rows = self._db.execute('''SELECT spider, state, result, started, finished FROM spider_runs
+                                      WHERE run_id = ? ORDER BY rowid''', (run_id,)).fetchall()
+
+        return [dict(zip(('spider', 'state', 'result', 'started', 'finished'), row)) for row in rows]
+
+    def get_state(self, run_id, spider):
+        with self._lock:
+            row = self._db.execute('SELECT state FROM spider_runs WHERE run_id = ? AND spider = ?',
+                                   (run_id, spider)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def durations(self, spider_names, last=5):
+        """
+        Returns the mean duration (s) of the last runs of each of the spiders which finished by themselves (with errors
+        or not), for those run before - killed and timed out runs say nothing about how long the spider takes
+        """
+        durations = {}
+        with self._lock:
+            for name in spider_names:
+                rows = self._db.execute('''SELECT finished - started FROM spider_runs
+                                          WHERE spider = ? AND state IN (?, ?) AND started IS NOT NULL
+                                          ORDER BY finished DESC LIMIT ?''', (name, DONE, FAILED, last)).fetchall()
+                if len(rows) > 0:
+                    durations[name] = sum(r[0] for r in rows) / len(rows)
+
+        return durations
+
+    def set_state(self, run_id, spider, state, result=None):
+        with self._lock:
+            if state == RUNNING:
+                self._db.execute('''INSERT INTO spider_runs (run_id, spider, state, started) VALUES (?, ?, ?, ?)
+                                    ON CONFLICT (run_id, spider) DO UPDATE SET
+                                    state = excluded.state, result = NULL, started = excluded.started, finished = NULL
+                                 ''', (run_id, spider, state, time.time()))
+            else:
+                self._db.execute('''UPDATE spider_runs SET state = ?, result = ?, finished = ?
+                                    WHERE run_id = ? AND spider = ?''',
+                                 (state, None if result is None else str(result), time.time(), run_id, spider))
+
+
+_manifest = None
+_manifest_pid = None
+_manifest_lock = threading.Lock()
+
+
+def get_manifest():
+    """Returns the run manifest, opened once per process (a forked process must not use its parent's connection)"""
+    global _manifest, _manifest_pid
+
+    with _manifest_lock:
+        if _manifest is None or _manifest_pid != os.getpid():
+            _manifest = RunManifest(from_data_root(MANIFEST_PATH))
+            _manifest_pid = os.getpid()
+
+    return _manifest
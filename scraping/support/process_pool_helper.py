@@ -0,0 +1,72 @@
+"""
+Helper methods for parsing responses in a pool of processes. Parsing big pages is CPU-heavy and, because of the GIL,
+it would otherwise block the reactor (and so the downloads of all the spiders in the process). With the pool, one
+reactor keeps the network busy while the parsing uses all the cores.
+
+The body of the response is handed to the worker process through shared memory, instead of being pickled.
+
+Needs Python 3.8+ (multiprocessing.shared_memory) - only imported when PARSE_IN_PROCESS_POOL is on.
+"""
+
+import concurrent.futures as futures
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+from twisted.internet import defer, reactor
+
+
+PARSE_PROCESSES = os.cpu_count()
+
+_executor = None
+
+
+def get_executor(processes=PARSE_PROCESSES):
+    """Returns the process pool of this process, created with the given number of processes on first call"""
+    global _executor
+
+    if _executor is None:
+        # spawned, not forked - forking a process with a running reactor (and its threads) is not safe
+        _executor = futures.ProcessPoolExecutor(max_workers=processes, mp_context=mp.get_context('spawn'))
+        reactor.addSystemEventTrigger('during', 'shutdown', lambda: _executor.shutdown(wait=False))
+
+    return _executor
+
+
+def defer_to_parse_process(f, body, *args, processes=PARSE_PROCESSES):
+    """
+    Calls f(body, *args) in the process pool and returns a Deferred firing with the result. Must be called from
+    the reactor thread. f must be a module-level function and the args and the result must be picklable. The body
+    (bytes) is passed through shared memory.
+    """
+    memory = shared_memory.SharedMemory(create=True, size=max(1, len(body)))
+    memory.buf[:len(body)] = body
+
+    future = get_executor(processes).submit(_call_with_shared_body, f, memory.name, len(body), args)
+    deferred = defer.Deferred()
+
+    def _done(future):
+        memory.close()
+        memory.unlink()
+
+        if future.exception() is not None:
+            reactor.callFromThread(deferred.errback, future.exception())
+        else:
+            reactor.callFromThread(deferred.callback, future.result())
+
+    future.add_done_callback(_done)
+
+    return deferred
+
+
+def _call_with_shared_body(f, memory_name, size, args):
+    # the memory is owned (and unlinked, which unregisters it from the resource tracker shared with the parent) by
+    # the parent - only the creator unregisters it
+    memory = shared_memory.SharedMemory(name=memory_name)
+
+    try:
+        body = bytes(memory.buf[:size])
+    finally:
+        memory.close()
+
+    return f(body, *args)
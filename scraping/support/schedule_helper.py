@@ -0,0 +1,101 @@
+"""
+Helper classes for scheduling the spiders of the super parallel mode (see run.py).
+
+Spiders are started longest first (LPT - longest processing time first), with their durations estimated from the
+earlier runs recorded in the run manifest. This keeps a slow spider from starting last and stretching the whole run.
+Besides, at most max_browser spiders using a browser (Selenium) run at the same time, as they are the ones heavy on
+memory and CPU.
+"""
+
+import heapq
+import threading
+
+
+DEF_DURATION = 10 * 60  # estimated duration (s) of a spider never run before, if no spider was
+
+
+def estimate_durations(spiders, manifest):
+    """
+    Returns the estimated duration of each spider (name -> s): its mean duration in the last runs, or for spiders not
+    run before the median duration of those which were
+    """
+    names = [spider.name for spider in spiders]
+    durations = manifest.durations(names)
+
+    known = sorted(durations.values())
+    default = known[len(known) // 2] if len(known) > 0 else DEF_DURATION
+
+    return {name: durations.get(name, default) for name in names}
+
+
+class SpiderScheduler:
+    """
+    Hands out the spiders to the workers (threads) of the super parallel mode, longest first. A browser-heavy spider
+    (see BaseSpider.uses_browser) is not handed out while max_browser of them are running - a worker asking for a
+    spider then gets the longest one not using a browser, or waits if there is none.
+    """
+
+    def __init__(self, spiders, durations, max_browser=None):
+        self._pending = sorted(spiders, key=lambda s: durations[s.name], reverse=True)
+        self._max_browser = max_browser
+        self._browser_running = 0
+        self._condition = threading.Condition()
+
+    def next_spider(self):
+        """Returns the next spider to run, or None if there are no more spiders. May block (see above)"""
+        with self._condition:
+            while len(self._pending) > 0:
+                for spider in self._pending:
+                    if not self.__is_capped(spider):
+                        self._pending.remove(spider)
+                        if spider.uses_browser():
+                            self._browser_running += 1
+                        return spider
+
+                self._condition.wait()
+
+        return None
+
+    def spider_finished(self, spider):
+        with self._condition:
+            if spider.uses_browser():
+                self._browser_running -= 1
+            self._condition.notify_all()
+
+    def __is_capped(self, spider):
+        return spider.uses_browser() and self._max_browser is not None and self._browser_running >= self._max_browser
+
+
+def predict_schedule(spiders, durations, workers, max_browser=None):
+    """
+    Simulates the run of the spiders by the given number of workers, scheduled as by SpiderScheduler. Returns the
+    schedule - list of (worker, spider name, start, end), in the order of start - and the makespan (both in s)
+    """
+    pending = sorted(spiders, key=lambda s: durations[s.name], reverse=True)
+    free_workers = [(0, i) for i in range(workers)]  # (time the worker is free from, worker)
+    running_browser = []  # end times of the browser-heavy spiders running
+    schedule = []
+
+    while len(pending) > 0:
+        now, worker = heapq.heappop(free_workers)
+        running_browser = [end for end in running_browser if end > now]
+
+        capped = max_browser is not None and len(running_browser) >= max_browser
+        candidates = [s for s in pending if not (capped and s.uses_browser())]
+        if len(candidates) == 0:
+            # only browser-heavy spiders are left - the worker waits for one of those running to finish
+            heapq.heappush(free_workers, (min(running_browser), worker))
+            continue
+
+        spider = candidates[0]
+        pending.remove(spider)
+        end = now + durations[spider.name]
+        if spider.uses_browser():
+            running_browser.append(end)
+
+        schedule.append((worker, spider.name, now, end))
+        heapq.heappush(free_workers, (end, worker))
+
+    makespan = max([end for _, _, _, end in schedule] + [0])
+
+    return schedule, makespan
@@ -2,43 +2,229 @@
 
 import selenium.webdriver as wd
 import scraping.support.general_helper as general_helper
+import scraping.support.log_helper as lg
 from scraping.support.common import *
 import selenium as se
+from twisted.internet import threads
+from twisted.python.threadpool import ThreadPool
+import threading
+import atexit
+import collections
+import json
+import os
 import time
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows - the browser budget is not enforced there, see get_budget
+    fcntl = None
+
 
 DEF_WAIT = 20
 
+POOL_MAX_SIZE = 4  # maximum number of Chrome instances alive at the same time (per process)
+POOL_MAX_USES = 50  # a driver is recycled (quit and re-launched) after this many checkouts
+LAUNCH_RETRY_WAIT = 20
+PAGE_LOAD_TIMEOUT = 120
 
-def get_driver():
-    # this is here cause if many spiders request a driver, it demands lots of memory. So it can error out
-    # the solution here is not ideal - ideally there would be a pool of drivers wrapped in Disposable object.
-    # But so far I was lazy and this works!
-    while True:
-        try:
-            options = se.webdriver.ChromeOptions()
-            options.headless = True
+BROWSER_WORKERS = POOL_MAX_SIZE  # number of threads running blocking browser code off the reactor thread
+
+BROWSER_SLOTS = max(1, (os.cpu_count() or 2) // 2)  # max. number of Chromes in use on the machine, see BrowserBudget
+BROWSER_MIN_FREE_MB = 700  # memory which must be available to launch one more Chrome
+BUDGET_POLL_INTERVAL = 1
+
+
+# ---------------------------------------------------------------------
+# --- Browser profiles
+# ---------------------------------------------------------------------
+
+# urls blocked by the lean profile - the resources not needed for reading a count from the page
+BLOCKED_RESOURCES = [
+    # images
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp',
+    # fonts
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    # media
+    '*.mp4', '*.webm', '*.ogg', '*.mp3', '*.wav', '*.m3u8',
+    # analytics, ads and other trackers
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*googlesyndication.com*',
+    '*facebook.net*', '*connect.facebook.*', '*hotjar.com*', '*hs-analytics.net*', '*linkedin.com/px*',
+    '*bat.bing.com*', '*adservice.google.*', '*newrelic.com*', '*nr-data.net*', '*optimizely.com*',
+    '*quantserve.com*', '*scorecardresearch.com*', '*twitter.com/i/adsct*', '*ads-twitter.com*'
+]
+
+
+class BrowserProfile:
+    """
+    How Chrome is launched and set up:
+
+    - blocked_urls: url patterns (with * wildcards) never downloaded (set with CDP Network.setBlockedURLs)
+    - allowed_domains: if given, only these hosts (patterns like *.taleo.net allowed) are resolved - any other host
+      (e.g. third-party scripts) fails to load
+    - block_images: do not even render images
+    - arguments: extra command line arguments of Chrome
+    - window_size: (width, height)
+
+    Drivers of all the profiles are kept in one pool, bounded in total (see get_pool)
+    """
+
+    def __init__(self, name, blocked_urls=(), allowed_domains=None, block_images=False, arguments=(),
+                 window_size=(1200, 800)):
+        self.name = name
+        self.blocked_urls = list(blocked_urls)
+        self.allowed_domains = allowed_domains
+        self.block_images = block_images
+        self.arguments = list(arguments)
+        self.window_size = window_size
+
+    def allowing(self, *domains):
+        """Returns a copy of the profile resolving only the given domains, e.g. the site of a spider and its ATS"""
+        return BrowserProfile('{}[{}]'.format(self.name, ','.join(domains)), self.blocked_urls, list(domains),
+                              self.block_images, self.arguments, self.window_size)
+
+    def chrome_options(self):
+        options = se.webdriver.ChromeOptions()
+        options.headless = True
+
+        options.add_argument('--ignore-ssl-errors')
+        options.add_argument('--ssl-protocol=any')
+        options.add_argument('--ignore-certificate-errors')
+        options.add_argument("--test-type")
+        for argument in self.arguments:
+            options.add_argument(argument)
+
+        if self.allowed_domains is not None:
+            options.add_argument('--host-resolver-rules=MAP * ~NOTFOUND, {}'.format(
+                ', '.join(['EXCLUDE {}'.format(d) for d in self.allowed_domains])))
+        if self.block_images:
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+        options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+
+        return options
 
-            options.add_argument('--ignore-ssl-errors')
-            options.add_argument('--ssl-protocol=any')
-            options.add_argument('--ignore-certificate-errors')
-            options.add_argument("--test-type")
+    def apply(self, driver):
+        """Sets up a launched driver"""
+        driver.set_window_size(*self.window_size)
 
+        if len(self.blocked_urls) > 0:
+            driver.execute_cdp_cmd('Network.enable', {})
+            driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.blocked_urls})
+
+    def __eq__(self, other):
+        return isinstance(other, BrowserProfile) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return 'BrowserProfile({})'.format(self.name)
+
+
+DEFAULT_PROFILE = BrowserProfile('default')
+
+LEAN_PROFILE = BrowserProfile(
+    'lean',
+    blocked_urls=BLOCKED_RESOURCES,
+    block_images=True,
+    arguments=['--disable-gpu', '--disable-extensions', '--disable-dev-shm-usage', '--disable-background-networking',
+               '--disable-component-update', '--disable-default-apps', '--disable-sync', '--mute-audio',
+               '--no-first-run'],
+    window_size=(1024, 768)
+)
+
+
+def get_driver(profile=DEFAULT_PROFILE):
+    """
+    Launches a brand new Chrome driver with the given profile. Prefer borrowing a driver from the pool (see
+    get_pool()), this is only exposed for the pool itself and for one-off scripts.
+    """
+    # if many spiders request a driver at once, it demands lots of memory, so it can error out - hence the retry
+    while True:
+        try:
             capabilities = se.webdriver.DesiredCapabilities().CHROME
             capabilities['acceptSslCerts'] = True
+            capabilities['goog:loggingPrefs'] = {'performance': 'ALL'}  # the network events, see PageLoadStats
 
-            driver = wd.Chrome(desired_capabilities=capabilities, chrome_options=options)
+            driver = wd.Chrome(desired_capabilities=capabilities, chrome_options=profile.chrome_options())
             break
         except OSError:
-            time.sleep(20)
+            time.sleep(LAUNCH_RETRY_WAIT)
 
-    driver.set_page_load_timeout(120)
-    driver.set_window_size(1200, 800)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    profile.apply(driver)
     driver.set_window_position(-10000, 0)
 
     return driver
 
 
+# load time and number of resources of the page the driver is on, as reported by the browser's Performance API. Not
+# the bytes - its transferSize is 0 for resources of other origins not sending Timing-Allow-Origin
+PAGE_LOAD_SCRIPT = '''
+    var navigation = performance.getEntriesByType('navigation')[0];
+    return [navigation ? navigation.loadEventEnd - navigation.startTime : 0,
+            performance.getEntriesByType('resource').length];
+'''
+
+
+def network_bytes(driver):
+    """
+    Returns the bytes the driver downloaded (encodedDataLength of the CDP Network.loadingFinished events in its
+    performance log) since the last call, or None if its performance log can not be read. Reading the log empties it
+    """
+    try:
+        entries = driver.get_log('performance')
+    except Exception:
+        return None
+
+    total = 0
+    for entry in entries:
+        message = json.loads(entry['message'])['message']
+        if message['method'] == 'Network.loadingFinished':
+            total += message['params']['encodedDataLength']
+
+    return total
+
+
+class PageLoadStats:
+    """
+    Bytes downloaded and load times of the pages loaded with each profile - logged when the pool is closed. The bytes
+    are those downloaded by the driver since the last page was recorded, or it was checked in to the pool
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # profile name -> [pages, bytes, load time (ms), resources]
+
+    def record(self, profile, driver):
+        """Records the page the driver just loaded. Returns (bytes, load time in ms, number of resources)"""
+        try:
+            load_ms, resources = driver.execute_script(PAGE_LOAD_SCRIPT)
+        except Exception:
+            return None
+
+        page_bytes = network_bytes(driver)
+        if page_bytes is None:
+            return None
+
+        with self._lock:
+            stats = self._stats.setdefault(profile.name, [0, 0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += page_bytes
+            stats[2] += load_ms
+            stats[3] += resources
+
+        return page_bytes, load_ms, resources
+
+    def summary(self):
+        with self._lock:
+            return {name: {'pages': pages, 'kb_avg': total_bytes / pages / 1024, 'load_ms_avg': load_ms / pages,
+                           'resources_avg': resources / pages}
+                    for name, (pages, total_bytes, load_ms, resources) in self._stats.items()}
+
+
+page_load_stats = PageLoadStats()
+
+
 def screenshot(driver, logger):
     """Saves a screenshot from the current driver"""
     screenshot_path = from_root('log/screenshots/{}_{}.png'.format(
@@ -50,6 +236,425 @@ def screenshot(driver, logger):
     driver.save_screenshot(screenshot_path)
 
 
+# ---------------------------------------------------------------------
+# --- Browser budget
+# ---------------------------------------------------------------------
+
+class BrowserBudget:
+    """
+    Machine-wide budget of Chrome instances in use, shared by all the processes (e.g. of the super parallel mode)
+    through lock files in folder - there are `slots` slot files, each locked (flock) by a process for as long as one
+    of its browsers is borrowed from the pool. Idle browsers kept warm by a pool do not hold a slot, so they can not
+    starve the threads and processes waiting for one. A slot for launching a new browser is only granted if at least
+    min_free_mb of memory is available (MemAvailable).
+
+    Waiting threads and processes queue on the gate file (each thread opens it on its own, so they queue on it like
+    processes do), and only the first of them looks for a free slot - so slots are granted in (about) the order they
+    were asked for. The locks are released by the OS if a process dies.
+    """
+
+    def __init__(self, folder, slots=BROWSER_SLOTS, min_free_mb=BROWSER_MIN_FREE_MB):
+        self._folder = folder
+        self._slots = slots
+        self._min_free_mb = min_free_mb
+
+        create_directories_if_necessary(folder)
+
+    def configure(self, slots, min_free_mb):
+        self._slots = slots
+        self._min_free_mb = min_free_mb
+
+    def acquire(self, need_memory=True):
+        """
+        Blocks until a slot is granted, and returns it. The slot must be released with release(). need_memory is False
+        for a browser which is running already (an idle one of the pool), for which no more memory is needed
+        """
+        t = time.time()
+        waiting = False
+
+        with open(os.path.join(self._folder, 'gate.lock'), 'a') as gate:
+            fcntl.flock(gate, fcntl.LOCK_EX)
+            try:
+                while True:
+                    slot = self.__try_slot()
+                    free_mb = _available_memory_mb()
+                    if slot is not None and (not need_memory or free_mb is None or free_mb >= self._min_free_mb):
+                        break
+
+                    if slot is not None:
+                        self.release(slot, log=False)
+                    if not waiting:
+                        waiting = True
+                        lg.deflog.info('Waiting for a browser slot (budget of {} browsers, {} MB available, {} MB '
+                                       'needed)'.format(self._slots, free_mb, self._min_free_mb))
+                    time.sleep(BUDGET_POLL_INTERVAL)
+            finally:
+                fcntl.flock(gate, fcntl.LOCK_UN)
+
+        # slots are taken for every checkout from the pool, only those which had to wait are worth a log
+        (lg.deflog.info if waiting else lg.deflog.debug)(
+            'Browser slot {}/{} granted to process {} after {:.1f}s ({} MB available)'.format(
+                slot[0] + 1, self._slots, os.getpid(), time.time() - t, free_mb))
+
+        return slot
+
+    def release(self, slot, log=True):
+        index, lock_file = slot
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+        if log:
+            lg.deflog.debug('Browser slot {}/{} released by process {}'.format(index + 1, self._slots, os.getpid()))
+
+    def __try_slot(self):
+        for index in range(self._slots):
+            lock_file = open(os.path.join(self._folder, 'slot-{}.lock'.format(index)), 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return index, lock_file
+            except BlockingIOError:
+                lock_file.close()
+
+        return None
+
+
+def _available_memory_mb():
+    """MemAvailable of /proc/meminfo in MB, None where it is not known"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+
+    return None
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget():
+    """
+    Returns the browser budget of this process (the budget itself is shared by all processes on the machine), or None
+    where it is not supported (no flock)
+    """
+    global _budget
+
+    with _budget_lock:
+        if _budget is None and fcntl is not None:
+            _budget = BrowserBudget(from_data_root('runs/browser_slots/'))
+
+    return _budget
+
+
+# ---------------------------------------------------------------------
+# --- Driver pool
+# ---------------------------------------------------------------------
+
+class DriverPool:
+    """
+    Bounded pool of warm Chrome drivers, of any browser profiles. Drivers are borrowed with checkout(profile) and must
+    be given back with checkin().
+
+    - at most max_size drivers exist at the same time (of all the profiles together), checkout() blocks until one is
+      free. If the pool is full, an idle driver of another profile is quit to make room for the one asked for
+    - a driver is health-checked before being handed out and reset (cookies, storage, frames, page load timeout) when
+      returned
+    - a driver is recycled after max_uses checkouts, or when it is returned as crashed
+    - the time spent waiting in checkout() and launching drivers is recorded (separately), see stats()
+    - with a budget (see BrowserBudget), a driver is only handed out once the budget grants it a slot, which it holds
+      until it is checked in
+    """
+
+    def __init__(self, max_size=POOL_MAX_SIZE, max_uses=POOL_MAX_USES, launcher=get_driver, budget=None):
+        self._max_size = max_size
+        self._max_uses = max_uses
+        self._launcher = launcher  # profile -> new driver
+        self._budget = budget
+        self._slots = {}  # borrowed driver -> its slot of the budget
+
+        self._cond = threading.Condition()
+        self._idle = collections.OrderedDict()  # profile -> its idle drivers
+        self._profiles = {}  # driver -> its profile, for all drivers alive (idle or borrowed)
+        self._uses = {}  # driver -> number of checkouts so far, for all drivers alive (idle or borrowed)
+        self._launching = 0
+
+        self._checkouts = 0
+        self._launches = 0
+        self._recycles = 0
+        self._evictions = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._launch_total = 0.0
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    def resize(self, max_size):
+        with self._cond:
+            self._max_size = max_size
+            self._cond.notify_all()
+
+    def checkout(self, profile=DEFAULT_PROFILE):
+        """Borrows a driver of the profile from the pool, launching a new one if there is no idle one"""
+        t = time.time()
+        launching_time = 0.0
+
+        driver = None
+        while driver is None:
+            evicted = None
+            with self._cond:
+                while len(self._idle.get(profile, [])) == 0 and self._alive() >= self._max_size and \
+                        self._idle_count() == 0:
+                    self._cond.wait()
+
+                if len(self._idle.get(profile, [])) > 0:
+                    driver = self._idle[profile].pop()
+                else:
+                    if self._alive() >= self._max_size:
+                        evicted = self._pop_idle()  # the least recently used profile makes room
+                        self._uses.pop(evicted)  # no longer counted as alive, it is quit outside of the lock
+                        self._evictions += 1
+                    self._launching += 1  # reserves the place while launching outside of the lock
+
+            if evicted is not None:
+                self._discard(evicted)
+
+            if driver is None:
+                slot = None
+                try:
+                    slot = self._budget.acquire() if self._budget is not None else None
+                    launch_start = time.time()
+                    driver = self._launcher(profile)
+                    launching_time += time.time() - launch_start
+                except BaseException:
+                    if slot is not None:
+                        self._budget.release(slot)
+                    raise
+                finally:
+                    with self._cond:
+                        self._launching -= 1
+                        self._cond.notify()  # if the launch failed, a waiting thread can launch instead
+                with self._cond:
+                    self._uses[driver] = 0
+                    self._profiles[driver] = profile
+                    self._slots[driver] = slot
+                    self._launches += 1
+                    self._launch_total += launching_time
+            elif not self._is_healthy(driver):
+                self._discard(driver)
+                driver = None
+            elif self._budget is not None:
+                # the idle driver runs already - it only needs a slot, not more memory
+                try:
+                    slot = self._budget.acquire(need_memory=False)
+                except BaseException:
+                    self.checkin(driver)
+                    raise
+                with self._cond:
+                    self._slots[driver] = slot
+
+        waited = time.time() - t - launching_time
+        with self._cond:
+            self._uses[driver] += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+        return driver
+
+    def checkin(self, driver, crashed=False):
+        """Returns a borrowed driver. Crashed or worn-out drivers are quit instead of being reused"""
+        if driver is None:
+            return
+
+        with self._cond:
+            uses = self._uses.get(driver, 0)
+            slot = self._slots.pop(driver, None)
+
+        if slot is not None:
+            self._budget.release(slot)
+
+        if crashed or uses >= self._max_uses or not self._reset(driver):
+            with self._cond:
+                self._recycles += 1
+            self._discard(driver)
+            return
+
+        with self._cond:
+            # the pool was closed or shrunk (see resize) meanwhile - the driver is not kept
+            keep = self._alive() <= self._max_size
+            if keep:
+                profile = self._profiles[driver]
+                self._idle.setdefault(profile, []).append(driver)
+                self._idle.move_to_end(profile)
+                self._cond.notify_all()  # waiting for this profile, or for any idle driver to evict
+
+        if not keep:
+            self._discard(driver)
+
+    def close(self):
+        """Quits all idle drivers. Borrowed drivers are quit when they are checked in"""
+        with self._cond:
+            self._max_size = 0
+
+        self.close_idle()
+
+    def close_idle(self):
+        """Quits all idle drivers, but keeps the pool usable (e.g. between the jobs of the scraping daemon)"""
+        with self._cond:
+            idle = [driver for drivers in self._idle.values() for driver in drivers]
+            self._idle.clear()
+
+        for driver in idle:
+            self._discard(driver)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'checkouts': self._checkouts,
+                'launches': self._launches,
+                'recycles': self._recycles,
+                'evictions': self._evictions,
+                'alive': self._alive(),
+                'idle': self._idle_count(),
+                'wait_avg': self._wait_total / self._checkouts if self._checkouts > 0 else 0.0,
+                'wait_max': self._wait_max,
+                'launch_avg': self._launch_total / self._launches if self._launches > 0 else 0.0
+            }
+
+    def _alive(self):
+        return len(self._uses) + self._launching
+
+    def _idle_count(self):
+        return sum([len(drivers) for drivers in self._idle.values()])
+
+    def _pop_idle(self):
+        """Takes an idle driver of the profile used the least recently out of the pool. Call with the lock held"""
+        for profile, drivers in self._idle.items():
+            if len(drivers) > 0:
+                return drivers.pop(0)
+
+        return None
+
+    def _is_healthy(self, driver):
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, driver):
+        """
+        Clears what the last borrower left in the driver. Returns False if that failed - the driver is then recycled, so
+        that no session or consent state leaks to the next borrower
+        """
+        try:
+            driver.switch_to.default_content()
+            driver.execute_script('try { window.sessionStorage.clear(); } catch (e) {}')
+            driver.get('about:blank')
+            # cookies and storage of all the origins, iframes of other sites included (delete_all_cookies and
+            # window.localStorage only reach the origin of the current page)
+            driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {'origin': '*', 'storageTypes': 'all'})
+            driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)  # an extraction may have set its own
+            network_bytes(driver)  # the next borrower's page loads are counted from here, see PageLoadStats
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+        with self._cond:
+            self._uses.pop(driver, None)
+            self._profiles.pop(driver, None)
+            slot = self._slots.pop(driver, None)
+            self._cond.notify()
+
+        if slot is not None:
+            self._budget.release(slot)
+
+
+_pool = None
+_pool_size = POOL_MAX_SIZE
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Returns the pool of drivers (of all the profiles) shared by everything running in this process"""
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            atexit.register(close_pool)
+            _pool = DriverPool(_pool_size, budget=get_budget())
+
+        return _pool
+
+
+def set_pool_size(max_size):
+    """Sets the maximum number of drivers of the pool"""
+    global _pool_size
+
+    with _pool_lock:
+        _pool_size = max_size
+        pool = _pool
+
+    if pool is not None:
+        pool.resize(max_size)
+
+
+def close_pool():
+    """Quits the drivers of the pool, if there are any (done at exit - call it where atexit hooks do not run)"""
+    with _pool_lock:
+        pool = _pool
+
+    if pool is not None:
+        lg.deflog.info('Closing driver pool: {}'.format(pool.stats()))
+        pool.close()
+        lg.deflog.info('Page loads per profile: {}'.format(page_load_stats.summary()))
+
+
+# ---------------------------------------------------------------------
+# --- Browser worker threads
+# ---------------------------------------------------------------------
+
+_workers = None
+
+
+def set_browser_workers(count):
+    """Sets the maximum number of browser worker threads (i.e. of Selenium extractions running at the same time)"""
+    global BROWSER_WORKERS
+    BROWSER_WORKERS = count
+
+    if _workers is not None:
+        _workers.adjustPoolsize(maxthreads=count)
+
+
+def defer_to_browser_worker(f, *args, **kwargs):
+    """
+    Calls f with the given arguments in the browser worker thread pool, so that blocking Selenium calls do not block
+    the reactor. Must be called from the reactor thread. Returns a Deferred firing with the result of f.
+    """
+    from twisted.internet import reactor
+
+    global _workers
+
+    if _workers is None:
+        _workers = ThreadPool(minthreads=0, maxthreads=BROWSER_WORKERS, name='browser-workers')
+        _workers.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', _workers.stop)
+
+    return threads.deferToThreadPool(reactor, _workers, f, *args, **kwargs)
+
+
 if __name__ == '__main__':
     from selenium import webdriver
     from selenium.webdriver.chrome.options import Options
@@ -60,4 +665,3 @@ if __name__ == '__main__':
     driver.get("http://google.com/")
     print("Headless Chrome Initialized")
     driver.quit()
-
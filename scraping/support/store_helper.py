@@ -0,0 +1,301 @@
+"""
+Helper classes for storing scraped data in bulk.
+
+All the item sinks have the interface of a Mongo collection (the part used here): insert_many(documents) and close().
+So a Mongo collection can be plugged in, and the local sinks (SQLite, Parquet) can stand in for it when working
+offline.
+
+The results store keeps the daily JV count per company scraped by the company-website spiders.
+"""
+
+import atexit
+import collections
+import importlib.util
+import sqlite3
+import threading
+import time
+
+from scraping.support.common import *
+
+
+BACKENDS = ('sqlite', 'parquet', 'mongo', 'timeseries')
+
+
+# ---------------------------------------------------------------------
+# --- Connection pool
+# ---------------------------------------------------------------------
+
+_connections = {}  # path -> [connection, number of users]
+_connections_lock = threading.Lock()
+
+
+def get_sqlite_connection(path):
+    """
+    Returns the connection to the SQLite database at path, shared by all its users in the process. Every call must be
+    paired with release_sqlite_connection
+    """
+    with _connections_lock:
+        if path not in _connections:
+            create_directories_if_necessary(path)
+            connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            _connections[path] = [connection, 0]
+
+        _connections[path][1] += 1
+        return _connections[path][0]
+
+
+def release_sqlite_connection(path):
+    with _connections_lock:
+        _connections[path][1] -= 1
+        if _connections[path][1] == 0:
+            _connections.pop(path)[0].close()
+
+
+# ---------------------------------------------------------------------
+# --- Item sinks
+# ---------------------------------------------------------------------
+
+class SqliteSink:
+    """Stores the documents as rows of a table (one column per field) in a SQLite database"""
+
+    def __init__(self, path, table, fields):
+        self._path = path
+        self._table = table
+        self._fields = fields
+        self._lock = threading.Lock()
+
+        self._connection = get_sqlite_connection(path)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(
+                table, ', '.join(['"{}"'.format(f) for f in fields])))
+
+    def insert_many(self, documents):
+        rows = [[d.get(f) for f in self._fields] for d in documents]
+
+        with self._lock, self._connection:  # one transaction per batch
+            self._connection.executemany('INSERT INTO "{}" VALUES ({})'.format(
+                self._table, ', '.join(['?'] * len(self._fields))), rows)
+
+    def close(self):
+        if self._connection is not None:
+            release_sqlite_connection(self._path)
+            self._connection = None
+
+
+class ParquetSink:
+    """
+    Stores the documents in a Parquet file, each batch as one row group. Values are stored as strings, as the fields
+    may hold error messages instead of values. Needs pyarrow.
+    """
+
+    def __init__(self, path, fields):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        create_directories_if_necessary(path)
+
+        self._pa = pa
+        self._fields = fields
+        self._schema = pa.schema([(f, pa.string()) for f in fields])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def insert_many(self, documents):
+        columns = [[None if d.get(f) is None else str(d.get(f)) for d in documents] for f in self._fields]
+        self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self._schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class MongoSink:
+    """Stores the documents in a Mongo collection. Needs pymongo (whose client keeps a pool of connections)"""
+
+    def __init__(self, uri, database, collection):
+        import pymongo
+
+        self._client = pymongo.MongoClient(uri)
+        self._collection = self._client[database][collection]
+
+    def insert_many(self, documents):
+        self._collection.insert_many(documents, ordered=False)
+
+    def close(self):
+        self._client.close()
+
+
+class TimeSeriesSink:
+    """
+    Appends the documents to the series of source in the time-series store (see timeseries_helper), as counts of
+    key_field for today. Needs pandas and pyarrow.
+    """
+
+    def __init__(self, source, key_field, count_field='count'):
+        import scraping.support.general_helper as general_helper
+        import scraping.support.timeseries_helper as timeseries_helper
+
+        self._timeseries_helper = timeseries_helper
+        self._source = source
+        self._key_field = key_field
+        self._count_field = count_field
+        self._date = general_helper.get_date()
+
+    def insert_many(self, documents):
+        self._timeseries_helper.append(
+            self._source, [(d.get(self._key_field), self._date, d.get(self._count_field)) for d in documents])
+
+    def close(self):
+        pass
+
+
+def open_sink(backend, path, name, fields):
+    """
+    Opens an item sink:
+    - 'sqlite': table `name` in the SQLite database at path
+    - 'parquet': Parquet file at path
+    - 'mongo': collection `name` in database 'jvp' of the Mongo server at path (a mongodb:// uri)
+    - 'timeseries': series `name` of the time-series store, keyed by the first field (path is not used)
+    """
+    if backend == 'sqlite':
+        return SqliteSink(path, name, fields)
+    elif backend == 'parquet':
+        return ParquetSink(path, fields)
+    elif backend == 'mongo':
+        return MongoSink(path, 'jvp', name)
+    elif backend == 'timeseries':
+        return TimeSeriesSink(name, fields[0])
+    else:
+        raise ValueError('Unknown backend {}, use one of {}'.format(backend, BACKENDS))
+
+
+def remove_sink_files(backend, path):
+    """Removes the files of a local (SQLite or Parquet) sink at path, if they exist"""
+    if backend in ('sqlite', 'parquet'):
+        for file_path in (path, path + '-wal', path + '-shm'):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+# ---------------------------------------------------------------------
+# --- Results store
+# ---------------------------------------------------------------------
+
+Result = collections.namedtuple('Result', ['company_name', 'date', 'count', 'err_msg', 'spider'])
+
+
+class SqliteResultsStore:
+    """
+    Daily JV counts per company in a SQLite database. Writes are idempotent - there is one row per (company, date),
+    the last result written wins
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._connection = get_sqlite_connection(path)
+
+        with self._connection:
+            self._connection.execute('''CREATE TABLE IF NOT EXISTS results (
+                company_name TEXT,
+                date TEXT,
+                count INTEGER,
+                err_msg TEXT,
+                spider TEXT,
+                stored_at REAL,
+                PRIMARY KEY (company_name, date)
+            )''')
+
+    def put_many(self, results):
+        rows = [tuple(r) + (time.time(),) for r in results]
+
+        # many processes may be finishing at once - a busy database is retried, on top of the connection's timeout
+        for attempt in range(5):
+            try:
+                with self._connection:  # one transaction for all the results
+                    self._connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)', rows)
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == 4:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def close(self):
+        if self._connection is not None:
+            release_sqlite_connection(self._path)
+            self._connection = None
+
+
+class TimeSeriesResultsStore:
+    """Appends the counts to the series of source in the time-series store (see timeseries_helper)"""
+
+    def __init__(self, source):
+        self._source = source
+
+    def put_many(self, results):
+        import scraping.support.timeseries_helper as timeseries_helper
+
+        timeseries_helper.append(self._source, [(r.company_name, r.date, r.count) for r in results])
+
+
+class BufferedResultsStore:
+    """
+    Buffers results in the process and writes them to the stores in one go - once flush_size (distinct) results are
+    buffered, and when the process ends. Results for the same (company, date) are coalesced, the last one wins
+    """
+
+    def __init__(self, stores, flush_size):
+        self._stores = stores
+        self._flush_size = flush_size
+        self._lock = threading.Lock()
+        self._buffer = collections.OrderedDict()  # (company, date) -> result
+
+    def put(self, company_name, date, count, err_msg, spider):
+        with self._lock:
+            self._buffer[(company_name, date)] = Result(company_name, date, count, err_msg, spider)
+            full = len(self._buffer) >= self._flush_size
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            results, self._buffer = list(self._buffer.values()), collections.OrderedDict()
+
+        if len(results) > 0:
+            for store in self._stores:
+                store.put_many(results)
+
+
+_results_store = None
+_results_store_lock = threading.Lock()
+
+
+def get_results_store(settings):
+    """
+    Returns the (buffered) results store of this process, created with the given (Scrapy) settings on first call.
+    The results go to the SQLite database at RESULTS_STORE_PATH and, if RESULTS_TIMESERIES_SOURCE is set, to that
+    series of the time-series store (if pandas and pyarrow are installed). The buffer is flushed when the reactor
+    stops, and at exit
+    """
+    global _results_store
+
+    with _results_store_lock:
+        if _results_store is None:
+            from twisted.internet import reactor
+
+            stores = [SqliteResultsStore(from_data_root(settings.get('RESULTS_STORE_PATH')))]
+            if settings.get('RESULTS_TIMESERIES_SOURCE'):
+                import scraping.support.log_helper as lg
+
+                if all([importlib.util.find_spec(m) is not None for m in ('pandas', 'pyarrow')]):
+                    stores.append(TimeSeriesResultsStore(settings.get('RESULTS_TIMESERIES_SOURCE')))
+                else:
+                    lg.deflog.warning('pandas or pyarrow is not installed - the results are not appended to the '
+                                      'time-series store')
+
+            _results_store = BufferedResultsStore(stores, settings.getint('RESULTS_FLUSH_SIZE', 100))
+            reactor.addSystemEventTrigger('before', 'shutdown', _results_store.flush)
+            atexit.register(_results_store.flush)
+
+    return _results_store
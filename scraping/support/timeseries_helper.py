@@ -0,0 +1,174 @@
+"""
+Append-only store of the scraped time series (e.g. daily JV counts per company, or per SIC), read by the nowcasting.
+
+The series are kept as Parquet files partitioned by source and month:
+
+    data/timeseries/source=<source>/month=<yyyy-mm>/<part>.parquet
+
+with the (typed) columns key (company name, SIC code, ...), date, count and written_at. Every append writes new small
+files (atomically, so readers never see half a file), which compact() merges per month. A value appended again for
+the same (key, date) replaces the older one when read. Queries read only the partitions of the requested months.
+
+Needs pandas and pyarrow - pyarrow is only imported once Parquet files are read or written.
+"""
+
+import datetime
+import functools
+import glob
+import os
+import uuid
+
+import pandas as pd
+
+from scraping.support.common import *
+
+
+TIMESERIES_FOLDER = 'timeseries/'  # relative to the data folder
+DATE_FORMAT = '%y-%m-%d'  # as in general_helper.get_date
+
+
+@functools.lru_cache(maxsize=1)
+def _pyarrow():
+    """Returns the modules pyarrow, pyarrow.parquet and the schema of the files - imported only when needed"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('key', pa.string()),
+        ('date', pa.date32()),
+        ('count', pa.float64()),
+        ('written_at', pa.timestamp('ms'))
+    ])
+
+    return pa, pq, schema
+
+
+def append(source, rows, folder=None):
+    """
+    Appends the rows - (key, date, count) tuples - to the series of source. Dates can be dates or strings in
+    DATE_FORMAT, counts which are not numbers (e.g. None for failed scrapes) are stored as missing
+    """
+    frame = pd.DataFrame(list(rows), columns=['key', 'date', 'count'])
+    if len(frame) == 0:
+        return
+
+    frame['key'] = frame['key'].astype(str)
+    frame['date'] = _to_dates(frame['date'])
+    frame['count'] = pd.to_numeric(frame['count'], errors='coerce').astype('float64')
+    frame['written_at'] = pd.Timestamp.now().floor('ms')
+
+    frame['month'] = frame['date'].dt.strftime('%Y-%m')
+    frame['date'] = frame['date'].dt.date
+    for month, part in frame.groupby('month'):
+        _write_part(_partition_path(source, month, folder), part.drop(columns='month'))
+
+
+def read_series(source, keys=None, start=None, end=None, folder=None):
+    """
+    Returns the series of source as a DataFrame indexed by date (daily, from start to end), with a float column per
+    key. Only the given keys are read, if any. Days without a value are NaN.
+    """
+    start = None if start is None else pd.Timestamp(start).normalize()
+    end = None if end is None else pd.Timestamp(end).normalize()
+
+    _, pq, schema = _pyarrow()
+    frames = [pq.read_table(p, schema=schema).to_pandas() for p in _part_paths(source, start, end, folder)]
+    frames = [f for f in frames if len(f) > 0]
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=keys or [], index=pd.DatetimeIndex([], name='date'), dtype='float64')
+
+    data = pd.concat(frames, ignore_index=True)
+    data['date'] = pd.to_datetime(data['date'])
+
+    if keys is not None:
+        data = data[data['key'].isin(keys)]
+    if start is not None:
+        data = data[data['date'] >= start]
+    if end is not None:
+        data = data[data['date'] <= end]
+
+    # the last value written for a day wins
+    data = data.sort_values('written_at').drop_duplicates(['key', 'date'], keep='last')
+    series = data.pivot(index='date', columns='key', values='count')
+
+    if len(series) > 0:
+        series = series.reindex(pd.date_range(start if start is not None else series.index.min(),
+                                              end if end is not None else series.index.max(), name='date'))
+    if keys is not None:
+        series = series.reindex(columns=keys)
+
+    series.columns.name = None
+    return series.astype('float64')
+
+
+def compact(source, folder=None):
+    """
+    Merges the files of every month of source into one (keeping only the last value of each key and day). Safe to
+    run while other processes append - files written during the compaction are kept as they are - but not while
+    another compaction of the same source runs.
+    """
+    _, pq, schema = _pyarrow()
+
+    for partition in glob.glob(os.path.join(_source_path(source, folder), 'month=*')):
+        paths = sorted(glob.glob(os.path.join(partition, '*.parquet')))
+        if len(paths) < 2:
+            continue
+
+        data = pd.concat([pq.read_table(p, schema=schema).to_pandas() for p in paths], ignore_index=True)
+        data = data.sort_values('written_at').drop_duplicates(['key', 'date'], keep='last')
+
+        # written before the old files are removed - a reader in between sees duplicates, which it drops
+        _write_part(partition, data.sort_values(['date', 'key']))
+        for path in paths:
+            os.remove(path)
+
+
+def import_csv(path, source, key_column='sic', date_format=DATE_FORMAT, folder=None):
+    """
+    Appends a CSV file with columns date, <key_column> and count (e.g. the mock files of the nowcasting folder)
+    """
+    data = pd.read_csv(path, dtype={key_column: str})
+    data['date'] = pd.to_datetime(data['date'], format=date_format)
+
+    append(source, data[[key_column, 'date', 'count']].itertuples(index=False, name=None), folder)
+
+
+def _to_dates(values):
+    return pd.to_datetime(pd.Series([
+        datetime.datetime.strptime(v, DATE_FORMAT) if isinstance(v, str) else v for v in values
+    ], dtype=object))
+
+
+def _write_part(partition, frame):
+    create_directories_if_necessary(os.path.join(partition, ''))
+
+    name = '{}-{}'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+    tmp_path = os.path.join(partition, '.{}.tmp'.format(name))
+
+    pa, pq, schema = _pyarrow()
+    table = pa.Table.from_pandas(frame[['key', 'date', 'count', 'written_at']], schema=schema, preserve_index=False)
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, os.path.join(partition, '{}.parquet'.format(name)))  # atomic - readers see whole files only
+
+
+def _source_path(source, folder):
+    return os.path.join(folder or from_data_root(TIMESERIES_FOLDER), 'source={}'.format(source))
+
+
+def _partition_path(source, month, folder):
+    return os.path.join(_source_path(source, folder), 'month={}'.format(month))
+
+
+def _part_paths(source, start, end, folder):
+    paths = []
+    for partition in sorted(glob.glob(os.path.join(_source_path(source, folder), 'month=*'))):
+        month = partition[partition.rfind('month=') + len('month='):]
+        if start is not None and month < start.strftime('%Y-%m'):
+            continue
+        if end is not None and month > end.strftime('%Y-%m'):
+            continue
+
+        paths.extend(sorted(glob.glob(os.path.join(partition, '*.parquet'))))
+
+    return paths
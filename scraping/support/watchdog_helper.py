@@ -0,0 +1,177 @@
+"""
+Helper methods for watching the process of a spider (in the super parallel mode, see run.py) together with all its
+children - the Chrome and chromedriver processes included. A spider whose process tree runs past its deadline, or
+uses more memory (RSS) than allowed, is terminated: SIGTERM first, so that it can close gracefully, then SIGKILL for
+whatever is left of the tree after a grace period.
+
+Uses psutil if it is installed, /proc otherwise (Linux only).
+"""
+
+import os
+import signal
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+GRACE_PERIOD = 60  # s between SIGTERM and SIGKILL
+POLL_INTERVAL = 5  # s between checks of the process tree
+
+
+def tree_pids(pid):
+    """Returns the pids of the process and of all its descendants"""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            return [pid] + [child.pid for child in process.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return []
+
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(entry)) as f:
+                    # the process name (2nd field) may contain spaces, the parent's pid is the 2nd field after it
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+
+    pids = [pid] if os.path.exists('/proc/{}'.format(pid)) else []
+    for p in pids:
+        pids.extend(children.get(p, []))
+
+    return pids
+
+
+def tree_rss(pid):
+    """Returns the resident memory (bytes) of the process and all its descendants"""
+    total = 0
+    for p in tree_pids(pid):
+        try:
+            if psutil is not None:
+                total += psutil.Process(p).memory_info().rss
+            else:
+                with open('/proc/{}/statm'.format(p)) as f:
+                    total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except Exception:
+            pass  # the process ended in the meantime
+
+    return total
+
+
+def terminate_tree(pid, grace_period=GRACE_PERIOD):
+    """
+    Sends SIGTERM to the process and its descendants, and SIGKILL to those still alive after the grace period.
+    Descendants are remembered before signalling, so that those which get orphaned (e.g. chromedriver) are reaped too
+    """
+    processes = _identify(tree_pids(pid))
+    _signal_all(processes, signal.SIGTERM)
+
+    deadline = time.time() + grace_period
+    while time.time() < deadline:
+        processes.update(_identify(tree_pids(pid)))
+        processes = {p: started for p, started in processes.items() if _is_alive(p, started)}
+        if len(processes) == 0:
+            return
+        time.sleep(1)
+
+    processes.update(_identify(tree_pids(pid)))
+    _signal_all(processes, signal.SIGKILL)
+
+
+def watch(process, time_limit, max_rss=None, grace_period=GRACE_PERIOD, poll_interval=POLL_INTERVAL):
+    """
+    Waits for the (started) multiprocessing process to end. If it runs for more than time_limit seconds, or its tree
+    uses more than max_rss bytes, the tree is terminated (see terminate_tree).
+
+    Processes of the tree left behind by a process which ended by itself (e.g. browsers not quit) are killed as well.
+
+    Returns None if the process ended by itself, otherwise the reason why it was terminated
+    """
+    started = time.time()
+    descendants = {}  # pid -> its start time
+    while True:
+        process.join(poll_interval)
+        if not process.is_alive():
+            _signal_all(descendants, signal.SIGKILL)
+            return None
+
+        descendants.update(_identify(p for p in tree_pids(process.pid) if p != process.pid))
+
+        reason = None
+        if time.time() - started > time_limit:
+            reason = 'still running after {}s'.format(time_limit)
+        elif max_rss is not None:
+            rss = tree_rss(process.pid)
+            if rss > max_rss:
+                reason = 'using {:.0f} MB, over the limit of {:.0f} MB'.format(rss / 2 ** 20, max_rss / 2 ** 20)
+
+        if reason is not None:
+            terminate_tree(process.pid, grace_period)
+            process.join()
+            return reason
+
+
+def _identify(pids):
+    """
+    Returns dict pid -> start time of the processes, so that they are told apart from processes started later with the
+    same pid (see _is_alive). Processes which already ended are left out
+    """
+    processes = {}
+    for p in pids:
+        started = _start_time(p)
+        if started is not None:
+            processes[p] = started
+
+    return processes
+
+
+def _start_time(pid):
+    """Start time of the process (in an OS-dependent unit), None if there is no such process"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).create_time()
+        except psutil.NoSuchProcess:
+            return None
+
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return int(f.read().rsplit(')', 1)[1].split()[19])  # starttime, the 22nd field
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _signal_all(processes, sig):
+    """Signals the processes (dict pid -> start time) which are still alive - never a process reusing their pid"""
+    for p, started in processes.items():
+        if not _is_alive(p, started):
+            continue
+        try:
+            os.kill(p, sig)
+        except OSError:
+            pass  # already ended
+
+
+def _is_alive(pid, started):
+    """Whether the process started at `started` (see _start_time) is still running, and is not a zombie"""
+    if _start_time(pid) != started:
+        return False  # ended, and its pid is free or taken by another process
+
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'  # zombies are dead, just not reaped by the parent
+    except (OSError, IndexError):
+        pass
+
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        except psutil.NoSuchProcess:
+            return False
+
+    return False
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are imported as scraping.*, from the root of the project (see PYTHONPATH in the README)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,54 @@
+import pytest
+
+import scraping.support.cache_helper as cache_helper
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = cache_helper.LatencyStore(str(tmp_path / 'latencies.sqlite'))
+    monkeypatch.setattr(cache_helper, '_latency_store', store)
+    return store
+
+
+def test_latencies_are_kept_per_key_most_recent_first(store):
+    store.add('a', 1.0)
+    store.add('b', 5.0)
+    store.add('a', 2.0)
+
+    assert store.get('a') == [2.0, 1.0]
+    assert store.get('b') == [5.0]
+    assert store.get('c') == []
+
+
+def test_only_the_last_latencies_are_kept(store, monkeypatch):
+    monkeypatch.setattr(cache_helper.LatencyStore, 'MAX_SAMPLES', 3)
+    for seconds in range(5):
+        store.add('a', float(seconds))
+
+    assert store.get('a') == [4.0, 3.0, 2.0]
+
+
+def test_max_wait_is_used_until_enough_latencies_are_known(store):
+    extractions = pytest.importorskip('scraping.company_website.extractions')
+    timeout = extractions.AdaptiveTimeout('a', max_wait=60)
+
+    for _ in range(timeout.MIN_SAMPLES - 1):
+        timeout.record(1.0)
+    assert timeout.get() == 60
+
+    timeout.record(1.0)
+    assert timeout.get() == timeout.MIN_WAIT  # 3 s is below the minimum
+
+
+def test_timeout_is_p95_latency_with_margin(store):
+    extractions = pytest.importorskip('scraping.company_website.extractions')
+    timeout = extractions.AdaptiveTimeout('a', max_wait=60)
+
+    for _ in range(19):
+        timeout.record(2.0)
+    timeout.record(10.0)
+    assert timeout.get() == 10.0 * timeout.MARGIN  # p95 of 20 latencies is the largest one
+
+    for _ in range(5):
+        timeout.record(30.0)
+    assert timeout.get() == 60  # capped by max_wait
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('selenium')
+pytest.importorskip('twisted')
+
+import scraping.support.selenium_helper as sel_helper
+from test_driver_pool import FakeLauncher
+
+if sel_helper.fcntl is None:
+    pytest.skip('the browser budget needs flock', allow_module_level=True)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(sel_helper, 'BUDGET_POLL_INTERVAL', 0.05)
+
+
+def _budget(tmp_path, slots=1, min_free_mb=0):
+    return sel_helper.BrowserBudget(str(tmp_path) + '/slots/', slots, min_free_mb)
+
+
+def _in_thread(f):
+    got = []
+    thread = threading.Thread(target=lambda: got.append(f()))
+    thread.start()
+    return thread, got
+
+
+def test_acquire_blocks_until_a_slot_is_released(tmp_path):
+    budget = _budget(tmp_path)
+    slot = budget.acquire()
+
+    thread, got = _in_thread(budget.acquire)
+    time.sleep(0.3)
+    assert got == []
+
+    budget.release(slot)
+    thread.join(5)
+    assert len(got) == 1
+    budget.release(got[0])
+
+
+def test_slots_are_shared_by_budgets_of_the_same_folder(tmp_path):
+    slot = _budget(tmp_path).acquire()
+
+    thread, got = _in_thread(_budget(tmp_path).acquire)
+    time.sleep(0.3)
+    assert got == []
+
+    _budget(tmp_path).release(slot)
+    thread.join(5)
+    assert len(got) == 1
+
+
+def test_running_browser_needs_no_free_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(sel_helper, '_available_memory_mb', lambda: 100)
+    budget = _budget(tmp_path, min_free_mb=700)
+
+    slot = budget.acquire(need_memory=False)
+    budget.release(slot)
+
+    thread, got = _in_thread(budget.acquire)
+    time.sleep(0.3)
+    assert got == []  # not enough memory to launch a browser
+
+    monkeypatch.setattr(sel_helper, '_available_memory_mb', lambda: 1000)
+    thread.join(5)
+    assert len(got) == 1
+
+
+def test_idle_drivers_do_not_hold_slots(tmp_path):
+    budget = _budget(tmp_path)
+    pool = sel_helper.DriverPool(max_size=2, launcher=FakeLauncher(), budget=budget)
+
+    driver = pool.checkout()
+    thread, got = _in_thread(pool.checkout)  # launches a second driver once the slot is free
+    time.sleep(0.3)
+    assert got == []
+
+    pool.checkin(driver)
+    thread.join(5)
+    assert len(got) == 1
+
+    pool.checkin(got[0])
+    slot = budget.acquire()  # both drivers idle - the slot is free
+    budget.release(slot)
@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('bs4')
+pytest.importorskip('lxml')
+
+from scrapy.http import HtmlResponse
+
+from scraping.job_board.careerjet import CareerjetJb, extract_companies_lxml, parse_letter_body
+
+
+# cells as on the letter pages, and the ways they can break
+LETTER_PAGE = '''<html><body><div id="heart"><table>
+<tr>
+<td><a href="/acme-jobs.html" title="Acme">Acme</a><br/> 12 jobs</td>
+<td><a href="/beta-jobs.html" title="Béta &amp; Co">Béta</a><!-- count --> 3 jobs</td>
+</tr>
+<tr>
+<td><a href="/gamma-jobs.html">Gamma</a><br/>1 job</td>
+<td><a title="Delta">Delta</a><br/> no jobs</td>
+<td>Epsilon <b>7</b> jobs</td>
+<td><a href="/zeta-jobs.html" title="Zeta">Zeta</a></td>
+</tr>
+</table></div></body></html>'''
+
+
+class FakeQueue:
+    def put(self, item):
+        pass
+
+
+def _normalized(entry):
+    # error messages differ between the parsers, only the kind of the error is compared
+    return {field: value.split(' (')[0] if isinstance(value, str) and '_ERR (' in value else value
+            for field, value in dict(entry).items()}
+
+
+@pytest.fixture
+def response():
+    return HtmlResponse(url='http://www.careerjet.co.uk/jobs/a.html', body=LETTER_PAGE.encode('utf-8'),
+                        encoding='utf-8')
+
+
+def test_lxml_parsing_matches_bs4(response):
+    bs4_data = CareerjetJb(err_queue=FakeQueue())._CareerjetJb__parse_with_bs4(response)
+    lxml_data = extract_companies_lxml(response.selector.root)
+
+    assert [_normalized(entry) for entry in lxml_data] == [_normalized(entry) for entry in bs4_data]
+    assert lxml_data[:2] == [
+        {'company_name': 'Acme', 'link_internal': 'http://www.careerjet.co.uk/acme-jobs.html', 'count': 12},
+        {'company_name': 'Béta & Co', 'link_internal': 'http://www.careerjet.co.uk/beta-jobs.html', 'count': 3}]
+    assert [entry['count'] for entry in lxml_data[2:4]] == [1, 'EXTRACT_COUNT_ERR (no count in \' no jobs\')']
+
+
+def test_body_parsing_matches_the_tree_parsing(response):
+    assert [_normalized(entry) for entry in parse_letter_body(response.body, response.encoding)] == [
+        _normalized(entry) for entry in extract_companies_lxml(response.selector.root)]
@@ -0,0 +1,86 @@
+import logging
+import threading
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('lxml')
+
+import scrapy
+
+import scraping.support.cache_helper as cache_helper
+import scraping.support.selenium_helper as sel_helper
+from scraping.company_website.base_cw_spider import BaseCwSpider
+from scraping.company_website.extractions import SeleniumExtraction
+from test_driver_pool import FakeLauncher
+from test_paginations import _pagination, _response
+
+
+class FakeQueue:
+    def put(self, item):
+        pass
+
+
+class FakeResponse:
+    url = 'https://jobs.example.com/search'
+    meta = {}
+
+
+class FakeCwSpider(BaseCwSpider):
+    name = 'test-cw'
+    use_response_cache = False
+
+
+def _extraction(profile):
+    class CountExtraction(SeleniumExtraction):
+        browser_profile = profile
+
+        def get_count_via_driver(self, driver, response):
+            return 1
+
+    extraction = CountExtraction()
+    extraction.assign_logger(logging.getLogger('test'))
+
+    return extraction
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_helper, '_latency_store', cache_helper.LatencyStore(str(tmp_path / 'latencies.sqlite')))
+    pool = sel_helper.DriverPool(max_size=1, launcher=FakeLauncher())
+    monkeypatch.setattr(sel_helper, '_pool', pool)
+
+    return pool
+
+
+def test_session_is_given_back_before_another_profile_is_borrowed(pool):
+    spider = FakeCwSpider(err_queue=FakeQueue())
+    entries = [{'url': FakeResponse.url, 'extraction': _extraction(profile)}
+               for profile in (sel_helper.DEFAULT_PROFILE, sel_helper.DEFAULT_PROFILE, sel_helper.LEAN_PROFILE)]
+
+    result = []
+    thread = threading.Thread(target=lambda: result.append(spider._extract_entries(FakeResponse(), entries)))
+    thread.daemon = True  # left hanging if it deadlocks
+    thread.start()
+    thread.join(5)
+
+    assert len(result) == 1, 'deadlocked on a pool of one driver'
+    entry_counts, requests = result[0]
+    assert [count for _, count in entry_counts] == [1, 1, 1]
+    assert pool.stats()['launches'] == 2  # the two default entries shared one driver
+
+
+def test_failed_page_hands_its_pagination_slot_on():
+    pagination = _pagination(pages=4, max_fan_out=1)
+    list(pagination.next_url(_response(), None, lambda response: None, count=5))  # page 2 in flight
+    url_info = {'url': 'https://jobs.example.com/?page=1', 'extraction': _extraction(sel_helper.DEFAULT_PROFILE),
+                'pagination': pagination}
+    spider = FakeCwSpider(err_queue=FakeQueue())
+
+    requests = spider._request_failed(scrapy.Request('https://jobs.example.com/?page=2',
+                                                     meta={'cw_entries': [url_info]}), 'Connection refused')
+
+    assert [r.url for r in requests] == ['https://jobs.example.com/?page=3']
+    assert requests[0].errback == spider._errback
+    assert requests[0].meta['cw_entries'] == [url_info]
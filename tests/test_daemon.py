@@ -0,0 +1,67 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('twisted.web')
+
+import scraping.daemon as daemon
+
+
+class FakeJob:
+    def __init__(self, job_id):
+        self.id = job_id
+
+
+def _daemon(tmp_path, monkeypatch):
+    scraping_daemon = daemon.ScrapingDaemon(get_spiders=lambda names: [], spool_folder=str(tmp_path) + '/')
+    submitted = []
+
+    def submit(spec):
+        if spec.get('spiders') == ['unknown']:
+            raise ValueError('No spiders to run for {}'.format(spec['spiders']))
+        submitted.append(spec)
+        return FakeJob('job-{}'.format(len(submitted)))
+
+    monkeypatch.setattr(scraping_daemon, 'submit', submit)
+
+    return scraping_daemon, submitted
+
+
+def _spool(tmp_path, name, spec):
+    with open(str(tmp_path / name), 'w') as f:
+        json.dump(spec, f)
+
+
+def test_spooled_specs_are_submitted_or_set_aside(tmp_path, monkeypatch):
+    scraping_daemon, submitted = _daemon(tmp_path, monkeypatch)
+    _spool(tmp_path, 'a.json', {'spiders': ['cw']})
+    _spool(tmp_path, 'b.json', {'spiders': ['unknown']})
+
+    scraping_daemon.poll_spool()
+
+    assert submitted == [{'spiders': ['cw']}]
+    assert os.listdir(str(tmp_path / 'submitted')) == ['job-1.json']
+    assert os.listdir(str(tmp_path / 'failed')) == ['b.json']
+    assert not (tmp_path / 'a.json').exists()
+
+
+def test_failing_move_neither_raises_nor_submits_twice(tmp_path, monkeypatch):
+    scraping_daemon, submitted = _daemon(tmp_path, monkeypatch)
+    _spool(tmp_path, 'a.json', {'spiders': ['cw']})
+
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        raise PermissionError('Permission denied: {}'.format(src))
+
+    monkeypatch.setattr(daemon.os, 'replace', failing_replace)
+    scraping_daemon.poll_spool()  # must not raise - it would stop the polling LoopingCall
+    scraping_daemon.poll_spool()
+    assert submitted == []
+
+    monkeypatch.setattr(daemon.os, 'replace', replace)
+    scraping_daemon.poll_spool()
+    scraping_daemon.poll_spool()
+    assert submitted == [{'spiders': ['cw']}]
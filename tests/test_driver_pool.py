@@ -0,0 +1,272 @@
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('selenium')
+pytest.importorskip('twisted')
+
+import scraping.support.selenium_helper as sel_helper
+
+
+class FakeDriver:
+    def __init__(self, profile):
+        self.profile = profile
+        self.quit_called = False
+        self.healthy = True
+        self.page_load_timeout = None
+        self.cdp_commands = []
+
+    @property
+    def current_url(self):
+        if not self.healthy:
+            raise Exception('crashed')
+        return 'about:blank'
+
+    @property
+    def switch_to(self):
+        return self
+
+    def default_content(self):
+        pass
+
+    def delete_all_cookies(self):
+        pass
+
+    def execute_script(self, script):
+        pass
+
+    def get(self, url):
+        pass
+
+    def execute_cdp_cmd(self, cmd, args):
+        self.cdp_commands.append(cmd)
+
+    def set_page_load_timeout(self, seconds):
+        self.page_load_timeout = seconds
+
+    def quit(self):
+        self.quit_called = True
+
+
+class FakeLauncher:
+    def __init__(self, fail=0):
+        self.launched = []
+        self._fail = fail
+
+    def __call__(self, profile):
+        if self._fail > 0:
+            self._fail -= 1
+            raise OSError('could not launch')
+
+        driver = FakeDriver(profile)
+        self.launched.append(driver)
+        return driver
+
+
+def test_checked_in_driver_is_reused():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=2, launcher=launcher)
+
+    driver = pool.checkout()
+    pool.checkin(driver)
+
+    assert pool.checkout() is driver
+    assert len(launcher.launched) == 1
+
+
+def test_checkout_blocks_while_pool_is_full():
+    pool = sel_helper.DriverPool(max_size=1, launcher=FakeLauncher())
+    driver = pool.checkout()
+
+    got = []
+    thread = threading.Thread(target=lambda: got.append(pool.checkout()))
+    thread.start()
+    time.sleep(0.2)
+    assert got == []
+
+    pool.checkin(driver)
+    thread.join(5)
+    assert got == [driver]
+
+
+def test_crashed_and_worn_out_drivers_are_recycled():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=1, max_uses=2, launcher=launcher)
+
+    driver = pool.checkout()
+    pool.checkin(driver, crashed=True)
+    assert driver.quit_called
+
+    driver = pool.checkout()
+    pool.checkin(driver)
+    assert pool.checkout() is driver
+    pool.checkin(driver)  # second use - worn out
+    assert driver.quit_called
+
+    assert pool.stats()['recycles'] == 2
+    assert pool.stats()['alive'] == 0
+
+
+def test_unhealthy_idle_driver_is_replaced():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=1, launcher=launcher)
+
+    driver = pool.checkout()
+    pool.checkin(driver)
+    driver.healthy = False
+
+    assert pool.checkout() is not driver
+    assert driver.quit_called
+
+
+def test_failed_launch_wakes_waiting_thread():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=1, launcher=launcher)
+
+    started = threading.Event()
+
+    def _slow_failing_launch(profile):
+        started.set()
+        time.sleep(0.2)
+        raise OSError('could not launch')
+
+    pool._launcher = _slow_failing_launch
+    errors = []
+
+    def _failing_checkout():
+        try:
+            pool.checkout()
+        except OSError as e:
+            errors.append(e)
+
+    failing = threading.Thread(target=_failing_checkout)
+    failing.start()
+    started.wait(5)
+
+    # waits for the place reserved by the failing launch, then launches itself
+    pool._launcher = launcher
+    got = []
+    waiting = threading.Thread(target=lambda: got.append(pool.checkout()))
+    waiting.start()
+
+    failing.join(5)
+    waiting.join(5)
+    assert len(errors) == 1
+    assert got == launcher.launched
+
+
+def test_launch_time_is_not_counted_as_waiting():
+    def _slow_launch(profile):
+        time.sleep(0.3)
+        return FakeDriver(profile)
+
+    pool = sel_helper.DriverPool(max_size=1, launcher=_slow_launch)
+    pool.checkout()
+
+    stats = pool.stats()
+    assert stats['wait_max'] < 0.1
+    assert stats['launch_avg'] >= 0.3
+
+
+def test_close_quits_idle_drivers():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=2, launcher=launcher)
+
+    first, second = pool.checkout(), pool.checkout()
+    pool.checkin(first)
+    pool.close()
+    assert first.quit_called and not second.quit_called
+
+    pool.checkin(second)  # borrowed drivers are quit once returned
+    assert second.quit_called
+
+
+def test_profiles_share_the_pool_size():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=1, launcher=launcher)
+
+    driver = pool.checkout(sel_helper.LEAN_PROFILE)
+    assert driver.profile is sel_helper.LEAN_PROFILE
+
+    got = []
+    thread = threading.Thread(target=lambda: got.append(pool.checkout()))
+    thread.start()
+    time.sleep(0.2)
+    assert got == []  # the lean driver is borrowed - no place for a default one
+
+    pool.checkin(driver)
+    thread.join(5)
+    assert got[0].profile is sel_helper.DEFAULT_PROFILE
+    assert driver.quit_called  # evicted to make room
+    assert pool.stats()['evictions'] == 1
+
+
+def test_least_recently_used_profile_is_evicted():
+    launcher = FakeLauncher()
+    pool = sel_helper.DriverPool(max_size=2, launcher=launcher)
+
+    lean, default = pool.checkout(sel_helper.LEAN_PROFILE), pool.checkout()
+    pool.checkin(lean)
+    pool.checkin(default)
+
+    other = pool.checkout(sel_helper.BrowserProfile('other'))
+    assert lean.quit_called and not default.quit_called
+    pool.checkin(other)
+
+    assert pool.checkout() is default
+
+
+def test_checkin_restores_page_load_timeout():
+    pool = sel_helper.DriverPool(max_size=1, launcher=FakeLauncher())
+
+    driver = pool.checkout()
+    driver.set_page_load_timeout(5)
+    pool.checkin(driver)
+
+    assert driver.page_load_timeout == sel_helper.PAGE_LOAD_TIMEOUT
+
+
+
+
+def test_checkin_clears_cookies_and_storage_of_all_origins():
+    pool = sel_helper.DriverPool(max_size=1, launcher=FakeLauncher())
+
+    driver = pool.checkout()
+    pool.checkin(driver)
+
+    assert driver.cdp_commands == ['Network.clearBrowserCookies', 'Storage.clearDataForOrigin']
+    assert not driver.quit_called
+
+
+def test_driver_which_can_not_be_cleared_is_recycled():
+    pool = sel_helper.DriverPool(max_size=1, launcher=FakeLauncher())
+
+    driver = pool.checkout()
+
+    def _unsupported(cmd, args):
+        raise Exception('unknown command')
+
+    driver.execute_cdp_cmd = _unsupported
+    pool.checkin(driver)
+
+    assert driver.quit_called
+    assert pool.stats()['recycles'] == 1
+
+
+def test_page_load_stats_count_the_bytes_downloaded():
+    def _event(method, **params):
+        return {'message': json.dumps({'message': {'method': method, 'params': params}})}
+
+    driver = FakeDriver(sel_helper.DEFAULT_PROFILE)
+    driver.execute_script = lambda script: [120.0, 2]
+    log = [_event('Network.loadingFinished', encodedDataLength=1000),
+           _event('Network.loadingFailed', errorText='net::ERR_BLOCKED_BY_CLIENT'),  # blocked by the profile
+           _event('Network.loadingFinished', encodedDataLength=24)]
+    driver.get_log = lambda kind: [log.pop(0) for _ in range(len(log))]
+
+    stats = sel_helper.PageLoadStats()
+    assert stats.record(sel_helper.DEFAULT_PROFILE, driver) == (1024, 120.0, 2)
+    assert stats.record(sel_helper.DEFAULT_PROFILE, driver) == (0, 120.0, 2)  # nothing downloaded since
+    assert stats.summary()['default']['kb_avg'] == 0.5
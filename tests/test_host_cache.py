@@ -0,0 +1,43 @@
+import scraping.support.cache_helper as cache_helper
+from scraping.support.cache_helper import HostCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_values_are_stored_per_host(tmp_path):
+    cache = HostCache(str(tmp_path / 'hosts.sqlite'), ttl=60)
+    cache.set('a.com', b'User-agent: *')
+    cache.set('b.com', b'')  # no robots.txt
+
+    assert cache.get('a.com') == b'User-agent: *'
+    assert cache.get('b.com') == b''
+    assert cache.get('c.com') is None
+    assert cache.stats == {'hits': 2, 'misses': 1}
+
+
+def test_values_are_shared_by_caches_of_the_same_file(tmp_path):
+    HostCache(str(tmp_path / 'hosts.sqlite'), ttl=60).set('a.com', '10.0.0.1')
+
+    assert HostCache(str(tmp_path / 'hosts.sqlite'), ttl=60).get('a.com') == '10.0.0.1'
+
+
+def test_values_expire(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_helper.time, 'time', clock)
+    cache = HostCache(str(tmp_path / 'hosts.sqlite'), ttl=60)
+
+    cache.set('a.com', '10.0.0.1')
+    clock.now += 59
+    assert cache.get('a.com') == '10.0.0.1'
+
+    clock.now += 2
+    assert cache.get('a.com') is None
+
+    cache.set('a.com', '10.0.0.2')  # stored again once expired
+    assert cache.get('a.com') == '10.0.0.2'
@@ -0,0 +1,92 @@
+import logging
+import pickle
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('lxml')
+
+from scrapy.http import HtmlResponse
+
+import scraping.support.cache_helper as cache_helper
+from scraping.company_website.extractions import Extraction, HybridExtraction, simple_xpath_regex_extraction
+
+
+class CountingExtraction(Extraction):
+    def __init__(self, extraction):
+        self._extraction = extraction
+        self.calls = 0
+
+    def assign_logger(self, logger):
+        super().assign_logger(logger)
+        self._extraction.assign_logger(logger)
+
+    def get_count_from_response(self, response):
+        self.calls += 1
+        return self._extraction.get_count(response)
+
+
+class JobsExtraction(HybridExtraction):
+    def get_count_via_driver(self, driver, response):
+        return 42
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    store = cache_helper.ExtractionPathStore(str(tmp_path / 'extraction_paths.sqlite'))
+    monkeypatch.setattr(cache_helper, '_extraction_path_store', store)
+    return store
+
+
+def _extraction():
+    static = CountingExtraction(simple_xpath_regex_extraction('//span[@id="total"]/text()', r'(\d+) jobs'))
+    extraction = JobsExtraction(static, key='test.jobs')
+    extraction.assign_logger(logging.getLogger('test'))
+
+    return extraction, static
+
+
+def _response(body):
+    return HtmlResponse(url='https://jobs.example.com/search', body=body, encoding='utf-8')
+
+
+STATIC_PAGE = b'<html><body><span id="total">17 jobs</span></body></html>'
+RENDERED_PAGE = b'<html><body><div id="app"></div></body></html>'
+
+
+def test_static_count_is_used_without_a_browser(store):
+    extraction, static = _extraction()
+    response = _response(STATIC_PAGE)
+
+    assert not extraction.runs_in_browser(response)
+    assert extraction.get_count(response) == 17
+    assert static.calls == 1  # decided once per response
+    assert store.get('test.jobs')[0] == 'static'
+
+
+def test_failing_static_extraction_is_skipped_in_later_runs(store):
+    extraction, static = _extraction()
+    assert extraction.runs_in_browser(_response(RENDERED_PAGE))
+    assert store.get('test.jobs')[0] == 'browser'
+
+    extraction, static = _extraction()  # the next run
+    assert extraction.runs_in_browser(_response(STATIC_PAGE))
+    assert static.calls == 0
+
+
+def test_static_extraction_is_retested_after_a_while(store, monkeypatch):
+    extraction, static = _extraction()
+    extraction.runs_in_browser(_response(RENDERED_PAGE))
+
+    monkeypatch.setattr(JobsExtraction, 'STATIC_RETEST_DAYS', 0)
+    extraction, static = _extraction()
+    assert not extraction.runs_in_browser(_response(STATIC_PAGE))
+    assert store.get('test.jobs')[0] == 'static'
+
+
+def test_response_is_not_pickled():
+    extraction, static = _extraction()
+    extraction.runs_in_browser(_response(STATIC_PAGE))
+
+    assert pickle.loads(pickle.dumps(extraction))._response is None
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+from scrapy.settings import Settings
+
+import scraping.support.store_helper as store_helper
+from scraping.job_board.pipelines import BatchedItemPipeline
+
+FIELDS = ['company_name', 'count']
+
+
+class FakeSpider:
+    name = 'test-jb'
+
+    def __init__(self, resumed=False):
+        self.settings = Settings({'RUN_RESUMED': resumed})
+
+
+class CountingSink:
+    def __init__(self, sink):
+        self._sink = sink
+        self.batches = []
+
+    def insert_many(self, documents):
+        self.batches.append(len(documents))
+        self._sink.insert_many(documents)
+
+    def close(self):
+        self._sink.close()
+
+
+def _rows(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute('SELECT company_name, count FROM "test-jb"').fetchall()
+
+
+def _run(path, items, resumed=False, flush_size=2):
+    pipeline = BatchedItemPipeline('sqlite', path, FIELDS, flush_size)
+    spider = FakeSpider(resumed)
+    pipeline.open_spider(spider)
+    pipeline._sink = sink = CountingSink(pipeline._sink)
+
+    for item in items:
+        pipeline.process_item(item, spider)
+    pipeline.close_spider(spider)
+    pipeline.close()
+
+    return pipeline, sink
+
+
+def test_items_are_written_in_batches(tmp_path):
+    path = str(tmp_path / 'items.sqlite')
+    items = [{'company_name': 'Acme', 'count': 1, 'link_internal': '/acme'}, {'company_name': 'Beta', 'count': 2},
+             {'company_name': 'Gamma', 'count': 'EXTRACT_COUNT_ERR'}]
+
+    pipeline, sink = _run(path, items)
+
+    assert sink.batches == [2, 1]
+    assert pipeline.stored == 3
+    assert _rows(path) == [('Acme', 1), ('Beta', 2), ('Gamma', 'EXTRACT_COUNT_ERR')]
+    assert path not in store_helper._connections  # closing the pipeline released the connection
+
+
+def test_items_of_an_earlier_run_are_kept_only_when_resuming(tmp_path):
+    path = str(tmp_path / 'items.sqlite')
+    _run(path, [{'company_name': 'Acme', 'count': 1}])
+
+    _run(path, [{'company_name': 'Beta', 'count': 2}], resumed=True)
+    assert _rows(path) == [('Acme', 1), ('Beta', 2)]
+
+    _run(path, [{'company_name': 'Gamma', 'count': 3}])
+    assert _rows(path) == [('Gamma', 3)]
+
+
+def test_parquet_sink_stores_values_as_strings(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'items.parquet')
+
+    sink = store_helper.open_sink('parquet', path, 'test-jb', FIELDS)
+    sink.insert_many([{'company_name': 'Acme', 'count': 1}, {'company_name': 'Beta'}])
+    sink.insert_many([{'company_name': 'Gamma', 'count': 'EXTRACT_COUNT_ERR'}])
+    sink.close()
+
+    assert pq.ParquetFile(path).num_row_groups == 2
+    assert pq.read_table(path).to_pydict() == {'company_name': ['Acme', 'Beta', 'Gamma'],
+                                               'count': ['1', None, 'EXTRACT_COUNT_ERR']}
+
+
+def test_unknown_backend_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        store_helper.open_sink('csv', str(tmp_path / 'items.csv'), 'test-jb', FIELDS)
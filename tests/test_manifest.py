@@ -0,0 +1,90 @@
+import pytest
+
+import scraping.support.manifest_helper as manifest_helper
+from scraping.support.manifest_helper import DONE, FAILED, KILLED, PENDING, RUNNING, TIMED_OUT, RunManifest
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return RunManifest(str(tmp_path / 'runs.sqlite'))
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_new_run_has_all_spiders_pending(manifest):
+    run_id = manifest.new_run(['a', 'b'])
+
+    assert manifest.spiders(run_id) == ['a', 'b']
+    assert manifest.spiders(run_id, [PENDING]) == ['a', 'b']
+    assert manifest.get_state(run_id, 'a') == PENDING
+    assert manifest.get_state(run_id, 'c') is None
+
+
+def test_states_are_updated(manifest):
+    run_id = manifest.new_run(['a', 'b', 'c'])
+    manifest.set_state(run_id, 'a', RUNNING)
+    manifest.set_state(run_id, 'a', DONE, 12)
+    manifest.set_state(run_id, 'b', RUNNING)
+    manifest.set_state(run_id, 'b', FAILED, 'timeout')
+
+    assert manifest.spiders(run_id, [PENDING, FAILED]) == ['b', 'c']
+
+    run = {s['spider']: s for s in manifest.get_run(run_id)}
+    assert run['a']['state'] == DONE and run['a']['result'] == '12'
+    assert run['b']['result'] == 'timeout'
+    assert run['c']['started'] is None
+
+
+def test_rerunning_spider_clears_its_result(manifest):
+    run_id = manifest.new_run(['a'])
+    manifest.set_state(run_id, 'a', RUNNING)
+    manifest.set_state(run_id, 'a', FAILED, 'timeout')
+    manifest.set_state(run_id, 'a', RUNNING)
+
+    run = manifest.get_run(run_id)
+    assert run[0]['state'] == RUNNING
+    assert run[0]['result'] is None and run[0]['finished'] is None
+
+
+def test_added_spiders_keep_their_state(manifest):
+    run_id = manifest.new_run(['a'])
+    manifest.set_state(run_id, 'a', RUNNING)
+    manifest.add_spiders(run_id, ['a', 'b'])
+
+    assert manifest.get_state(run_id, 'a') == RUNNING
+    assert manifest.get_state(run_id, 'b') == PENDING
+
+
+def test_durations_of_finished_runs(manifest, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(manifest_helper.time, 'time', clock)
+
+    for run_id, duration in (('1', 10), ('2', 20), ('3', 60)):
+        manifest.add_spiders(run_id, ['a', 'b'])
+        manifest.set_state(run_id, 'a', RUNNING)
+        manifest.set_state(run_id, 'b', RUNNING)
+        clock.now += duration
+        manifest.set_state(run_id, 'a', DONE)
+        manifest.set_state(run_id, 'b', KILLED)  # killed runs say nothing about the duration
+
+    assert manifest.durations(['a', 'b', 'c']) == {'a': 30}
+    assert manifest.durations(['a'], last=2) == {'a': 40}
+
+
+def test_durations_count_runs_finished_with_errors(manifest, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(manifest_helper.time, 'time', clock)
+
+    for run_id, state, duration in (('1', FAILED, 100), ('2', DONE, 50), ('3', TIMED_OUT, 1000)):
+        manifest.add_spiders(run_id, ['a'])
+        manifest.set_state(run_id, 'a', RUNNING)
+        clock.now += duration
+        manifest.set_state(run_id, 'a', state)
+
+    assert manifest.durations(['a']) == {'a': 75}
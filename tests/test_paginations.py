@@ -0,0 +1,95 @@
+import logging
+
+import pytest
+
+pytest.importorskip('scrapy')
+
+import scrapy
+from scrapy.http import HtmlResponse
+
+from scraping.company_website.paginations import PredictablePagination, QueryParamPagination
+
+
+class ListPagination(PredictablePagination):
+    def __init__(self, urls, max_fan_out):
+        super().__init__(max_fan_out=max_fan_out)
+        self._urls = urls
+
+    def get_page_urls(self, response, extraction):
+        return self._urls
+
+
+def _pagination(pages=10, max_fan_out=3):
+    pagination = ListPagination(['https://jobs.example.com/?page={}'.format(i) for i in range(2, pages + 1)],
+                                max_fan_out)
+    pagination.assign_logger(logging.getLogger('test'))
+
+    return pagination
+
+
+def _response(url='https://jobs.example.com/?page=1', body=b'<html></html>'):
+    return HtmlResponse(url=url, body=body, encoding='utf-8')
+
+
+def _callback(response):
+    pass
+
+
+def _urls(requests):
+    return [r.url for r in requests]
+
+
+def test_first_page_fans_out_up_to_the_limit():
+    pagination = _pagination()
+
+    requests = list(pagination.next_url(_response(), None, _callback, count=5))
+
+    assert _urls(requests) == ['https://jobs.example.com/?page={}'.format(i) for i in (2, 3, 4)]
+
+
+def test_each_finished_page_hands_out_one_more():
+    pagination = _pagination()
+    list(pagination.next_url(_response(), None, _callback, count=5))
+
+    requests = list(pagination.next_url(_response('https://jobs.example.com/?page=2'), None, _callback, count=5))
+
+    assert _urls(requests) == ['https://jobs.example.com/?page=5']
+
+
+def test_page_without_results_stops_the_fan_out():
+    pagination = _pagination()
+    list(pagination.next_url(_response(), None, _callback, count=5))
+
+    assert list(pagination.next_url(_response('https://jobs.example.com/?page=2'), None, _callback, count=0)) == []
+    assert list(pagination.next_url(_response('https://jobs.example.com/?page=3'), None, _callback, count=5)) == []
+    assert pagination.page_failed(scrapy.Request('https://jobs.example.com/?page=4'), _callback) == []
+
+
+def test_failed_page_releases_its_slot():
+    pagination = _pagination(pages=6, max_fan_out=2)
+    list(pagination.next_url(_response(), None, _callback, count=5))  # pages 2 and 3 in flight
+
+    requests = pagination.page_failed(scrapy.Request('https://jobs.example.com/?page=2'), _callback)
+    assert _urls(requests) == ['https://jobs.example.com/?page=4']
+
+    requests = pagination.page_failed(scrapy.Request('https://jobs.example.com/?page=3'), _callback)
+    assert _urls(requests) == ['https://jobs.example.com/?page=5']
+
+    requests = list(pagination.next_url(_response('https://jobs.example.com/?page=4'), None, _callback, count=5))
+    assert _urls(requests) == ['https://jobs.example.com/?page=6']
+
+
+def test_failure_of_the_first_page_requests_nothing():
+    pagination = _pagination()
+
+    assert pagination.page_failed(scrapy.Request('https://jobs.example.com/?page=1'), _callback) == []
+
+
+def test_query_param_pagination_derives_the_page_urls():
+    pagination = QueryParamPagination('offset', '//span[@id="total"]/text()', pattern=r'(\d+) jobs', step=20,
+                                      per_page=20)
+    response = _response('https://jobs.example.com/search?q=dev&offset=0',
+                         b'<html><body><span id="total">45 jobs</span></body></html>')
+
+    assert pagination.get_page_urls(response, None) == ['https://jobs.example.com/search?q=dev&offset=20',
+                                                         'https://jobs.example.com/search?q=dev&offset=40']
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('lxml')
+
+from scraping.company_website.registry_spider import RegistryCwSpider
+
+
+def _spider(close_reason='finished'):
+    spider = RegistryCwSpider(err_queue=FakeQueue())
+    spider._close_reason = close_reason
+    for company_name in ('a', 'b', 'c'):
+        spider._totals[company_name] = 0
+
+    spider.stored = {}
+    spider._store_result = lambda company_name, total, err_msg: spider.stored.update({company_name: (total, err_msg)})
+
+    return spider
+
+
+class FakeQueue:
+    def put(self, item):
+        pass
+
+
+def test_company_with_a_failed_page_keeps_its_partial_total():
+    spider = _spider()
+    spider._add_entry_count({'company_name': 'a'}, 5)
+    spider._add_entry_count({'company_name': 'b'}, 3)
+    spider._entry_failed({'company_name': 'b'}, 'timeout')
+    spider._entry_failed({'company_name': 'c'}, 'timeout')
+
+    spider._store_results()
+
+    assert spider.stored == {'a': (5, None), 'b': (3, 'timeout'), 'c': (None, 'timeout')}
+
+
+def test_closing_early_fails_all_companies():
+    spider = _spider(close_reason='terminated')
+    spider._add_entry_count({'company_name': 'a'}, 5)
+    spider._add_entry_count({'company_name': 'b'}, 3)
+    spider._entry_failed({'company_name': 'b'}, 'timeout')
+
+    spider._store_results()
+
+    assert spider.stored['a'] == (None, 'Closed before finishing (terminated)')
+    assert spider.stored['b'] == (None, 'timeout')
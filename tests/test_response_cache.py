@@ -0,0 +1,92 @@
+import collections
+import re
+
+import pytest
+
+import scraping.support.cache_helper as cache_helper
+from scraping.support.cache_helper import ResponseCache
+
+
+class FakeResponse:
+    def __init__(self, body, status=200, headers=None, key=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+        self.meta = {'response_cache_key': key} if key is not None else {}
+
+
+class FakeExtraction:
+    def __init__(self, xpath, pattern=r'(\d+)'):
+        self._xpath = xpath
+        self._pattern = re.compile(pattern)
+        self._logger = object()
+
+    def get_count_from_response(self, response):
+        return 1
+
+
+class OtherExtraction(FakeExtraction):
+    def get_count_from_response(self, response):
+        return 2
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / 'responses.sqlite'), ttl=60, max_bytes=1024 * 1024)
+
+
+def test_result_is_reused_while_the_page_does_not_change(cache):
+    cache.store('k', FakeResponse(b'page', headers={'ETag': b'"v1"'}), [3, 4])
+
+    assert cache.conditional_headers('k') == {'If-None-Match': '"v1"'}
+    assert cache.lookup('k', FakeResponse(b'page')) == [3, 4]
+    assert cache.lookup('k', FakeResponse(b'', status=304)) == [3, 4]
+    assert cache.lookup('k', FakeResponse(b'changed page')) is None
+    assert cache.lookup('other', FakeResponse(b'page')) is None
+
+
+def test_least_recently_used_results_are_evicted(tmp_path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(cache_helper.time, 'time', lambda: next(clock))
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), ttl=60, max_bytes=7)  # two results of 3 bytes fit
+
+    cache.store('a', FakeResponse(b'a'), [1])
+    cache.store('b', FakeResponse(b'b'), [2])
+    cache.lookup('a', FakeResponse(b'a'))
+    cache.store('c', FakeResponse(b'c'), [3])
+
+    assert cache.lookup('a', FakeResponse(b'a')) == [1]
+    assert cache.lookup('b', FakeResponse(b'b')) is None
+    assert cache.lookup('c', FakeResponse(b'c')) == [3]
+
+
+def test_fingerprint_changes_with_the_extraction_specs():
+    def entries(extraction, url='https://a.com/jobs', **extra):
+        return [dict({'url': url, 'extraction': extraction}, **extra)]
+
+    fingerprint = cache_helper.fingerprint(entries(FakeExtraction('//h1')))
+
+    assert cache_helper.fingerprint(entries(FakeExtraction('//h1'))) == fingerprint
+    assert cache_helper.fingerprint(entries(FakeExtraction('//h2'))) != fingerprint
+    assert cache_helper.fingerprint(entries(FakeExtraction('//h1', r'(\d+) jobs'))) != fingerprint
+    assert cache_helper.fingerprint(entries(OtherExtraction('//h1'))) != fingerprint
+    assert cache_helper.fingerprint(entries(FakeExtraction('//h1'), company_name='B')) != fingerprint
+    assert cache_helper.fingerprint(entries(FakeExtraction('//h1')) * 2) != fingerprint
+
+
+def test_cached_result_of_another_length_is_a_miss(cache, monkeypatch):
+    pytest.importorskip('scrapy')
+    pytest.importorskip('twisted')
+    from scrapy.settings import Settings
+    from scraping.base_spider import BaseSpider
+
+    monkeypatch.setattr(cache_helper, 'get_response_cache', lambda settings: cache)
+    spider = BaseSpider.__new__(BaseSpider)
+    spider.settings = Settings()
+    spider._cache_stats = collections.Counter()
+
+    cache.store('k', FakeResponse(b'page'), [3, 4])
+
+    assert spider._cached_result(FakeResponse(b'page', key='k'), size=2) == [3, 4]
+    assert spider._cached_result(FakeResponse(b'page', key='k'), size=3) is None
+    assert spider._cache_stats == {'hits': 1, 'misses': 1}
@@ -0,0 +1,62 @@
+import sqlite3
+
+import scraping.support.store_helper as store_helper
+from scraping.support.store_helper import BufferedResultsStore, Result, SqliteResultsStore
+
+
+class ListStore:
+    def __init__(self):
+        self.batches = []
+
+    def put_many(self, results):
+        self.batches.append(list(results))
+
+
+def _rows(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute(
+            'SELECT company_name, date, count, err_msg, spider FROM results ORDER BY company_name, date').fetchall()
+
+
+def test_last_result_of_the_day_wins(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    store = SqliteResultsStore(path)
+
+    store.put_many([Result('Acme', '2026-10-16', 5, None, 'acme'),
+                    Result('Acme', '2026-10-17', None, 'Timeout', 'acme'),
+                    Result('Beta', '2026-10-17', 3, None, 'beta')])
+    store.put_many([Result('Acme', '2026-10-17', 7, None, 'acme')])
+    store.close()
+
+    assert _rows(path) == [('Acme', '2026-10-16', 5, None, 'acme'), ('Acme', '2026-10-17', 7, None, 'acme'),
+                           ('Beta', '2026-10-17', 3, None, 'beta')]
+
+
+def test_stores_share_and_release_the_connection(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    first, second = SqliteResultsStore(path), SqliteResultsStore(path)
+    assert store_helper._connections[path][1] == 2
+
+    first.close()
+    first.close()  # closing twice releases once
+    second.put_many([Result('Acme', '2026-10-17', 1, None, 'acme')])
+    second.close()
+
+    assert path not in store_helper._connections
+    assert _rows(path) == [('Acme', '2026-10-17', 1, None, 'acme')]
+
+
+def test_buffer_coalesces_and_flushes_when_full():
+    store = ListStore()
+    buffered = BufferedResultsStore([store], flush_size=2)
+
+    buffered.put('Acme', '2026-10-17', 1, None, 'acme')
+    buffered.put('Acme', '2026-10-17', 2, None, 'acme')
+    assert store.batches == []
+
+    buffered.put('Beta', '2026-10-17', 3, None, 'beta')
+    assert store.batches == [[Result('Acme', '2026-10-17', 2, None, 'acme'),
+                              Result('Beta', '2026-10-17', 3, None, 'beta')]]
+
+    buffered.flush()  # nothing buffered, nothing written
+    assert len(store.batches) == 1
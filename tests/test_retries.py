@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('twisted')
+
+import scrapy
+from scrapy.settings import Settings
+
+from scraping.base_spider import BaseSpider
+
+
+class FakeQueue:
+    def put(self, item):
+        pass
+
+
+class FakeSpider(BaseSpider):
+    name = 'fake'
+
+
+def test_retries_and_give_ups_are_counted_per_kind():
+    spider = FakeSpider(err_queue=FakeQueue())
+    spider.settings = Settings({'URL_RETRY_BUDGETS': {'network': 2, 'parse': 0}})
+    request = scrapy.Request('https://example.com/')
+
+    retry = spider._retry_request(request, 'network', 'timeout')
+    retry = spider._retry_request(retry, 'network', 'timeout')
+    assert retry is not None
+    assert spider._retry_request(retry, 'network', 'timeout') is None
+    assert spider._retry_request(request, 'parse', 'no count') is None
+
+    assert spider._retry_summary() == 'retries: 2 (network 2), gave up: 2 (network 1, parse 1)'
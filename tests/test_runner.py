@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('scrapy')
+pytest.importorskip('selenium')
+pytest.importorskip('lxml')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_preloaded_modules_do_not_install_the_reactor():
+    # the modules preloaded by the forkserver of run.py (run.py itself as '__main__'), in a fresh interpreter
+    code = '\n'.join([
+        'import importlib, importlib.util, sys',
+        'import scraping.run as run',
+        'for m in run.FORKSERVER_PRELOAD:',
+        '    if m != "__main__" and importlib.util.find_spec(m.split(".")[0]) is not None:',
+        '        importlib.import_module(m)',
+        'assert "twisted.internet.reactor" not in sys.modules'
+    ])
+
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
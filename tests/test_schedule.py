@@ -0,0 +1,63 @@
+import threading
+import time
+
+from scraping.support.manifest_helper import DONE, RUNNING, RunManifest
+from scraping.support.schedule_helper import DEF_DURATION, SpiderScheduler, estimate_durations, predict_schedule
+
+
+class FakeSpider:
+    def __init__(self, name, browser=False):
+        self.name = name
+        self._browser = browser
+
+    def uses_browser(self):
+        return self._browser
+
+
+def test_longest_spiders_first():
+    spiders = [FakeSpider('a'), FakeSpider('b'), FakeSpider('c')]
+    scheduler = SpiderScheduler(spiders, {'a': 1, 'b': 30, 'c': 10})
+
+    assert [scheduler.next_spider().name for _ in range(3)] == ['b', 'c', 'a']
+    assert scheduler.next_spider() is None
+
+
+def test_browser_spiders_are_capped():
+    spiders = [FakeSpider('a', browser=True), FakeSpider('b', browser=True), FakeSpider('c')]
+    scheduler = SpiderScheduler(spiders, {'a': 30, 'b': 20, 'c': 10}, max_browser=1)
+
+    first = scheduler.next_spider()
+    assert first.name == 'a'
+    assert scheduler.next_spider().name == 'c'  # b waits for a, a shorter spider runs meanwhile
+
+    got = []
+    thread = threading.Thread(target=lambda: got.append(scheduler.next_spider()))
+    thread.start()
+    time.sleep(0.2)
+    assert got == []
+
+    scheduler.spider_finished(first)
+    thread.join(5)
+    assert [s.name for s in got] == ['b']
+
+
+def test_durations_are_estimated_from_earlier_runs(tmp_path):
+    manifest = RunManifest(str(tmp_path / 'runs.sqlite'))
+    spiders = [FakeSpider('a'), FakeSpider('b'), FakeSpider('c'), FakeSpider('new')]
+    assert estimate_durations(spiders, manifest) == {s.name: DEF_DURATION for s in spiders}
+
+    manifest.add_spiders('1', ['a', 'b', 'c'])
+    for name in ('a', 'b', 'c'):
+        manifest.set_state('1', name, RUNNING)
+        manifest.set_state('1', name, DONE)
+
+    durations = estimate_durations(spiders, manifest)
+    assert durations['new'] == sorted(durations[name] for name in ('a', 'b', 'c'))[1]  # the median
+
+
+def test_predicted_schedule_respects_the_browser_cap():
+    spiders = [FakeSpider('a', browser=True), FakeSpider('b', browser=True), FakeSpider('c')]
+    schedule, makespan = predict_schedule(spiders, {'a': 30, 'b': 20, 'c': 10}, workers=2, max_browser=1)
+
+    assert [(name, start, end) for _, name, start, end in schedule] == [('a', 0, 30), ('c', 0, 10), ('b', 30, 50)]
+    assert makespan == 50
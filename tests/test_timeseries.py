@@ -0,0 +1,72 @@
+import datetime
+import glob
+import math
+import os
+import time
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+import scraping.support.timeseries_helper as ts
+
+
+def _parts(folder, source, month):
+    return glob.glob(os.path.join(folder, 'source={}'.format(source), 'month={}'.format(month), '*.parquet'))
+
+
+def test_appended_rows_are_read_as_daily_series(tmp_path):
+    folder = str(tmp_path)
+    ts.append('cw', [('a', '24-01-30', 3), ('b', datetime.date(2024, 1, 31), 4), ('a', '24-02-01', None)], folder)
+
+    series = ts.read_series('cw', folder=folder)
+
+    assert list(series.columns) == ['a', 'b']
+    assert len(series) == 3  # 30 Jan - 1 Feb
+    assert series.loc['2024-01-30', 'a'] == 3
+    assert series.loc['2024-01-31', 'b'] == 4
+    assert math.isnan(series.loc['2024-02-01', 'a'])  # failed scrape
+    assert len(_parts(folder, 'cw', '2024-01')) == 1 and len(_parts(folder, 'cw', '2024-02')) == 1
+
+
+def test_read_series_selects_keys_and_dates(tmp_path):
+    folder = str(tmp_path)
+    ts.append('cw', [('a', '24-01-01', 1), ('a', '24-01-10', 2), ('a', '24-03-01', 3), ('b', '24-01-05', 4)], folder)
+
+    series = ts.read_series('cw', keys=['a', 'c'], start='2024-01-05', end='2024-01-11', folder=folder)
+
+    assert list(series.columns) == ['a', 'c']
+    assert len(series) == 7
+    assert series['a'].dropna().tolist() == [2]
+    assert series['c'].isna().all()
+
+
+def test_last_value_written_wins(tmp_path):
+    folder = str(tmp_path)
+    ts.append('cw', [('a', '24-01-05', 3)], folder)
+    time.sleep(0.01)
+    ts.append('cw', [('a', '24-01-05', 5), ('a', '24-01-06', 6)], folder)
+
+    series = ts.read_series('cw', folder=folder)
+    assert series['a'].tolist() == [5, 6]
+
+
+def test_compact_merges_the_files_of_a_month(tmp_path):
+    folder = str(tmp_path)
+    ts.append('cw', [('a', '24-01-05', 3)], folder)
+    time.sleep(0.01)
+    ts.append('cw', [('a', '24-01-05', 5), ('b', '24-01-05', 1)], folder)
+    assert len(_parts(folder, 'cw', '2024-01')) == 2
+
+    ts.compact('cw', folder)
+
+    assert len(_parts(folder, 'cw', '2024-01')) == 1
+    series = ts.read_series('cw', folder=folder)
+    assert series.loc['2024-01-05'].tolist() == [5, 1]
+
+
+def test_read_empty_series(tmp_path):
+    series = ts.read_series('nothing', keys=['a'], folder=str(tmp_path))
+
+    assert len(series) == 0 and list(series.columns) == ['a']
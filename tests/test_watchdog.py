@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+import scraping.support.watchdog_helper as watchdog_helper
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='needs /proc or psutil on Linux')
+
+# a parent process which prints the pid of its child, both ignoring SIGTERM if asked to
+TREE_SCRIPT = '''
+import signal, subprocess, sys, time
+child = "import signal, time; {ignore}; time.sleep(60)"
+ignore_child, ignore_parent = sys.argv[1] == '1', sys.argv[2] == '1'
+process = subprocess.Popen([sys.executable, '-c', child.format(
+    ignore='signal.signal(signal.SIGTERM, signal.SIG_IGN)' if ignore_child else 'pass')])
+if ignore_parent:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+print(process.pid, flush=True)
+time.sleep(60)
+'''
+
+
+def _start_tree(ignore_child, ignore_parent):
+    parent = subprocess.Popen([sys.executable, '-c', TREE_SCRIPT, str(int(ignore_child)), str(int(ignore_parent))],
+                              stdout=subprocess.PIPE)
+    child_pid = int(parent.stdout.readline())
+
+    return parent, child_pid
+
+
+def _alive(pids):
+    return [p for p, started in watchdog_helper._identify(pids).items() if watchdog_helper._is_alive(p, started)]
+
+
+def test_tree_pids_include_the_children():
+    parent, child_pid = _start_tree(False, False)
+    try:
+        assert watchdog_helper.tree_pids(parent.pid) == [parent.pid, child_pid]
+        assert watchdog_helper.tree_rss(parent.pid) > 0
+    finally:
+        watchdog_helper.terminate_tree(parent.pid, grace_period=5)
+        parent.wait()
+
+
+def test_terminate_tree_ends_processes_willing_to_close():
+    parent, child_pid = _start_tree(False, False)
+
+    started = time.time()
+    watchdog_helper.terminate_tree(parent.pid, grace_period=30)
+    parent.wait()
+
+    assert time.time() - started < 10  # no waiting for the grace period
+    assert _alive([parent.pid, child_pid]) == []
+
+
+def test_terminate_tree_kills_processes_ignoring_sigterm():
+    parent, child_pid = _start_tree(True, True)
+
+    watchdog_helper.terminate_tree(parent.pid, grace_period=1)
+    parent.wait(10)
+
+    time.sleep(0.5)  # the orphaned child may be left a zombie, which counts as dead
+    assert _alive([parent.pid, child_pid]) == []
+
+
+def test_terminate_tree_kills_orphans_left_by_the_parent():
+    parent, child_pid = _start_tree(True, False)  # the parent closes, its child does not
+
+    watchdog_helper.terminate_tree(parent.pid, grace_period=1)
+    parent.wait(10)
+
+    time.sleep(0.5)
+    assert _alive([child_pid]) == []